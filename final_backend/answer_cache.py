@@ -0,0 +1,204 @@
+# answer_cache.py
+
+# Semantic cache of final answers keyed by query-embedding similarity.
+# Evergreen questions ("what is diversification", "explain SIP") are asked over
+# and over; a close enough match returns the stored answer without running
+# the LLM pipeline. Entries expire after a TTL and real-time questions are
+# never stored, since their answers go stale immediately.
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from query_text import looks_realtime, normalize_query
+
+default_cache_path = "./db/answer_cache.sqlite3"
+
+# Follow-ups that lean on the conversation ("tell me more about it", "why is that?") cannot be
+# answered out of context. Ordinary words such as "it" or "this" inside a self-contained question
+# ("is it better to invest via SIP?") do not count; only explicit references back to the chat do.
+CONTEXT_HINTS = re.compile(
+    r"\b(tell me more|more (about|on|details)|elaborate|expand on|what about|how about|the same (for|with)|"
+    r"(the |your )?(above|previous|earlier|last|prior) (answer|response|reply|point|question|message|suggestion|one)|"
+    r"you (just )?(said|mentioned|suggested|recommended)|as (mentioned|discussed)|"
+    r"(explain|say|repeat) (that |this |it )?again|"
+    r"(it|that|this|them|those|these|they|him|her)\s*[?.!]*$)",
+    re.IGNORECASE,
+)
+grow_rows = 256     # Rows added to the embedding buffer each time it fills up
+evict_fraction = 0.1    # Share of entries dropped per eviction pass, so a full cache does not reload on every store
+
+
+def cacheable_query(query: str) -> bool:
+    """Only self-contained, evergreen questions are looked up or stored."""
+    # looks_realtime is a lexical screen, since the LLM real-time verdict is not known before lookup
+    return not looks_realtime(query) and not CONTEXT_HINTS.search(query)
+
+
+class AnswerCache:
+    """
+    SQLite-backed answer store with an in-memory matrix of normalized query embeddings.
+    There is one entry per (namespace, normalized query): storing the same question
+    again replaces its answer and refreshes its expiry.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: str = default_cache_path,
+                 threshold: float = 0.92, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 5000):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(answers)")]
+        if columns and "query_key" not in columns:
+            # Table from before entries were keyed by query; it is only a cache, so start over
+            self._conn.execute("DROP TABLE answers")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT NOT NULL,
+                query_key TEXT NOT NULL,
+                query TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                UNIQUE (namespace, query_key)
+            )"""
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Load unexpired entries into memory, dropping expired ones from disk."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT namespace, query_key, query, answer, vector, expires_at FROM answers ORDER BY id"
+            ).fetchall()
+            self._positions = {(row[0], row[1]): i for i, row in enumerate(rows)}
+            self._namespaces = [row[0] for row in rows]
+            self._queries = [row[2] for row in rows]
+            self._answers = [row[3] for row in rows]
+            self._size = len(rows)
+            self._buffer = (np.vstack([np.frombuffer(row[4], dtype=np.float32) for row in rows])
+                            if rows else None)
+            self._expires_buffer = np.array([row[5] for row in rows], dtype=np.float64)
+
+    @property
+    def _matrix(self) -> Optional[np.ndarray]:
+        return self._buffer[:self._size] if self._size else None
+
+    @property
+    def _expires(self) -> np.ndarray:
+        return self._expires_buffer[:self._size]
+
+    def _append_row(self, vector: np.ndarray, expires_at: float):
+        # Caller holds the lock. The buffers grow by grow_rows at a time instead of a vstack per entry.
+        if self._buffer is None:
+            self._buffer = np.empty((0, len(vector)), dtype=np.float32)
+        if self._size == len(self._buffer):
+            extra = max(grow_rows, self._size // 2)
+            self._buffer = np.vstack([self._buffer, np.empty((extra, self._buffer.shape[1]), dtype=np.float32)])
+            self._expires_buffer = np.concatenate([self._expires_buffer, np.zeros(extra)])
+        self._buffer[self._size] = vector
+        self._expires_buffer[self._size] = expires_at
+        self._size += 1
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query: str, namespace: str = "standard") -> Optional[Dict[str, Any]]:
+        """Return the closest unexpired answer above the threshold, or None."""
+        if not cacheable_query(query):
+            return None
+        q = self._normalize(self.embeddings.embed_query(query))
+        with self._lock:
+            if self._matrix is None:
+                self.misses += 1
+                return None
+            similarities = self._matrix @ q
+            valid = (self._expires > time.time()) & np.array(
+                [ns == namespace for ns in self._namespaces], dtype=bool)
+            similarities = np.where(valid, similarities, -1.0)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {
+                "answer": self._answers[best],
+                "matched_query": self._queries[best],
+                "similarity": float(similarities[best]),
+            }
+
+    def store(self, query: str, answer: str, namespace: str = "standard", ttl_seconds: Optional[float] = None):
+        if not cacheable_query(query):
+            return
+        vector = self._normalize(self.embeddings.embed_query(query))
+        key = normalize_query(query)
+        now = time.time()
+        expires_at = now + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO answers (namespace, query_key, query, answer, vector, created_at, expires_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (namespace, query_key) DO UPDATE SET
+                       query=excluded.query, answer=excluded.answer, vector=excluded.vector,
+                       created_at=excluded.created_at, expires_at=excluded.expires_at""",
+                (namespace, key, query, answer, vector.tobytes(), now, expires_at),
+            )
+            self._conn.commit()
+            position = self._positions.get((namespace, key))
+            if position is not None:
+                self._queries[position] = query
+                self._answers[position] = answer
+                self._buffer[position] = vector
+                self._expires_buffer[position] = expires_at
+            else:
+                self._positions[(namespace, key)] = self._size
+                self._namespaces.append(namespace)
+                self._queries.append(query)
+                self._answers.append(answer)
+                self._append_row(vector, expires_at)
+            overflow = self._size > self.max_entries
+        if overflow:
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently stored entries beyond max_entries."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY created_at DESC LIMIT ?)",
+                (int(self.max_entries * (1 - evict_fraction)),),
+            )
+            self._conn.commit()
+        self._load()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+        self._load()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size,
+        }
@@ -0,0 +1,2 @@
+# Offline benchmarks for the financial assistant backend.
+# Run from final_backend/, e.g. `python -m benchmarks.ingest_bench --help`.
@@ -0,0 +1,40 @@
+# benchmarks/fake_embeddings.py
+
+# Deterministic stand-in for OllamaEmbeddings so benchmarks run without a
+# model server. Identical texts always map to identical unit vectors.
+import hashlib
+import math
+import time
+from typing import List
+from langchain_core.embeddings import Embeddings
+
+
+class DeterministicEmbeddings(Embeddings):
+    """Hash-based embeddings with an optional simulated per-text latency."""
+
+    def __init__(self, dim: int = 768, latency_per_text: float = 0.0):
+        self.dim = dim
+        self.latency_per_text = latency_per_text
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def _vector(self, text: str) -> List[float]:
+        values = []
+        counter = 0
+        while len(values) < self.dim:
+            digest = hashlib.sha256(f"{counter}\x00{text}".encode("utf-8")).digest()
+            values.extend((byte - 127.5) / 127.5 for byte in digest)
+            counter += 1
+        values = values[:self.dim]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        if self.latency_per_text:
+            time.sleep(self.latency_per_text * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
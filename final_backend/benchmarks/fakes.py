@@ -0,0 +1,271 @@
+# benchmarks/fakes.py
+
+# Offline stand-ins for the external services the query pipeline calls: the
+# Groq/Ollama models handed out by vars.get_llm_provider (LangChain and Agno
+# flavours), agno's Agent, TavilyClient and YFinanceTools. Responses come from
+# recorded fixtures (benchmarks/fixtures/pipeline.json): each model call is
+# matched against ordered regex rules on its prompt, and every call sleeps for a
+# configurable latency so stage timings resemble production. All calls are
+# counted per model and rule. install() patches the fakes in; it must run before
+# run.py, router.py, deep_research.py or ingest.py is imported.
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from context_budget import count_tokens
+
+default_fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pipeline.json")
+stream_chunk_words = 4      # Words per streamed chunk, roughly what Groq sends
+
+
+def load_fixtures(path: str = default_fixtures_path) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        fixtures = json.load(f)
+    for rule in fixtures["llm_rules"]:
+        rule["pattern"] = re.compile(rule["match"], re.DOTALL | re.IGNORECASE)
+    return fixtures
+
+
+class CallRecorder:
+    """Thread-safe counters of model and tool calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.llm_calls: Counter = Counter()     # (model id, rule) -> calls
+        self.tool_calls: Counter = Counter()    # tool name -> calls
+        self.tokens: Counter = Counter()        # "input" / "output" -> tokens
+
+    def llm(self, model_id: str, rule: str, input_tokens: int, output_tokens: int):
+        with self._lock:
+            self.llm_calls[(model_id, rule)] += 1
+            self.tokens["input"] += input_tokens
+            self.tokens["output"] += output_tokens
+
+    def tool(self, name: str):
+        with self._lock:
+            self.tool_calls[name] += 1
+
+    def reset(self):
+        with self._lock:
+            self.llm_calls.clear()
+            self.tool_calls.clear()
+            self.tokens.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            by_rule: Counter = Counter()
+            by_model: Counter = Counter()
+            for (model_id, rule), calls in self.llm_calls.items():
+                by_rule[rule] += calls
+                by_model[model_id] += calls
+            return {
+                "llm_calls": sum(self.llm_calls.values()),
+                "llm_calls_by_rule": dict(sorted(by_rule.items())),
+                "llm_calls_by_model": dict(sorted(by_model.items())),
+                "tool_calls": dict(sorted(self.tool_calls.items())),
+                "tokens": dict(self.tokens),
+            }
+
+
+recorder = CallRecorder()
+
+
+class FakeLLM:
+    """Fixture-backed model. The same object serves as the Agno model given to FakeAgent."""
+
+    def __init__(self, model_id: str, fixtures: Dict[str, Any], latency_scale: float = 1.0):
+        self.id = model_id
+        self.fixtures = fixtures
+        latency = fixtures["latency"]["llm"]
+        profile = dict(latency["default"], **latency.get(model_id, {}))
+        self.first_token_seconds = profile["first_token_seconds"] * latency_scale
+        self.seconds_per_token = profile["seconds_per_output_token"] * latency_scale
+
+    def respond(self, prompt: str) -> Tuple[str, str, int, int]:
+        """(rule name, response text, input tokens, output tokens); records the call but does not sleep."""
+        for rule in self.fixtures["llm_rules"]:
+            if rule["pattern"].search(prompt):
+                name, text = rule["name"], rule["response"]
+                break
+        else:
+            name, text = "default", self.fixtures["default_response"]
+        input_tokens, output_tokens = count_tokens(prompt), count_tokens(text)
+        recorder.llm(self.id, name, input_tokens, output_tokens)
+        return name, text, input_tokens, output_tokens
+
+    def latency(self, output_tokens: int) -> float:
+        return self.first_token_seconds + self.seconds_per_token * output_tokens
+
+    def complete(self, prompt: str) -> Tuple[str, int, int]:
+        _, text, input_tokens, output_tokens = self.respond(prompt)
+        time.sleep(self.latency(output_tokens))
+        return text, input_tokens, output_tokens
+
+    async def acomplete(self, prompt: str) -> Tuple[str, int, int]:
+        _, text, input_tokens, output_tokens = self.respond(prompt)
+        await asyncio.sleep(self.latency(output_tokens))
+        return text, input_tokens, output_tokens
+
+
+class FakeChatModel(BaseChatModel):
+    """LangChain chat model over a FakeLLM, usable in `prompt | llm | parser` chains."""
+
+    llm: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "offline-fixture"
+
+    @staticmethod
+    def _prompt(messages: List[BaseMessage]) -> str:
+        return "\n".join(str(m.content) for m in messages)
+
+    @staticmethod
+    def _result(text: str, input_tokens: int, output_tokens: int) -> ChatResult:
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self._result(*self.llm.complete(self._prompt(messages)))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self._result(*await self.llm.acomplete(self._prompt(messages)))
+
+
+class FakeRunResponse:
+    def __init__(self, content: str, input_tokens: int = 0, output_tokens: int = 0,
+                 tools: Optional[List[Dict[str, Any]]] = None, event: str = "RunResponse"):
+        self.content = content
+        self.event = event
+        self.metrics = {"input_tokens": [input_tokens], "output_tokens": [output_tokens]}
+        self.tools = tools or []
+
+
+class FakeAgent:
+    """Replaces agno.agent.Agent: optional tool round (one model call, then each tool), then the answer."""
+
+    def __init__(self, model: FakeLLM = None, description: str = "", tools: Optional[list] = None, **kwargs):
+        self.model = model
+        self.description = description or ""
+        self.tools = tools or []
+        self.run_response: Optional[FakeRunResponse] = None
+
+    def _tool_round(self, message: str) -> Tuple[str, List[Dict[str, Any]], int, int]:
+        if not self.tools:
+            return "", [], 0, 0
+        _, input_tokens, output_tokens = self.model.complete(f"Choose tool calls for: {message}")
+        outputs, records = [], []
+        for tool in self.tools:
+            if hasattr(tool, "fake_call"):
+                outputs.append(tool.fake_call(message))
+                records.append({"tool_name": tool.name})
+            elif callable(tool):
+                # Function tools (e.g. run.py's web_search) are called with the message as the query
+                outputs.append(str(tool(message)))
+                records.append({"tool_name": tool.__name__})
+        return "\n\nTool output:\n" + "\n".join(outputs), records, input_tokens, output_tokens
+
+    def run(self, message: str, stream: bool = False, chat_history: Any = None, **kwargs):
+        tool_text, tool_records, tool_in, tool_out = self._tool_round(message)
+        prompt = f"{self.description}\n\n{message}{tool_text}"
+        if stream:
+            return self._stream(prompt, tool_records, tool_in, tool_out)
+        text, input_tokens, output_tokens = self.model.complete(prompt)
+        self.run_response = FakeRunResponse(text, tool_in + input_tokens, tool_out + output_tokens, tool_records)
+        return self.run_response
+
+    def _stream(self, prompt: str, tool_records, tool_in: int, tool_out: int) -> Iterator[FakeRunResponse]:
+        _, text, input_tokens, output_tokens = self.model.respond(prompt)
+        time.sleep(self.model.first_token_seconds)
+        words = text.split(" ")
+        per_word = self.model.seconds_per_token * output_tokens / max(len(words), 1)
+        for i in range(0, len(words), stream_chunk_words):
+            piece = " ".join(words[i:i + stream_chunk_words]) + (" " if i + stream_chunk_words < len(words) else "")
+            time.sleep(per_word * len(words[i:i + stream_chunk_words]))
+            yield FakeRunResponse(piece)
+        self.run_response = FakeRunResponse(text, tool_in + input_tokens, tool_out + output_tokens,
+                                            tool_records, event="RunCompleted")
+        yield self.run_response
+
+
+class FakeTavilyClient:
+    name = "TavilySearch"
+
+    def __init__(self, api_key: Optional[str] = None, **kwargs):
+        self.fixtures = _installed["fixtures"]
+        self.seconds = self.fixtures["latency"]["tavily_seconds"] * _installed["latency_scale"]
+
+    def search(self, query: str, search_depth: str = "basic", max_results: int = 5, **kwargs) -> Dict[str, Any]:
+        recorder.tool("tavily")
+        time.sleep(self.seconds * (2 if search_depth == "advanced" else 1))
+        return {"query": query, "results": self.fixtures["tavily"]["results"][:max_results]}
+
+    def fake_call(self, message: str) -> str:
+        return json.dumps(self.search(message))
+
+
+class FakeYFinanceTools:
+    name = "YFinanceTools"
+
+    def __init__(self, **kwargs):
+        self.fixtures = _installed["fixtures"]
+        self.seconds = self.fixtures["latency"]["yfinance_seconds"] * _installed["latency_scale"]
+
+    def get_current_stock_price(self, symbol: str) -> str:
+        recorder.tool("yfinance")
+        time.sleep(self.seconds)
+        return self.fixtures["yfinance"].get(symbol.upper(), self.fixtures["yfinance"]["default"])
+
+    def fake_call(self, message: str) -> str:
+        return self.get_current_stock_price("default")
+
+
+class FakeModels:
+    """Replaces models.Models for ingest.py / run.py."""
+
+    def __init__(self):
+        from benchmarks.fake_embeddings import DeterministicEmbeddings
+        self.embeddings_ollama = DeterministicEmbeddings(
+            dim=768, latency_per_text=_installed["fixtures"]["latency"]["embed_seconds_per_text"] * _installed["latency_scale"])
+        self.model_ollama = fake_get_llm_provider("llama3.2:latest", framework="langchain")
+
+
+_installed: Dict[str, Any] = {"fixtures": None, "latency_scale": 1.0, "models": {}}
+
+
+def fake_get_llm_provider(model_id, framework="agno"):
+    key = (model_id, framework)
+    if key not in _installed["models"]:
+        llm = FakeLLM(model_id, _installed["fixtures"], _installed["latency_scale"])
+        _installed["models"][key] = llm if framework == "agno" else FakeChatModel(llm=llm)
+    return _installed["models"][key]
+
+
+def install(fixtures: Dict[str, Any], latency_scale: float = 1.0):
+    """Patch the fakes into the modules the pipeline imports them from."""
+    _installed.update(fixtures=fixtures, latency_scale=latency_scale, models={})
+    os.environ.setdefault("TAVILY_API_KEY", "offline-benchmark")
+    os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+
+    import vars
+    import models
+    import tavily
+    import agno.agent
+    import agno.tools.yfinance
+    vars.get_llm_provider = fake_get_llm_provider
+    models.Models = FakeModels
+    tavily.TavilyClient = FakeTavilyClient
+    agno.agent.Agent = FakeAgent
+    agno.tools.yfinance.YFinanceTools = FakeYFinanceTools
@@ -0,0 +1,177 @@
+# benchmarks/ingest_bench.py
+
+# Ingestion throughput benchmark. Generates synthetic PDF and text corpora,
+# runs them through ingest.ingest_file with a deterministic local embedder and
+# a throwaway Chroma directory, and reports parse / split / embed / store time,
+# chunk statistics and peak RSS. Results are written as sorted, indented JSON
+# so two runs can be diffed directly or compared with --compare.
+#
+# Usage (from final_backend/):
+#   python -m benchmarks.ingest_bench --docs 20 --pages 10 --out bench_ingest.json
+#   python -m benchmarks.ingest_bench --chunk-size 800 --compare bench_ingest.json
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Any
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fields that must match exactly between runs; anything else is a timing/memory metric
+EXACT_FIELDS = ["docs", "chunks", "chunks_skipped", "chunk_fingerprint", "mean_chunk_chars"]
+METRIC_FIELDS = ["parse_seconds", "split_seconds", "embed_seconds", "store_seconds",
+                 "wall_seconds", "peak_rss_mb"]
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one benchmark case in the current process (called inside a fresh subprocess)."""
+    from benchmarks.fake_embeddings import DeterministicEmbeddings
+    from benchmarks import synthetic
+
+    if case["kind"] == "pdf":
+        paths = synthetic.generate_pdfs("data", case["docs"], case["pages"], seed=case["seed"])
+    else:
+        paths = synthetic.generate_texts("data", case["docs"], case["paragraphs"], seed=case["seed"])
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Keep ingest's progress output off stdout, which carries the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        import ingest
+        ingest.chunk_size = case["chunk_size"]
+        ingest.chunk_overlap = case["chunk_overlap"]
+        ingest.embeddings = DeterministicEmbeddings(dim=case["dim"], latency_per_text=case["embed_latency"])
+        if case["streaming"] == "on":
+            ingest.stream_min_bytes = 0
+        elif case["streaming"] == "off":
+            ingest.stream_min_bytes = float("inf")
+
+        stats = ingest.IngestStats()
+        start = time.perf_counter()
+        for path in paths:
+            ingest.ingest_file(path, stats, batch_size=case["batch_size"])
+        stats.wall_seconds = time.perf_counter() - start
+
+        stored = ingest.vector_store._collection.get(include=["documents"])
+
+    ids = sorted(stored["ids"])
+    lengths = [len(doc) for doc in stored["documents"]]
+    return {
+        "docs": stats.docs,
+        "chunks": stats.chunks,
+        "chunks_skipped": stats.chunks_skipped,
+        # Changes whenever chunk boundaries or content change
+        "chunk_fingerprint": hashlib.sha256("\n".join(ids).encode()).hexdigest()[:16],
+        "mean_chunk_chars": round(sum(lengths) / len(lengths), 1) if lengths else 0,
+        "parse_seconds": round(stats.parse_seconds, 4),
+        "split_seconds": round(stats.split_seconds, 4),
+        "embed_seconds": round(stats.embed_seconds, 4),
+        "store_seconds": round(stats.store_seconds, 4),
+        "wall_seconds": round(stats.wall_seconds, 4),
+        "docs_per_sec": round(stats.docs / stats.wall_seconds, 2) if stats.wall_seconds else 0,
+        "chunks_per_sec": round(stats.chunks / stats.wall_seconds, 2) if stats.wall_seconds else 0,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "ingest_rss_delta_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+    }
+
+
+def run_case_isolated(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a case in a fresh interpreter and temporary working directory so peak RSS is per case."""
+    with tempfile.TemporaryDirectory(prefix="ingest_bench_") as workdir:
+        env = dict(os.environ, PYTHONPATH=BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.ingest_bench", "--run-case", json.dumps(case)],
+            cwd=workdir, env=env, stdout=subprocess.PIPE, check=True, text=True,
+        )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], tolerance: float, min_delta: float) -> int:
+    """Print differences between two result files. Returns the number of regressions."""
+    regressions = 0
+    for name, new_case in new["cases"].items():
+        old_case = old.get("cases", {}).get(name)
+        if old_case is None:
+            print(f"[{name}] new case")
+            continue
+        for field in EXACT_FIELDS:
+            if old_case.get(field) != new_case.get(field):
+                print(f"[{name}] CHANGED {field}: {old_case.get(field)} -> {new_case.get(field)}")
+                regressions += 1
+        for field in METRIC_FIELDS:
+            before, after = old_case.get(field, 0), new_case.get(field, 0)
+            if before and after > before * (1 + tolerance) and after - before > min_delta:
+                print(f"[{name}] REGRESSION {field}: {before} -> {after} (+{(after / before - 1):.0%})")
+                regressions += 1
+            elif before:
+                print(f"[{name}] {field}: {before} -> {after} ({(after / before - 1):+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest.py with synthetic corpora.")
+    parser.add_argument("--docs", type=int, default=10, help="PDF documents to generate")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per PDF")
+    parser.add_argument("--text-docs", type=int, default=10, help="Text documents to generate")
+    parser.add_argument("--paragraphs", type=int, default=200, help="Paragraphs per text document")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts per embedding call")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension (nomic-embed-text is 768)")
+    parser.add_argument("--embed-latency", type=float, default=0.0,
+                        help="Simulated embedding seconds per text")
+    parser.add_argument("--streaming", choices=["auto", "on", "off"], default="auto")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare against an earlier results file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown before --compare reports a regression")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many seconds (or MB) as noise")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case)), sort_keys=True))
+        return
+
+    common = {
+        "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap,
+        "batch_size": args.batch_size, "dim": args.dim, "embed_latency": args.embed_latency,
+        "streaming": args.streaming, "seed": args.seed,
+    }
+    cases = {
+        "pdf": dict(common, kind="pdf", docs=args.docs, pages=args.pages),
+        "text": dict(common, kind="text", docs=args.text_docs, paragraphs=args.paragraphs),
+    }
+    results = {"config": common, "cases": {}}
+    for name, case in cases.items():
+        if not case["docs"]:
+            continue
+        print(f"Running case '{name}'...", file=sys.stderr)
+        results["cases"][name] = dict(run_case_isolated(case), docs_requested=case["docs"])
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"{regressions} regression(s) against {args.compare}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# benchmarks/pipeline_bench.py
+
+# Offline end-to-end benchmark of the query pipeline (run.process_query_flow).
+# The Groq/Ollama models, agno Agents, Tavily and YFinance are replaced by the
+# fixture-backed fakes in benchmarks/fakes.py (with artificial latency), and the
+# knowledge base is a throwaway Chroma collection built from the fixture
+# documents with the deterministic embedder. A query set (docs/query.md by
+# default) is replayed through the standard and deep research paths at each
+# concurrency level. Reported per case: request latency p50/p95, time to first
+# answer token, throughput, per-stage p50/p95 from the request traces, and model
+# / tool call counts. Results are sorted, indented JSON like ingest_bench.
+#
+# Usage (from final_backend/):
+#   python -m benchmarks.pipeline_bench --concurrency 1 4 --out bench_pipeline.json
+#   python -m benchmarks.pipeline_bench --modes standard --latency-scale 0   # framework overhead only
+#   python -m benchmarks.pipeline_bench --compare bench_pipeline.json
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_queries_path = os.path.join(BACKEND_DIR, "docs", "query.md")
+
+# Fields that must match exactly between runs; anything else is a timing metric
+EXACT_FIELDS = ["llm_calls_per_query", "tool_calls"]
+METRIC_FIELDS = ["latency_p50_seconds", "latency_p95_seconds", "first_token_p50_seconds", "wall_seconds"]
+
+
+def load_queries(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_pipeline(fixtures: Dict[str, Any], latency_scale: float, answer_cache: bool,
+                   kb_docs: int, paragraphs: int, search_cache: bool = True):
+    """Install the fakes, ingest the knowledge base and import run.py. Call from the scratch directory."""
+    from benchmarks import fakes, synthetic
+    fakes.install(fixtures, latency_scale)
+    import vars
+    vars.RETRIEVAL_BACKEND = "chroma"
+    vars.TRACING_ENABLED = False        # Traces are still returned with each result
+    vars.ANSWER_CACHE_ENABLED = answer_cache
+    vars.SEARCH_CACHE_ENABLED = search_cache    # Starts empty in the scratch directory
+
+    import ingest
+    os.makedirs("data", exist_ok=True)
+    paths = []
+    for doc in fixtures["knowledge_base"]:
+        path = os.path.join("data", doc["name"])
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(doc["text"])
+        paths.append(path)
+    if kb_docs:
+        paths += synthetic.generate_texts("data", kb_docs, paragraphs, seed=0)
+    stats = ingest.IngestStats()
+    for path in paths:
+        ingest.ingest_file(path, stats)
+
+    import run
+    return run
+
+
+def run_case(run, queries: List[str], deep: bool, concurrency: int) -> Dict[str, Any]:
+    from langchain_core.chat_history import InMemoryChatMessageHistory
+    from benchmarks import fakes
+    from conversation_memory import RollingSummaryMemory
+    from tracing import percentile, stage_stats
+    from vars import get_llm_id
+
+    summary_llm = fakes.fake_get_llm_provider(get_llm_id("remote"), framework="langchain")
+    warnings.filterwarnings("ignore", message=".*InMemoryChatMessageHistory.*")
+
+    def one(query: str) -> Dict[str, Any]:
+        # Each request is a fresh conversation, as for a new user
+        memory = RollingSummaryMemory(InMemoryChatMessageHistory(), llm=summary_llm)
+        first_token: List[float] = []
+        start = time.perf_counter()
+        result = run.process_query_flow(
+            query, memory, deep_search=deep,
+            token_callback=lambda token: first_token or first_token.append(time.perf_counter()),
+        )
+        end = time.perf_counter()
+        return {
+            "seconds": end - start,
+            "first_token_seconds": first_token[0] - start if first_token else None,
+            "trace": result.get("trace", {}),
+            "degraded": result.get("answer", "").startswith("Sorry"),
+        }
+
+    fakes.recorder.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, queries))
+    wall = time.perf_counter() - start
+    calls = fakes.recorder.snapshot()
+
+    latencies = sorted(s["seconds"] for s in samples)
+    first_tokens = sorted(s["first_token_seconds"] for s in samples if s["first_token_seconds"] is not None)
+    return {
+        "requests": len(samples),
+        "degraded_answers": sum(s["degraded"] for s in samples),
+        "wall_seconds": round(wall, 4),
+        "throughput_qps": round(len(samples) / wall, 3) if wall else 0,
+        "latency_p50_seconds": round(percentile(latencies, 0.50), 4),
+        "latency_p95_seconds": round(percentile(latencies, 0.95), 4),
+        "latency_max_seconds": round(latencies[-1], 4),
+        "first_token_p50_seconds": round(percentile(first_tokens, 0.50), 4) if first_tokens else None,
+        "stages_ms": {name: {k: round(v, 2) for k, v in s.items()}
+                      for name, s in stage_stats([s["trace"] for s in samples]).items()},
+        "llm_calls_per_query": round(calls["llm_calls"] / len(samples), 2),
+        "llm_calls_by_rule": calls["llm_calls_by_rule"],
+        "llm_calls_by_model": calls["llm_calls_by_model"],
+        "tool_calls": calls["tool_calls"],
+        "tokens": calls["tokens"],
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], tolerance: float, min_delta: float) -> int:
+    """Print differences between two result files. Returns the number of regressions."""
+    regressions = 0
+    for name, new_case in new["cases"].items():
+        old_case = old.get("cases", {}).get(name)
+        if old_case is None:
+            print(f"[{name}] new case")
+            continue
+        for field in EXACT_FIELDS:
+            if old_case.get(field) != new_case.get(field):
+                print(f"[{name}] CHANGED {field}: {old_case.get(field)} -> {new_case.get(field)}")
+                regressions += 1
+        for field in METRIC_FIELDS:
+            before, after = old_case.get(field) or 0, new_case.get(field) or 0
+            if before and after > before * (1 + tolerance) and after - before > min_delta:
+                print(f"[{name}] REGRESSION {field}: {before} -> {after} (+{(after / before - 1):.0%})")
+                regressions += 1
+            elif before:
+                print(f"[{name}] {field}: {before} -> {after} ({(after / before - 1):+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark run.process_query_flow offline with recorded fakes.")
+    parser.add_argument("--queries", default=default_queries_path, help="File with one query per line")
+    parser.add_argument("--fixtures", help="Fixture file (default benchmarks/fixtures/pipeline.json)")
+    parser.add_argument("--modes", nargs="+", choices=["standard", "deep"], default=["standard", "deep"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4],
+                        help="Concurrent requests per case (one case per value)")
+    parser.add_argument("--repeat", type=int, default=2, help="Times the query set is replayed per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed requests per mode before measuring")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Multiplier on all fixture latencies (0 measures pipeline overhead only)")
+    parser.add_argument("--kb-docs", type=int, default=0, help="Extra synthetic documents in the knowledge base")
+    parser.add_argument("--paragraphs", type=int, default=50, help="Paragraphs per synthetic document")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Keep the semantic answer cache on (repeats then measure cache hits)")
+    parser.add_argument("--no-search-cache", action="store_true",
+                        help="Turn the Tavily search cache off (every search then reaches the fake Tavily)")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's console output on stderr")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare against an earlier results file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown before --compare reports a regression")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many seconds as noise")
+    args = parser.parse_args()
+
+    # Paths are resolved before moving into the scratch directory
+    sys.path.insert(0, BACKEND_DIR)
+    from benchmarks import fakes
+    fixtures = fakes.load_fixtures(os.path.abspath(args.fixtures) if args.fixtures else fakes.default_fixtures_path)
+    queries = load_queries(os.path.abspath(args.queries))
+    out_path = os.path.abspath(args.out) if args.out else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    config = {
+        "queries": queries, "repeat": args.repeat, "latency_scale": args.latency_scale,
+        "kb_docs": args.kb_docs, "answer_cache": args.answer_cache, "search_cache": not args.no_search_cache,
+    }
+    results = {"config": config, "cases": {}}
+    pipeline_output = sys.stderr if args.verbose else open(os.devnull, "w")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="pipeline_bench_") as workdir:
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(pipeline_output):
+                run = build_pipeline(fixtures, args.latency_scale, args.answer_cache, args.kb_docs, args.paragraphs,
+                                     search_cache=not args.no_search_cache)
+            for mode in args.modes:
+                with contextlib.redirect_stdout(pipeline_output):
+                    for query in queries[:args.warmup]:
+                        run_case(run, [query], mode == "deep", 1)
+                for concurrency in args.concurrency:
+                    name = f"{mode}_c{concurrency}"
+                    print(f"Running case '{name}'...", file=sys.stderr)
+                    with contextlib.redirect_stdout(pipeline_output):
+                        case = run_case(run, queries * args.repeat, mode == "deep", concurrency)
+                    results["cases"][name] = dict(case, mode=mode, concurrency=concurrency)
+        finally:
+            os.chdir(cwd)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if out_path:
+        with open(out_path, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {out_path}", file=sys.stderr)
+    else:
+        print(output)
+
+    if compare_path:
+        with open(compare_path) as f:
+            regressions = compare(json.load(f), results, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"{regressions} regression(s) against {compare_path}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# benchmarks/synthetic.py
+
+# Deterministic synthetic corpora for ingestion benchmarks: minimal text PDFs
+# written by hand (no PDF library needed) and plain-text documents built from
+# a small financial vocabulary.
+import os
+import random
+from typing import List
+
+WORDS = [
+    "revenue", "profit", "margin", "equity", "debt", "dividend", "growth", "quarter",
+    "fiscal", "guidance", "inflation", "interest", "yield", "portfolio", "allocation",
+    "diversification", "liquidity", "volatility", "valuation", "earnings", "cash", "flow",
+    "capital", "expenditure", "bank", "loan", "deposit", "asset", "liability", "ratio",
+    "HDFCBANK", "RELIANCE", "INFY", "TCS", "AAPL", "MSFT", "NIFTY", "FY24", "Q3",
+]
+
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + ", " + str(rng.randint(1, 9999)) + "."
+
+
+def page_lines(rng: random.Random, lines_per_page: int) -> List[str]:
+    return [sentence(rng) for _ in range(lines_per_page)]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Write a minimal valid PDF with one line of Helvetica text per entry."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    font_id = 3 + 2 * len(pages)
+    for i, lines in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * i} 0 R >>".encode()
+        )
+        body = "BT /F1 9 Tf 11 TL 36 760 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_pdfs(folder: str, docs: int, pages: int, lines_per_page: int = 60, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for d in range(docs):
+        path = os.path.join(folder, f"synthetic_{d:04d}.pdf")
+        write_pdf(path, [page_lines(rng, lines_per_page) for _ in range(pages)])
+        paths.append(path)
+    return paths
+
+
+def generate_texts(folder: str, docs: int, paragraphs: int, sentences_per_paragraph: int = 6,
+                   seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for d in range(docs):
+        path = os.path.join(folder, f"synthetic_{d:04d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for _ in range(paragraphs):
+                f.write(" ".join(sentence(rng) for _ in range(sentences_per_paragraph)) + "\n\n")
+        paths.append(path)
+    return paths
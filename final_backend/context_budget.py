@@ -0,0 +1,149 @@
+# context_budget.py
+
+# Token-budgeted assembly of the synthesis prompt. The RAG chunks, web/deep
+# research evidence and chat history each get a share of the active model's
+# context window (after reserving room for the answer and the fixed prompt);
+# items are taken in priority order, unused share flows to the other sections,
+# and whatever does not fit is dropped (or, for the last item that partly fits,
+# truncated). The caller gets back what was kept and a record of what was dropped.
+# Tokens are counted with tiktoken (a requirement); the characters-per-token
+# estimate is only a fallback for when the encoding cannot be loaded.
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import tiktoken
+    # Llama 3's tokenizer is tiktoken-based with a superset of cl100k's merges; close enough for budgeting
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # Not installed, or the encoding file cannot be fetched
+    _encoding = None
+
+CHARS_PER_TOKEN = 3.5   # Conservative estimate for English/financial text when tiktoken is unavailable
+
+# Context windows of the models configured in vars.py; unknown ids fall back to a
+# trailing "-8192"-style suffix, then to default_context_window
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "llama3:70b": 8192,
+    "llama3.2:latest": 8192,
+    "qwen-2.5-coder-32b": 32768,
+    "deepseek-r1-distill-llama-70b": 131072,
+}
+default_context_window = 8192
+min_truncated_tokens = 64   # Smaller leftovers are not worth a truncated fragment
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:int(max_tokens * CHARS_PER_TOKEN)]
+
+
+def context_window(model_id: str) -> int:
+    if model_id in MODEL_CONTEXT_WINDOWS:
+        return MODEL_CONTEXT_WINDOWS[model_id]
+    match = re.search(r"-(\d{4,6})$", model_id or "")
+    return int(match.group(1)) if match else default_context_window
+
+
+def split_evidence(text: str) -> List[str]:
+    """Web/deep-research output as paragraphs, so it can be trimmed from the end."""
+    return [p.strip() for p in re.split(r"\n\s*\n", text or "") if p.strip()]
+
+
+@dataclass
+class AssembledContext:
+    rag: List[str]
+    web: List[str]
+    history: List[Any]              # Kept messages, oldest first
+    budget_tokens: int
+    used_tokens: Dict[str, int]
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def rag_text(self) -> str:
+        return "\n\n".join(self.rag)
+
+    @property
+    def web_text(self) -> str:
+        return "\n\n".join(self.web)
+
+    def report(self) -> Dict[str, Any]:
+        return {"budget_tokens": self.budget_tokens, "used_tokens": self.used_tokens, "dropped": self.dropped}
+
+
+def _message_text(message: Any) -> str:
+    return message if isinstance(message, str) else str(getattr(message, "content", message))
+
+
+class ContextAssembler:
+    def __init__(self, model_id: str, reserve_output_tokens: int = 1024,
+                 shares: Optional[Dict[str, float]] = None):
+        self.model_id = model_id
+        self.window = context_window(model_id)
+        self.reserve_output_tokens = reserve_output_tokens
+        self.shares = shares or {"rag": 0.4, "web": 0.4, "history": 0.2}
+
+    def assemble(self, fixed_prompt: str, rag: Sequence[str], web: Sequence[str], history: Sequence[Any],
+                 priority: Sequence[str] = ("rag", "web", "history")) -> AssembledContext:
+        """
+        Fit the sections into the budget. `fixed_prompt` is everything that is always
+        sent (instructions and the query). RAG items should be best-first; history is
+        given oldest first and the most recent messages are kept.
+        """
+        budget = max(0, self.window - self.reserve_output_tokens - count_tokens(fixed_prompt))
+        items = {
+            "rag": list(rag),
+            "web": list(web),
+            "history": list(reversed(history)),     # Newest first while selecting
+        }
+        costs = {name: [count_tokens(_message_text(item)) for item in section] for name, section in items.items()}
+        kept: Dict[str, List[Any]] = {name: [] for name in items}
+        used = {name: 0 for name in items}
+
+        def take(name: str, limit: int):
+            """Take whole items in order while they fit under `limit` tokens for this section."""
+            section, section_costs = items[name], costs[name]
+            while len(kept[name]) < len(section) and used[name] + section_costs[len(kept[name])] <= limit:
+                used[name] += section_costs[len(kept[name])]
+                kept[name].append(section[len(kept[name])])
+
+        # Pass 1: each section up to its share; pass 2: leftovers in priority order
+        for name in priority:
+            take(name, int(budget * self.shares.get(name, 0)))
+        for name in priority:
+            take(name, used[name] + budget - sum(used.values()))
+
+        dropped = []
+        for name in priority:
+            remaining = items[name][len(kept[name]):]
+            if not remaining:
+                continue
+            leftover = budget - sum(used.values())
+            # The next item of a text section can still contribute a truncated prefix
+            if name != "history" and leftover >= min_truncated_tokens:
+                fragment = truncate_to_tokens(remaining[0], leftover - 8) + " …[truncated]"
+                kept[name].append(fragment)
+                used[name] += count_tokens(fragment)
+                dropped.append({"section": name, "items": 1, "tokens": costs[name][len(kept[name]) - 1] - count_tokens(fragment),
+                                "truncated": True})
+                remaining = remaining[1:]
+            if remaining:
+                dropped.append({"section": name, "items": len(remaining),
+                                "tokens": sum(costs[name][len(items[name]) - len(remaining):]), "truncated": False})
+
+        return AssembledContext(
+            rag=kept["rag"], web=kept["web"], history=list(reversed(kept["history"])),
+            budget_tokens=budget, used_tokens=used, dropped=dropped,
+        )
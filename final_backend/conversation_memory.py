@@ -0,0 +1,164 @@
+# conversation_memory.py
+
+# Conversation memory with a flat prompt footprint: the last N turns are passed
+# verbatim and everything older is folded into a rolling summary. The full
+# transcript stays in the underlying chat history (e.g. FileChatMessageHistory)
+# for display; the summary is kept next to it and updated incrementally on a
+# background thread after each turn, never on the request path. Drop-in for the
+# parts of ConversationBufferMemory the app uses (chat_memory,
+# load_memory_variables, save_context, clear).
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between a user and a financial assistant.
+Keep facts the assistant may need later: the user's goals, constraints, holdings, risk profile,
+time horizons, and the companies, funds and figures discussed. Stay under {max_words} words.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+Updated summary:"""
+
+
+def _role(message: BaseMessage) -> str:
+    return {"human": "User", "ai": "Assistant"}.get(message.type, "System")
+
+
+class RollingSummaryMemory:
+    def __init__(self, chat_memory: BaseChatMessageHistory, llm: Any = None, window_turns: int = 4,
+                 summary_path: Optional[str] = None, max_summary_words: int = 200, max_batch_chars: int = 12_000,
+                 memory_key: str = "chat_history", input_key: str = "input", output_key: str = "output"):
+        self.chat_memory = chat_memory
+        self._llm = llm
+        self.window_messages = 2 * window_turns   # A turn is a user message and a reply
+        self.summary_path = summary_path
+        self.max_summary_words = max_summary_words
+        self.max_batch_chars = max_batch_chars    # Conversation text per summary call (~3.5k tokens)
+        self.memory_key = memory_key
+        self.input_key = input_key
+        self.output_key = output_key
+        self.summary = ""
+        self.summarized = 0    # Messages of chat_memory already folded into the summary
+        self._generation = 0   # Bumped by clear() so an in-flight update is discarded
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+        self._pending = None
+        self._load_summary()
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            from vars import get_llm_id, get_llm_provider
+            self._llm = get_llm_provider(get_llm_id("remote"), framework="langchain")
+        return self._llm
+
+    def _load_summary(self):
+        if not self.summary_path or not os.path.exists(self.summary_path):
+            return
+        try:
+            with open(self.summary_path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.summary, self.summarized = state.get("summary", ""), state.get("summarized", 0)
+        except (OSError, ValueError) as e:
+            print(f"Could not read conversation summary {self.summary_path}: {e}")
+
+    def _save_summary(self):
+        if not self.summary_path:
+            return
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary, "summarized": self.summarized}, f)
+        os.replace(tmp_path, self.summary_path)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, List[BaseMessage]]:
+        """The summary (as a system message), turns not yet folded into it, then the last N turns verbatim."""
+        messages = self.chat_memory.messages
+        window_start = max(0, len(messages) - self.window_messages)
+        with self._lock:
+            if self.summarized > len(messages):
+                # The history was truncated or replaced outside this class; start over
+                self.summary, self.summarized = "", 0
+                self._generation += 1
+            summary, summarized = self.summary, self.summarized
+        history: List[BaseMessage] = []
+        if summary:
+            history.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        # Turns that left the window while the background update is still folding them into the
+        # summary are sent verbatim until it lands. Normally that is a turn or two; a long unsummarized
+        # backlog (an old history file) is capped at one summary batch, most recent turns first.
+        pending: List[BaseMessage] = []
+        size = 0
+        for message in reversed(messages[summarized:window_start]):
+            size += len(message.content)
+            if pending and size > self.max_batch_chars:
+                break
+            pending.insert(0, message)
+        history.extend(pending)
+        history.extend(messages[window_start:])
+        self._schedule_summary(len(messages))
+        return {self.memory_key: history}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]):
+        self.chat_memory.add_messages([
+            HumanMessage(content=inputs[self.input_key]),
+            AIMessage(content=outputs[self.output_key]),
+        ])
+        self._schedule_summary(len(self.chat_memory.messages))
+
+    def clear(self):
+        self.chat_memory.clear()
+        with self._lock:
+            self.summary, self.summarized = "", 0
+            self._generation += 1
+            self._save_summary()
+
+    def _schedule_summary(self, total_messages: int):
+        """Start a background summary update if messages have slid out of the window."""
+        with self._lock:
+            outside_window = total_messages - self.window_messages
+            if outside_window <= self.summarized or (self._pending and not self._pending.done()):
+                return
+            self._pending = self._executor.submit(self._update_summary)
+
+    def _update_summary(self):
+        """Fold messages that left the window into the summary, a bounded batch per LLM call."""
+        try:
+            messages = self.chat_memory.messages
+            end = len(messages) - self.window_messages
+            while True:
+                with self._lock:
+                    summary, start, generation = self.summary, self.summarized, self._generation
+                if end <= start:
+                    return
+                # A long backlog (e.g. an existing history file) is summarized in several passes
+                stop, size = start, 0
+                while stop < end and (stop == start or size + len(messages[stop].content) <= self.max_batch_chars):
+                    size += len(messages[stop].content)
+                    stop += 1
+                lines = "\n".join(f"{_role(m)}: {m.content[:self.max_batch_chars]}" for m in messages[start:stop])
+                prompt = SUMMARY_PROMPT.format(max_words=self.max_summary_words, summary=summary or "(none)", lines=lines)
+                result = self.llm.invoke(prompt)
+                new_summary = str(getattr(result, "content", result)).strip()
+                # Hard cap in case the model ignores the word limit
+                words = new_summary.split()
+                if len(words) > 2 * self.max_summary_words:
+                    new_summary = " ".join(words[:2 * self.max_summary_words])
+                with self._lock:
+                    if self._generation != generation:
+                        return  # Cleared meanwhile
+                    self.summary, self.summarized = new_summary, stop
+                    self._save_summary()
+        except Exception as e:
+            print(f"Error updating conversation summary: {e}")
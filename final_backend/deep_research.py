@@ -1,8 +1,14 @@
 # deep_research.py
+import copy
+import functools
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from tavily import TavilyClient
 from agno.agent import Agent
-from vars import get_llm_id, get_llm_provider, MAX_DEPTH, MAX_SEARCH_CALLS, NUM_SUBQUESTIONS
+from vars import (get_llm_id, get_llm_provider, MAX_DEPTH, MAX_SEARCH_CALLS, NUM_SUBQUESTIONS, RESEARCH_WORKERS,
+                  EVIDENCE_SIMILARITY_THRESHOLD, TAVILY_SEARCH_DEPTH, TAVILY_MAX_RESULTS)
 import os
 from typing import List, Dict, Any, Optional, Callable # Import Callable
 from dotenv import load_dotenv
@@ -12,6 +18,9 @@ from rich.markdown import Markdown
 import re
 import json
 from agno.tools.yfinance import YFinanceTools
+from tracing import span, traced, set_attributes, record_llm_usage, bind
+from search_cache import CachedTavilyClient, shared_search_cache
+from evidence_store import EvidenceStore
 
 load_dotenv()
 console = Console()
@@ -19,7 +28,8 @@ console = Console()
 tavily_api_key = os.environ.get("TAVILY_API_KEY")
 if not tavily_api_key:
     raise ValueError("TAVILY_API_KEY not found in environment variables.")
-tavily_client = TavilyClient(api_key=tavily_api_key)
+# Searches are shared with run.py's web agent through the on-disk search cache
+tavily_client = CachedTavilyClient(TavilyClient(api_key=tavily_api_key), shared_search_cache())
 
 yf_tool = YFinanceTools(
     stock_price=True,
@@ -29,36 +39,135 @@ yf_tool = YFinanceTools(
 )
 
 
+class SearchBudget:
+    """
+    Search/tool calls left for one research run. A slot is reserved before each call,
+    so concurrent branches cannot overshoot the limit; a failed call gives its slot back.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> bool:
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.used = max(0, self.used - 1)
+
+    @property
+    def exhausted(self) -> bool:
+        with self._lock:
+            return self.used >= self.limit
+
+
+def _path_key(path: str) -> List[int]:
+    return [int(part) for part in path.split(".")]
+
+
 class DeepResearch:
-    def __init__(self, max_depth=MAX_DEPTH, max_search_calls=MAX_SEARCH_CALLS):
+    # Sibling subquestions (and their sub-subquestions) are researched concurrently, and each
+    # subquestion's Tavily search runs alongside its YFinance lookup, so wall time follows the
+    # depth of the research tree rather than its size. Logs from worker threads are prefixed
+    # with the subquestion's path ("2.1") and streamed from the calling thread; the returned
+    # debug_log groups them in tree order. Web sources go into a per-run EvidenceStore, so an
+    # article found by several subquestions is held once and its full text analysed once.
+    def __init__(self, max_depth=MAX_DEPTH, max_search_calls=MAX_SEARCH_CALLS, max_workers=RESEARCH_WORKERS):
         self.reasoning_model = get_llm_provider(get_llm_id("reasoning"))
         self.analysis_model = get_llm_provider(get_llm_id("remote"))
         self.max_depth = max_depth
         self.max_search_calls = max_search_calls
+        self.max_workers = max_workers
+        self.user_prompt = ""
+        self.realtime = False   # Real-time research bypasses the search cache
+        self._reset_run_state()
+
+    def _reset_run_state(self):
         self.search_calls_made = 0
         self.debug_log = []
-        self.user_prompt = ""
+        self.budget = SearchBudget(self.max_search_calls)
+        self.evidence = EvidenceStore(EVIDENCE_SIMILARITY_THRESHOLD)
+        self._node_logs: Dict[str, List[str]] = {}     # Subquestion path -> its log lines
+        self._log_lock = threading.Lock()
+        self._pending_stream: "queue.Queue" = queue.Queue()
+        self._caller_thread = threading.get_ident()
 
     # Modified _log method
-    def _log(self, message, color=None, attrs=None, stream_callback: Optional[Callable[[str], None]] = None):
+    def _log(self, message, color=None, attrs=None, stream_callback: Optional[Callable[[str], None]] = None,
+             path: str = ""):
         """Log a message to console, debug log, and optionally stream via callback."""
         log_entry = message # Store the raw message
+        if path:
+            # Keep leading blank lines ahead of the "[1.2]" prefix
+            body = message.lstrip("\n")
+            log_entry = message[:len(message) - len(body)] + f"[{path}] {body}"
         if color:
-            colored_msg = colored(message, color, attrs=attrs)
+            colored_msg = colored(log_entry, color, attrs=attrs)
             print(colored_msg)
         else:
-            print(message)
+            print(log_entry)
 
-        self.debug_log.append(log_entry) # Append raw message to internal log
+        if path:
+            with self._log_lock:
+                self._node_logs.setdefault(path, []).append(log_entry)
+        else:
+            self.debug_log.append(log_entry) # Append raw message to internal log
 
         # If a callback is provided, call it with the raw message
         if stream_callback:
+            if threading.get_ident() != self._caller_thread:
+                # UI callbacks (e.g. Streamlit) must run on the thread that started the research
+                self._pending_stream.put((stream_callback, log_entry))
+            else:
+                self._stream(stream_callback, log_entry)
+
+    def _stream(self, stream_callback: Callable[[str], None], log_entry: str):
+        try:
+            # Add newline for better streaming display formatting
+            stream_callback(log_entry + "\n")
+        except Exception as e:
+            # Avoid crashing backend if streaming fails, just print error
+            print(colored(f"--- STREAMING CALLBACK ERROR: {e} ---", "red"))
+
+    def _flush_stream(self):
+        """Forward log lines queued by worker threads (call on the calling thread)."""
+        while True:
             try:
-                # Add newline for better streaming display formatting
-                stream_callback(log_entry + "\n")
-            except Exception as e:
-                # Avoid crashing backend if streaming fails, just print error
-                print(colored(f"--- STREAMING CALLBACK ERROR: {e} ---", "red"))
+                stream_callback, log_entry = self._pending_stream.get_nowait()
+            except queue.Empty:
+                return
+            self._stream(stream_callback, log_entry)
+
+    def _map_concurrently(self, func: Callable, items: List[Any]) -> List[Any]:
+        """
+        func over items on a bounded pool, results in item order. Each task runs in a
+        copy of the current tracing context. On the calling thread, queued log lines are
+        streamed while waiting.
+        """
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)),
+                                thread_name_prefix="deep-research") as pool:
+            futures = [pool.submit(bind(functools.partial(func, item))) for item in items]
+            if threading.get_ident() == self._caller_thread:
+                pending = set(futures)
+                while pending:
+                    _, pending = wait(pending, timeout=0.1)
+                    self._flush_stream()
+            return [future.result() for future in futures]
+
+    def _merge_node_logs(self):
+        """Append the per-subquestion log lines to debug_log in tree order (1, 1.1, 1.2, 2, ...)."""
+        with self._log_lock:
+            for path in sorted(self._node_logs, key=_path_key):
+                self.debug_log.extend(self._node_logs[path])
+            self._node_logs = {}
 
     def _parse_subquestions(self, response_content: str, num_questions: int) -> List[str]:
         """Robustly parse numbered list of subquestions from LLM response."""
@@ -80,13 +189,14 @@ class DeepResearch:
 
 
     # Modified _generate_subquestions
-    def _generate_subquestions(self, query: str, num_questions=NUM_SUBQUESTIONS, stream_callback: Optional[Callable[[str], None]] = None) -> List[str]:
+    @traced("deep.plan")
+    def _generate_subquestions(self, query: str, num_questions=NUM_SUBQUESTIONS, stream_callback: Optional[Callable[[str], None]] = None,
+                               path: str = "") -> List[str]:
         """Break down query into subquestions, using the stream callback for logging."""
         agent = Agent(
             model=self.analysis_model,
             description="You are an expert research planner...",
         )
-        self.user_prompt = query # Store user prompt for context in analysis
 
         prompt = f"""
         You need to research the following complex topic: "{query}"
@@ -95,25 +205,29 @@ class DeepResearch:
         """ # (Keep existing prompt)
 
         try:
-            self._log(f"Generating {num_questions} subquestions for: '{query}'", "cyan", stream_callback=stream_callback)
+            self._log(f"Generating {num_questions} subquestions for: '{query}'", "cyan", stream_callback=stream_callback, path=path)
+            set_attributes(prompt_chars=len(prompt))
             response = agent.run(prompt)
+            record_llm_usage(response)
             content = response.content
             if "<think>" in content:
                 content = content.split("</think>")[-1].strip()
 
             subquestions = self._parse_subquestions(content, num_questions)
 
-            self._log(f"Generated {len(subquestions)} subquestions:", "cyan", stream_callback=stream_callback)
+            self._log(f"Generated {len(subquestions)} subquestions:", "cyan", stream_callback=stream_callback, path=path)
             for idx, q in enumerate(subquestions):
-                self._log(f"  {idx+1}. {q}", "yellow", stream_callback=stream_callback)
+                self._log(f"  {idx+1}. {q}", "yellow", stream_callback=stream_callback, path=path)
             return subquestions
 
         except Exception as e:
-            self._log(f"Error generating subquestions: {e}", "red", stream_callback=stream_callback)
+            self._log(f"Error generating subquestions: {e}", "red", stream_callback=stream_callback, path=path)
             return []
 
     # Modified _should_decompose (added stream_callback, though not directly used for logging here)
-    def _should_decompose(self, subquestion: str, context: str, stream_callback: Optional[Callable[[str], None]] = None) -> bool:
+    @traced("llm.decompose_check")
+    def _should_decompose(self, subquestion: str, context: str, stream_callback: Optional[Callable[[str], None]] = None,
+                          path: str = "") -> bool:
         """Decide if a subquestion needs further decomposition."""
         agent = Agent(model=self.analysis_model)
         prompt = f"""
@@ -127,21 +241,25 @@ class DeepResearch:
         """
         try:
             response = agent.run(prompt)
+            record_llm_usage(response)
             return "YES" in response.content.upper()
         except Exception as e:
             # Log the error using the callback
-            self._log(f"Error checking decomposition for '{subquestion}': {e}", "red", stream_callback=stream_callback)
+            self._log(f"Error checking decomposition for '{subquestion}': {e}", "red", stream_callback=stream_callback, path=path)
             return False
 
     # Modified _research_subquestion
-    def _research_subquestion(self, subquestion: str, depth=0, stream_callback: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    @traced("deep.subquestion")
+    def _research_subquestion(self, subquestion: str, depth=0, stream_callback: Optional[Callable[[str], None]] = None,
+                              path: str = "1") -> Dict[str, Any]:
         """Research subquestion, using stream callback for logging."""
+        set_attributes(depth=depth, subquestion=subquestion[:200])
         self._log(
-            f"\n{'  ' * depth}Researching (Depth {depth}): {subquestion}", "green", stream_callback=stream_callback)
+            f"\n{'  ' * depth}Researching (Depth {depth}): {subquestion}", "green", stream_callback=stream_callback, path=path)
 
-        if self.search_calls_made >= self.max_search_calls:
+        if self.budget.exhausted:
             self._log(
-                f"{'  ' * depth}Skipping research: Max search calls ({self.max_search_calls}) reached.", "red", stream_callback=stream_callback)
+                f"{'  ' * depth}Skipping research: Max search calls ({self.max_search_calls}) reached.", "red", stream_callback=stream_callback, path=path)
             return {
                 "subquestion": subquestion, "summary": "Max search calls reached.",
                 "search_results": None, "context": "", "additional_info": {}
@@ -149,7 +267,25 @@ class DeepResearch:
 
         context = ""
         search_results = None
+        evidence_ids: List[str] = []
         tool_outputs = {}
+        indent = '  ' * depth
+
+        # --- Tavily Web Search, started first so it runs alongside the YFinance branch ---
+        # Simplified logic: Always run Tavily unless YFinance provided a definitive answer (hard to judge, so usually run)
+        tavily_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tavily")
+        tavily_future = None
+        # A cached search costs nothing, so it does not take a slot of the budget
+        cached_results = tavily_client.lookup(subquestion, realtime=self.realtime, search_depth=TAVILY_SEARCH_DEPTH,
+                                             max_results=TAVILY_MAX_RESULTS)
+        if cached_results is not None:
+            self._log(f"{indent}Tavily results for: {subquestion} served from cache", "blue", stream_callback=stream_callback, path=path)
+        elif self.budget.reserve():
+            self._log(f"{indent}Performing Tavily search for: {subquestion}", "blue", stream_callback=stream_callback, path=path)
+            tavily_future = tavily_pool.submit(bind(functools.partial(self._tavily_search, subquestion)))
+        else:
+            self._log(f"{indent}Skipping Tavily search: Max search calls reached.", "red", stream_callback=stream_callback, path=path)
+        tavily_pool.shutdown(wait=False)
 
         # --- Tool Integration ---
         agent = Agent(model=self.reasoning_model)
@@ -159,90 +295,112 @@ class DeepResearch:
         Answer with only YES or NO.
         """
         try:
-            relevance_response = agent.run(relevance_prompt)
+            with span("llm.yfinance_relevance"):
+                relevance_response = agent.run(relevance_prompt)
+                record_llm_usage(relevance_response)
             is_yfinance_relevant = "YES" in relevance_response.content.upper()
 
-            if is_yfinance_relevant:
-                self._log(f"{'  ' * depth}YFinance determined to be relevant for: {subquestion}", "blue", stream_callback=stream_callback)
+            if is_yfinance_relevant and not self.budget.reserve():
+                self._log(f"{indent}Skipping YFinance: Max search calls reached.", "red", stream_callback=stream_callback, path=path)
+            elif is_yfinance_relevant:
+                self._log(f"{indent}YFinance determined to be relevant for: {subquestion}", "blue", stream_callback=stream_callback, path=path)
                 yf_agent = Agent(model=self.reasoning_model, tools=[yf_tool], show_tool_calls=True, markdown=True)
                 try:
-                    self._log(f"{'  ' * depth}Calling YFinance for: {subquestion}", "blue", stream_callback=stream_callback)
-                    yf_response = yf_agent.run(subquestion)
+                    self._log(f"{indent}Calling YFinance for: {subquestion}", "blue", stream_callback=stream_callback, path=path)
+                    with span("tool.yfinance"):
+                        yf_response = yf_agent.run(subquestion)
+                        record_llm_usage(yf_response)
                     yf_output = yf_response.content
                     if "404 Client Error:" in yf_output: # Check for common yfinance error
-                         self._log(f"{'  ' * depth}YFinance returned 404 error. Falling back.", "red", stream_callback=stream_callback)
+                         self._log(f"{indent}YFinance returned 404 error. Falling back.", "red", stream_callback=stream_callback, path=path)
                          raise ValueError("YFinance 404 error") # Raise to trigger fallback
 
                     tool_outputs["yfinance_data"] = yf_output
                     context += f"\nYFinance Tool Output:\n{yf_output}\n"
-                    self._log(f"{'  ' * depth}YFinance Output received.", "magenta", stream_callback=stream_callback)
+                    self._log(f"{indent}YFinance Output received.", "magenta", stream_callback=stream_callback, path=path)
                     # Note: show_tool_calls=True in Agno might print, but we log receipt here.
-                    self.search_calls_made += 1 # Increment after successful call
                 except Exception as e:
-                    self._log(f"{'  ' * depth}YFinance agent failed: {e}", "red", stream_callback=stream_callback)
+                    self.budget.release() # Only successful calls count against the budget
+                    self._log(f"{indent}YFinance agent failed: {e}", "red", stream_callback=stream_callback, path=path)
                     # Decide if fallback to Tavily is needed here or handled below
                     is_yfinance_relevant = False # Treat as not relevant if failed
             else:
-                self._log(f"{'  ' * depth}YFinance determined not relevant.", "yellow", stream_callback=stream_callback)
+                self._log(f"{indent}YFinance determined not relevant.", "yellow", stream_callback=stream_callback, path=path)
 
         except Exception as e:
-            self._log(f"{'  ' * depth}Error determining YFinance relevance: {e}", "red", stream_callback=stream_callback)
+            self._log(f"{indent}Error determining YFinance relevance: {e}", "red", stream_callback=stream_callback, path=path)
             is_yfinance_relevant = False # Assume not relevant on error
 
-        # --- Tavily Web Search (Run if YFinance not relevant, failed, or general search needed) ---
-        # Simplified logic: Always run Tavily unless YFinance provided a definitive answer (hard to judge, so usually run)
-        if self.search_calls_made < self.max_search_calls:
-            self._log(f"{'  ' * depth}Performing Tavily search for: {subquestion}", "blue", stream_callback=stream_callback)
+        tool_context = context
+        if cached_results is not None or tavily_future is not None:
             try:
-                search_results = tavily_client.search(query=subquestion, search_depth="advanced", max_results=5)
-                self.search_calls_made += 1
+                search_results = cached_results if cached_results is not None else tavily_future.result()
                 if search_results and search_results.get("results"):
-                    context += "\nWeb Search Results (Tavily):\n" + "\n\n".join([f"Source: {r.get('url', 'N/A')}\nContent: {r.get('content', '')}" for r in search_results["results"]])
-                    self._log(f"{'  ' * depth}Tavily search successful.", "magenta", stream_callback=stream_callback)
+                    evidence_ids, collapsed = self.evidence.add_results(search_results["results"], path=path)
+                    context += "\nWeb Search Results (Tavily):\n" + self.evidence.render(evidence_ids)
+                    self._log(f"{indent}Tavily search successful ({len(evidence_ids)} sources, {collapsed} duplicates collapsed).",
+                              "magenta", stream_callback=stream_callback, path=path)
                 else:
-                    self._log(f"{'  ' * depth}Tavily search returned no results.", "yellow", stream_callback=stream_callback)
+                    self._log(f"{indent}Tavily search returned no results.", "yellow", stream_callback=stream_callback, path=path)
             except Exception as e:
-                self._log(f"{'  ' * depth}Tavily search failed: {e}", "red", stream_callback=stream_callback)
+                if tavily_future is not None:
+                    self.budget.release()   # Cached results never reserved a slot
+                self._log(f"{indent}Tavily search failed: {e}", "red", stream_callback=stream_callback, path=path)
                 context += "\nWeb search failed."
-        else:
-             self._log(f"{'  ' * depth}Skipping Tavily search: Max search calls reached.", "red", stream_callback=stream_callback)
 
 
         # --- Recursive Decomposition ---
         additional_info = {}
-        if depth < self.max_depth and self.search_calls_made < self.max_search_calls:
+        if depth < self.max_depth and not self.budget.exhausted:
             # Pass callback to _should_decompose
-            if self._should_decompose(subquestion, context, stream_callback=stream_callback):
-                self._log(f"{'  ' * depth}Further decomposing: {subquestion}", "magenta", stream_callback=stream_callback)
+            if self._should_decompose(subquestion, context, stream_callback=stream_callback, path=path):
+                self._log(f"{indent}Further decomposing: {subquestion}", "magenta", stream_callback=stream_callback, path=path)
                  # Pass callback to _generate_subquestions
-                sub_subquestions = self._generate_subquestions(subquestion, num_questions=2, stream_callback=stream_callback)
-
-                sub_findings = {}
-                for sub_sq in sub_subquestions:
-                    # Recursive call - pass callback
-                    sub_result = self._research_subquestion(sub_sq, depth=depth + 1, stream_callback=stream_callback)
-                    sub_findings[sub_sq] = sub_result
-                additional_info["sub_research"] = sub_findings
+                sub_subquestions = self._generate_subquestions(subquestion, num_questions=2, stream_callback=stream_callback, path=path)
+
+                # Sub-subquestions are researched concurrently too
+                sub_results = self._map_concurrently(
+                    lambda item: self._research_subquestion(item[1], depth=depth + 1, stream_callback=stream_callback, path=item[0]),
+                    [(f"{path}.{idx + 1}", sub_sq) for idx, sub_sq in enumerate(sub_subquestions)],
+                )
+                additional_info["sub_research"] = dict(zip(sub_subquestions, sub_results))
             else:
-                self._log(f"{'  ' * depth}Decomposition not needed for: {subquestion}", "yellow", stream_callback=stream_callback)
+                self._log(f"{indent}Decomposition not needed for: {subquestion}", "yellow", stream_callback=stream_callback, path=path)
 
         # --- Analysis/Summarization ---
+        # Each source's full text goes to the first subquestion analysed with it (a deeper one, or
+        # whichever sibling gets there first); the others only cite it by id
+        analysis_context = context
+        if evidence_ids:
+            owners = self.evidence.claim(evidence_ids, path)
+            analysis_context = tool_context + "\nWeb Search Results (Tavily):\n" + self.evidence.render(
+                evidence_ids, owners, path)
         # Pass callback to _analyze_findings
-        summary = self._analyze_findings(subquestion, context, additional_info, stream_callback=stream_callback)
+        summary = self._analyze_findings(subquestion, analysis_context, additional_info, stream_callback=stream_callback, path=path)
 
         return {
             "subquestion": subquestion,
             "search_results": search_results,
+            "evidence_ids": evidence_ids,
             "tool_outputs": tool_outputs,
             "context": context,
             "summary": summary,
             "additional_info": additional_info
         }
 
+    def _tavily_search(self, subquestion: str) -> Dict[str, Any]:
+        """One Tavily call (stored in the search cache), its budget slot already reserved by the caller."""
+        with span("tool.tavily", search_depth=TAVILY_SEARCH_DEPTH) as s:
+            search_results = tavily_client.fetch(subquestion, search_depth=TAVILY_SEARCH_DEPTH, max_results=TAVILY_MAX_RESULTS)
+            s.set(results=len((search_results or {}).get("results") or []))
+        return search_results
+
     # Modified _analyze_findings
-    def _analyze_findings(self, subquestion: str, context: str, additional_info: Dict, stream_callback: Optional[Callable[[str], None]] = None) -> str:
+    @traced("llm.analyze")
+    def _analyze_findings(self, subquestion: str, context: str, additional_info: Dict, stream_callback: Optional[Callable[[str], None]] = None,
+                          path: str = "") -> str:
         """Analyze findings, using stream callback for logging."""
-        self._log(f"Analyzing findings for: {subquestion}", "cyan", stream_callback=stream_callback)
+        self._log(f"Analyzing findings for: {subquestion}", "cyan", stream_callback=stream_callback, path=path)
         agent = Agent(
             model=self.reasoning_model, # Use reasoning model for analysis correctness
             description="You are a research analyst...",
@@ -266,16 +424,20 @@ class DeepResearch:
         1. Focus *only* on answering the subquestion: "{subquestion}"
         2. Analyse the correctness of the information provided. If the information is incorrect with respect to the subquestion and the user prompt (which is "{self.user_prompt}") in general... provide the correct information.
         3. Create a clear, concise, and factual summary...
+        4. Cite the web sources you rely on by their [E#] ids.
         """ # (Keep existing prompt structure)
         try:
+            set_attributes(prompt_chars=len(prompt))
             response = agent.run(prompt)
-            self._log(f"Analysis complete for: {subquestion}", "green", stream_callback=stream_callback)
+            record_llm_usage(response)
+            self._log(f"Analysis complete for: {subquestion}", "green", stream_callback=stream_callback, path=path)
             return response.content
         except Exception as e:
-            self._log(f"Error analyzing findings for '{subquestion}': {e}", "red", stream_callback=stream_callback)
+            self._log(f"Error analyzing findings for '{subquestion}': {e}", "red", stream_callback=stream_callback, path=path)
             return f"Error summarizing findings for '{subquestion}'."
 
     # Modified _synthesize_research
+    @traced("deep.synthesis")
     def _synthesize_research(self, main_query: str, research_results: Dict[str, Dict], stream_callback: Optional[Callable[[str], None]] = None) -> str:
         """Synthesize final answer, using stream callback for logging."""
         self._log("Synthesizing final research report...", "cyan", stream_callback=stream_callback)
@@ -292,6 +454,10 @@ class DeepResearch:
             #     self._log(f"Tool outputs for {subq}: {json.dumps(result['tool_outputs'], indent=2)}", "grey", stream_callback=stream_callback)
 
 
+        sources = self.evidence.sources()
+        if sources:
+            findings_context += f"\n\n## Sources cited as [E#]\n{sources}"
+
         prompt = f"""
         You have been tasked with researching the question: "{main_query}"
         The research was broken down... summaries were generated for each:
@@ -304,7 +470,9 @@ class DeepResearch:
         9. Format the output using Markdown for readability.
         """
         try:
+            set_attributes(prompt_chars=len(prompt))
             response = agent.run(prompt)
+            record_llm_usage(response)
             self._log("Final synthesis complete.", "green", stream_callback=stream_callback)
             return response.content
         except Exception as e:
@@ -312,10 +480,20 @@ class DeepResearch:
             return f"Error synthesizing the final research report: {e}"
 
     # Modified research method signature
-    def research(self, query: str, stream_callback: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
-        """Execute deep research, passing stream callback down."""
-        self.debug_log = [] # Clear log for new research
-        self.search_calls_made = 0 # Reset counter
+    @traced("deep_research")
+    def research(self, query: str, stream_callback: Optional[Callable[[str], None]] = None,
+                 realtime: bool = False) -> Dict[str, Any]:
+        """Execute deep research, passing stream callback down. realtime=True skips cached searches."""
+        # Per-run state (budget, logs) lives on a copy, so concurrent requests sharing this instance do not mix
+        run = copy.copy(self)
+        run._reset_run_state()
+        run.realtime = realtime
+        result = run._research(query, stream_callback)
+        self.debug_log, self.search_calls_made = run.debug_log, run.search_calls_made
+        return result
+
+    def _research(self, query: str, stream_callback: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        self.user_prompt = query # Store user prompt for context in analysis
         # Pass callback to initial log
         self._log(f"\n=== Starting Deep Research on: {query} ===", "blue", attrs=["bold"], stream_callback=stream_callback)
 
@@ -332,23 +510,26 @@ class DeepResearch:
                  "subquestion_results": {}
             }
 
-        # Step 2: Pass callback to research each subquestion
-        subquestion_results = {}
-        for sq in subquestions:
-            if self.search_calls_made >= self.max_search_calls:
-                self._log(f"Max search calls ({self.max_search_calls}) reached. Skipping remaining subquestions.", "red", stream_callback=stream_callback)
-                subquestion_results[sq] = {"summary": "Skipped due to max search call limit."}
-                continue
-            # Pass callback here
-            subquestion_results[sq] = self._research_subquestion(sq, depth=0, stream_callback=stream_callback)
+        # Step 2: Research the subquestions concurrently; each one skips itself once the budget is spent
+        results = self._map_concurrently(
+            lambda item: self._research_subquestion(item[1], depth=0, stream_callback=stream_callback, path=item[0]),
+            [(str(idx + 1), sq) for idx, sq in enumerate(subquestions)],
+        )
+        subquestion_results = dict(zip(subquestions, results))
+        self._flush_stream()
+        self._merge_node_logs()
 
         # Step 3: Pass callback to synthesize findings
         final_answer = self._synthesize_research(query, subquestion_results, stream_callback=stream_callback)
 
         self._log("\n=== Deep Research Complete ===", "blue", attrs=["bold"], stream_callback=stream_callback)
 
-        total_calls = self.search_calls_made
+        total_calls = self.search_calls_made = self.budget.used
+        evidence_stats = self.evidence.stats()
+        set_attributes(subquestions=len(subquestions), search_calls=total_calls, **{f"evidence_{k}": v for k, v in evidence_stats.items()})
         self._log(f"Total search calls made: {total_calls}", "cyan", stream_callback=stream_callback)
+        self._log(f"Evidence: {evidence_stats['sources']} distinct sources ({evidence_stats['url_duplicates']} repeated URLs, "
+                  f"{evidence_stats['content_duplicates']} near-duplicate articles collapsed)", "cyan", stream_callback=stream_callback)
 
         # Return the full results including the internally collected debug_log
         return {
@@ -356,6 +537,7 @@ class DeepResearch:
             "subquestions": subquestions,
             "subquestion_results": subquestion_results,
             "answer": final_answer,
+            "evidence": self.evidence.to_list(),
             "debug_log": "\n".join(self.debug_log) # Still return the complete log
         }
 
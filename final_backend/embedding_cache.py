@@ -0,0 +1,145 @@
+# embedding_cache.py
+
+# Persistent, size-bounded embedding cache shared by ingestion and query time.
+# Vectors are stored in SQLite keyed by (model name, text hash), so the ingest
+# watcher and the Streamlit app reuse each other's embeddings across restarts.
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List, Dict
+from langchain_core.embeddings import Embeddings
+
+default_cache_path = "./db/embedding_cache.sqlite3"
+default_max_entries = 500_000   # Least recently used entries are evicted beyond this
+evict_fraction = 0.1            # Share of entries dropped per eviction pass
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings object with an on-disk LRU cache and hit/miss counters."""
+
+    def __init__(self, underlying: Embeddings, model_name: str,
+                 cache_path: str = default_cache_path, max_entries: int = default_max_entries):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0     # Time spent in the underlying model on misses
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{kind}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            # Stay well below SQLite's bound-variable limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used=? WHERE key=?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()],
+            )
+            self._entries += len(items)
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Caller holds the lock
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._entries - int(self.max_entries * (1 - evict_fraction))
+        if excess > 0:
+            self._conn.execute(
+                """DELETE FROM embeddings WHERE key IN
+                   (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)""",
+                (excess,),
+            )
+            self._entries -= excess
+
+    def _embed(self, kind: str, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        with self._lock:
+            self.hits += len(keys) - sum(1 for key in keys if key not in cached)
+            self.misses += len(missing)
+        if missing:
+            start = time.perf_counter()
+            if kind == "query":
+                vectors = [self.underlying.embed_query(text) for text in missing.values()]
+            else:
+                vectors = self.underlying.embed_documents(list(missing.values()))
+            elapsed = time.perf_counter() - start
+            fresh = dict(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+            with self._lock:
+                self.miss_seconds += elapsed
+        return [cached[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text])[0]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        avg_miss = self.miss_seconds / self.misses if self.misses else 0.0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._entries,
+            "miss_seconds": self.miss_seconds,
+            # Estimated model time avoided, assuming a hit would have cost an average miss
+            "saved_seconds_estimate": self.hits * avg_miss,
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        return (
+            f"Embedding cache: {s['hits']} hits / {s['misses']} misses "
+            f"({s['hit_rate']:.1%} hit rate, {s['entries']} entries), "
+            f"~{s['saved_seconds_estimate']:.2f}s of {self.model_name} time saved"
+        )
@@ -0,0 +1,249 @@
+# entities.py
+
+# Ticker, company and fiscal-period extraction for chunks and queries, plus an
+# inverted index from entity to chunk ids. Ingestion tags every chunk with the
+# entities found in its text and in its document's file name; at query time the
+# entities named in the question restrict retrieval to the chunks that mention
+# them, so filings of unrelated companies do not crowd the top results.
+import os
+import pickle
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+default_index_path = "./db/entity_index.pkl"
+
+# Canonical ticker -> company names and other spellings it is referred to by
+COMPANY_ALIASES: Dict[str, List[str]] = {
+    "HDFCBANK": ["hdfc bank", "hdfc bank ltd", "hdfc bank limited"],
+    "ICICIBANK": ["icici bank"],
+    "SBIN": ["state bank of india"],
+    "KOTAKBANK": ["kotak mahindra bank", "kotak bank"],
+    "AXISBANK": ["axis bank"],
+    "RELIANCE": ["reliance industries", "reliance industries ltd", "reliance industries limited"],
+    "TCS": ["tata consultancy services"],
+    "INFY": ["infosys"],
+    "WIPRO": ["wipro"],
+    "HCLTECH": ["hcl technologies", "hcl tech"],
+    "ITC": ["itc ltd", "itc limited"],
+    "LT": ["larsen & toubro", "larsen and toubro"],
+    "BHARTIARTL": ["bharti airtel", "airtel"],
+    "HINDUNILVR": ["hindustan unilever"],
+    "BAJFINANCE": ["bajaj finance"],
+    "MARUTI": ["maruti suzuki"],
+    "TATAMOTORS": ["tata motors"],
+    "ASIANPAINT": ["asian paints"],
+    "SUNPHARMA": ["sun pharma", "sun pharmaceutical"],
+    "ADANIENT": ["adani enterprises"],
+    "AAPL": ["apple inc"],
+    "MSFT": ["microsoft"],
+    "GOOGL": ["alphabet inc"],
+    "AMZN": ["amazon.com", "amazon inc"],
+    "META": ["meta platforms", "facebook"],
+    "NVDA": ["nvidia"],
+    "TSLA": ["tesla"],
+    "JPM": ["jpmorgan", "jp morgan", "jpmorgan chase"],
+    "NIFTY": ["nifty 50", "nifty50"],
+    "SENSEX": ["bse sensex"],
+}
+
+# Names that are also ordinary words ("reliance on debt", "an apple a day", "google it") or
+# short letter groups: only matched as written here, capitalised or upper-case. The
+# qualified forms above ("Reliance Industries", "Apple Inc") match in any case.
+CASED_ALIASES: Dict[str, List[str]] = {
+    "SBIN": ["SBI"],
+    "RELIANCE": ["Reliance", "RIL"],
+    "HINDUNILVR": ["HUL"],
+    "AAPL": ["Apple"],
+    "GOOGL": ["Alphabet", "Google"],
+    "AMZN": ["Amazon"],
+}
+KNOWN_TICKERS = set(COMPANY_ALIASES) | set(CASED_ALIASES)
+
+
+def _alias_pattern(aliases, flags: int = 0) -> re.Pattern:
+    return re.compile(r"\b(" + "|".join(re.escape(a) for a in sorted(aliases, key=len, reverse=True)) + r")\b",
+                      flags)
+
+
+_ALIAS_TO_TICKER = {alias: ticker for ticker, aliases in COMPANY_ALIASES.items() for alias in aliases}
+_CASED_TO_TICKER = {alias: ticker for ticker, aliases in CASED_ALIASES.items() for alias in aliases}
+ALIAS_PATTERN = _alias_pattern(_ALIAS_TO_TICKER, re.IGNORECASE)
+CASED_ALIAS_PATTERN = _alias_pattern(_CASED_TO_TICKER)
+_ANY_CASE_TO_TICKER = {alias.lower(): ticker for alias, ticker in _CASED_TO_TICKER.items()}
+ANY_CASE_ALIAS_PATTERN = _alias_pattern(_ANY_CASE_TO_TICKER, re.IGNORECASE)
+# Bare upper-case words are only tickers when known ("NAV" or "SIP" are not);
+# exchange-qualified forms like NSE:ZOMATO, ZOMATO.NS or $PLTR are always accepted
+BARE_TICKER = re.compile(r"\b[A-Z][A-Z&]{1,11}\b")
+QUALIFIED_TICKER = re.compile(r"(?:\b(?:NSE|BSE|NASDAQ|NYSE):\s?([A-Z][A-Z0-9&]{0,11})\b"
+                              r"|\b([A-Z][A-Z0-9&]{0,11})\.(?:NS|BO)\b|\$([A-Z]{1,6})\b)")
+# FY24, FY 2024, FY2023-24, FY 23-24, optionally preceded by a quarter: Q3 FY24, Q3FY24
+PERIOD_PATTERN = re.compile(
+    r"(?:\b(Q[1-4])\s?|\b)FY\s?'?(\d{4}|\d{2})(?:\s?[-/]\s?(\d{4}|\d{2}))?\b",
+    re.IGNORECASE,
+)
+
+
+def _fiscal_year(first: str, second: Optional[str]) -> str:
+    # A range names the fiscal year by the year it ends in
+    year = second or first
+    return f"FY{year[-2:]}"
+
+
+def extract_entities(text: str, any_case: bool = False) -> Dict[str, Set[str]]:
+    """
+    Tickers (canonical) and fiscal periods mentioned in `text`. With `any_case`,
+    the ambiguous names in CASED_ALIASES also match in lower case.
+    """
+    tickers = {_ALIAS_TO_TICKER[m.lower()] for m in ALIAS_PATTERN.findall(text)}
+    if any_case:
+        tickers.update(_ANY_CASE_TO_TICKER[m.lower()] for m in ANY_CASE_ALIAS_PATTERN.findall(text))
+    else:
+        tickers.update(_CASED_TO_TICKER[m] for m in CASED_ALIAS_PATTERN.findall(text))
+    tickers.update(m for m in BARE_TICKER.findall(text) if m in KNOWN_TICKERS)
+    for groups in QUALIFIED_TICKER.findall(text):
+        tickers.update(g.upper() for g in groups if g)
+    periods = set()
+    for quarter, first, second in PERIOD_PATTERN.findall(text):
+        fiscal_year = _fiscal_year(first, second)
+        periods.add(fiscal_year)
+        if quarter:
+            periods.add(quarter.upper() + fiscal_year)
+    return {"tickers": tickers, "periods": periods}
+
+
+def document_entities(doc_key: str) -> Dict[str, Set[str]]:
+    """
+    Entities named in a file name such as `HDFCBANK_Q3FY24_results.pdf`. A file name
+    is chosen to name the document, so ambiguous names count there in any case.
+    """
+    return extract_entities(re.sub(r"[_\-.]+", " ", os.path.splitext(doc_key)[0]), any_case=True)
+
+
+def entity_metadata(text: str, doc_entities: Optional[Dict[str, Set[str]]] = None) -> Dict[str, str]:
+    """Chunk metadata fields (comma-joined, since Chroma metadata values are scalars)."""
+    found = extract_entities(text)
+    metadata = {}
+    for kind in ("tickers", "periods"):
+        values = found[kind] | (doc_entities or {}).get(kind, set())
+        if values:
+            metadata[kind] = ",".join(sorted(values))
+    return metadata
+
+
+def _keys(metadata: Dict) -> List[str]:
+    keys = []
+    for kind in ("tickers", "periods"):
+        keys.extend(f"{kind}:{value}" for value in (metadata.get(kind) or "").split(",") if value)
+    return keys
+
+
+class EntityIndex:
+    """Inverted index from `tickers:X` / `periods:Y` keys to chunk ids."""
+
+    def __init__(self, path: str = default_index_path):
+        self.path = path
+        self.postings: Dict[str, Set[str]] = defaultdict(set)
+        self.chunk_keys: Dict[str, List[str]] = {}   # Every indexed chunk, including those without entities
+        self._mtime = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunk_keys)
+
+    def add(self, ids: Iterable[str], metadatas: Iterable[Dict]):
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                self._remove(chunk_id)
+                keys = _keys(metadata or {})
+                for key in keys:
+                    self.postings[key].add(chunk_id)
+                self.chunk_keys[chunk_id] = keys
+
+    def _remove(self, chunk_id: str):
+        for key in self.chunk_keys.pop(chunk_id, []):
+            posting = self.postings.get(key)
+            if posting is not None:
+                posting.discard(chunk_id)
+                if not posting:
+                    del self.postings[key]
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+
+    def chunk_ids(self, entities: Dict[str, Iterable[str]]) -> Optional[Set[str]]:
+        """
+        Chunks matching the query entities: any of the tickers, narrowed to the
+        periods when that leaves something. None when nothing known was named,
+        meaning the search should not be restricted.
+        """
+        self.refresh()
+        allowed = None
+        with self._lock:
+            for kind in ("tickers", "periods"):
+                matched = set()
+                for value in entities.get(kind, ()):
+                    matched |= self.postings.get(f"{kind}:{value}", set())
+                if not matched:
+                    continue
+                if allowed is None:
+                    allowed = matched
+                elif allowed & matched:
+                    allowed = allowed & matched
+        return allowed
+
+    def save(self):
+        """Atomically write the index so readers never see a partial file."""
+        with self._lock:
+            state = {"postings": dict(self.postings), "chunk_keys": self.chunk_keys}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def refresh(self) -> bool:
+        """Reload from disk if another process (the ingest watcher) saved a newer index."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime <= self._mtime:
+            return False
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        with self._lock:
+            self.postings = defaultdict(set, state["postings"])
+            self.chunk_keys = state["chunk_keys"]
+            self._mtime = mtime
+        return True
+
+    def rebuild(self, vector_store, page_size: int = 5000):
+        """Re-extract entities for every chunk in the Chroma collection, including chunks stored before tagging."""
+        with self._lock:
+            self.postings = defaultdict(set)
+            self.chunk_keys = {}
+        offset = 0
+        while True:
+            page = vector_store._collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            metadatas = [
+                entity_metadata(text, document_entities((metadata or {}).get("doc_id", "")))
+                for text, metadata in zip(page["documents"], page["metadatas"])
+            ]
+            self.add(page["ids"], metadatas)
+            offset += len(page["ids"])
+        self.save()
+
+    @classmethod
+    def load_or_build(cls, vector_store, path: str = default_index_path) -> "EntityIndex":
+        index = cls(path)
+        if not index.refresh() or len(index) != vector_store._collection.count():
+            print(f"Entity index at {path} is missing or stale, rebuilding it from the vector store...")
+            index.rebuild(vector_store)
+        return index
@@ -0,0 +1,206 @@
+# evidence_store.py
+
+# Per-run store of the web sources gathered by deep research. Each Tavily result
+# is fingerprinted by its normalized URL (scheme, "www.", tracking parameters and
+# trailing slashes ignored) and by a MinHash signature over word shingles of its
+# content, so the same article reached through another URL, or syndicated with
+# small edits, becomes a single piece of evidence with a stable id ("E3").
+# Subquestions keep the ids of the evidence they found; duplicates inside one
+# search are dropped, and each source's full text goes into a single analysis
+# prompt: the first subquestion to analyse it claims it (children are analysed
+# before their parent), and every other subquestion, sibling or ancestor, cites
+# it by id with only its title and lead.
+import hashlib
+import random
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+shingle_words = 5       # Words per shingle
+lead_chars = 200        # Text shown with a source cited by id
+num_perm = 64           # MinHash signature length
+lsh_bands = 16          # Signature split into bands of num_perm / lsh_bands rows for candidate lookup
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|dclid|mc_cid|mc_eid|ref|ref_src|cmpid|guccounter|ocid)$")
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """Canonical form of a URL for identity checks, or None when there is no usable URL."""
+    url = (url or "").strip()
+    parts = urlsplit(url)
+    if not parts.netloc:
+        return None
+    host = parts.netloc.lower()
+    host = re.sub(r":(80|443)$", "", host)
+    if host.startswith("www."):
+        host = host[4:]
+    path = re.sub(r"/(amp|index\.html?)$", "", parts.path).rstrip("/") or "/"
+    params = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                    if not _TRACKING_PARAMS.match(k.lower()))
+    query = urlencode(params)
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+def shingles(text: str, k: int = shingle_words) -> Set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def minhash(shingle_set: Iterable[str]) -> Tuple[int, ...]:
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+              for s in shingle_set]
+    if not hashes:
+        return ()
+    return tuple(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def estimated_similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    if not sig_a or not sig_b:
+        return 0.0
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+
+class EvidenceStore:
+    """Thread-safe collection of deduplicated sources, shared by the subquestions of one research run."""
+
+    def __init__(self, similarity_threshold: float = 0.8):
+        self.similarity_threshold = similarity_threshold
+        self.items: Dict[str, Dict[str, Any]] = {}      # Evidence id -> url, title, content, aliases, paths, owner
+        self.url_duplicates = 0
+        self.content_duplicates = 0
+        self._by_url: Dict[str, str] = {}
+        self._signatures: Dict[str, Tuple[int, ...]] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = {}
+        self._lock = threading.Lock()
+
+    def _bands(self, signature: Tuple[int, ...]):
+        rows = num_perm // lsh_bands
+        for band in range(lsh_bands):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def _index_signature(self, eid: str, signature: Tuple[int, ...]):
+        # Caller holds the lock. Replaces any earlier signature of the item in the LSH buckets.
+        old = self._signatures.pop(eid, None)
+        if old:
+            for key in self._bands(old):
+                self._buckets[key].remove(eid)
+        if signature:
+            self._signatures[eid] = signature
+            for key in self._bands(signature):
+                self._buckets.setdefault(key, []).append(eid)
+
+    def _near_duplicate(self, signature: Tuple[int, ...]) -> Optional[str]:
+        candidates = {eid for key in self._bands(signature) for eid in self._buckets.get(key, [])}
+        best, best_score = None, self.similarity_threshold
+        for eid in sorted(candidates, key=lambda e: int(e[1:])):
+            score = estimated_similarity(signature, self._signatures[eid])
+            if score >= best_score:
+                best, best_score = eid, score
+        return best
+
+    def add(self, url: str, content: str, title: str = "", path: str = "") -> Tuple[str, bool]:
+        """Register one source found by subquestion `path`. Returns (evidence id, newly added)."""
+        url_key = normalize_url(url)
+        signature = minhash(shingles(content or ""))
+        with self._lock:
+            eid = self._by_url.get(url_key) if url_key else None
+            if eid is not None:
+                self.url_duplicates += 1
+            elif signature:
+                eid = self._near_duplicate(signature)
+                if eid is not None:
+                    self.content_duplicates += 1
+            if eid is not None:
+                item = self.items[eid]
+                if url and url not in item["urls"]:
+                    item["urls"].append(url)
+                if url_key:
+                    self._by_url.setdefault(url_key, eid)
+                if len(content or "") > len(item["content"]):
+                    # Keep the fullest copy of the text, and match later sources against it
+                    item["content"] = content
+                    self._index_signature(eid, signature)
+                item["paths"].add(path)
+                return eid, False
+
+            eid = f"E{len(self.items) + 1}"
+            self.items[eid] = {"url": url or "N/A", "title": title or "", "content": content or "",
+                               "urls": [url] if url else [], "paths": {path}, "owner": None}
+            if url_key:
+                self._by_url[url_key] = eid
+            self._index_signature(eid, signature)
+            return eid, True
+
+    def add_results(self, results: List[Dict[str, Any]], path: str = "") -> Tuple[List[str], int]:
+        """Register a Tavily result list. Returns (distinct evidence ids in result order, results collapsed)."""
+        ids: List[str] = []
+        for result in results:
+            eid, _ = self.add(result.get("url", ""), result.get("content", ""), result.get("title", ""), path)
+            if eid not in ids:
+                ids.append(eid)
+        return ids, len(results) - len(ids)
+
+    def claim(self, ids: Iterable[str], path: str) -> Dict[str, str]:
+        """
+        Called when subquestion `path` is analysed: it owns (gets the full text of) every
+        source no other subquestion has analysed yet. Returns id -> owning path.
+        """
+        owners = {}
+        with self._lock:
+            for eid in ids:
+                item = self.items[eid]
+                if item["owner"] is None:
+                    item["owner"] = path
+                owners[eid] = item["owner"]
+        return owners
+
+    def render(self, ids: Iterable[str], owners: Optional[Dict[str, str]] = None, path: str = "") -> str:
+        """
+        Prompt text for the given evidence, as seen by subquestion `path`. Without `owners`
+        every source is given in full; with them, sources owned elsewhere are cited by id.
+        """
+        blocks = []
+        with self._lock:
+            for eid in ids:
+                item = self.items[eid]
+                owner = (owners or {}).get(eid, path)
+                # A citation only saves tokens when the text is longer than the lead it would show
+                if owner == path or len(item["content"]) <= 2 * lead_chars:
+                    blocks.append(f"[{eid}] Source: {item['url']}\nContent: {item['content']}")
+                elif owner.startswith(f"{path}."):
+                    blocks.append(f"[{eid}] Source: {item['url']}\nContent: (analysed in the deeper findings below)")
+                else:
+                    lead = item["content"][:lead_chars].rsplit(" ", 1)[0]
+                    title = f"{item['title']}: " if item["title"] else ""
+                    blocks.append(f"[{eid}] Source: {item['url']}\nContent: {title}{lead}... "
+                                  f"(full text analysed under another subquestion; cite as [{eid}])")
+        return "\n\n".join(blocks)
+
+    def sources(self, ids: Optional[Iterable[str]] = None) -> str:
+        """One line per source ("[E1] Title - url"), for prompts that cite evidence ids."""
+        with self._lock:
+            return "\n".join(f"[{eid}] {self.items[eid]['title'] or 'Untitled'} - {self.items[eid]['url']}"
+                             for eid in (ids if ids is not None else self.items))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sources": len(self.items),
+                "shared_sources": sum(len(item["paths"]) > 1 for item in self.items.values()),
+                "url_duplicates": self.url_duplicates,
+                "content_duplicates": self.content_duplicates,
+            }
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"id": eid, "url": item["url"], "title": item["title"], "urls": list(item["urls"]),
+                     "subquestions": sorted(item["paths"]), "analysed_in": item["owner"]}
+                    for eid, item in self.items.items()]
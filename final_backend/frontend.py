@@ -4,19 +4,22 @@ import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import streamlit as st
-from langchain.memory import ConversationBufferMemory
+from conversation_memory import RollingSummaryMemory
 from langchain_community.chat_message_histories import FileChatMessageHistory
 from langchain_core.messages import SystemMessage, HumanMessage
 from termcolor import colored
 import os
 import traceback # Import traceback
+import time
 
 # Import the main processing function from run.py
-from run import process_query_flow
+from run import process_query_flow, main_llm_langchain
+from vars import MEMORY_WINDOW_TURNS, MEMORY_SUMMARY_MAX_WORDS
 
 
 # --- Configuration ---
 CHAT_HISTORY_FILE = "chat_history.json"
+CHAT_SUMMARY_FILE = "chat_history.summary.json"
 
 st.set_page_config(page_title="Financial Assistant", page_icon="💰")
 st.title("💰 Financial Assistant")
@@ -26,9 +29,13 @@ if "chat_history" not in st.session_state:
     st.session_state.chat_history = FileChatMessageHistory(CHAT_HISTORY_FILE)
 
 if "memory" not in st.session_state:
-    st.session_state.memory = ConversationBufferMemory(
+    # Recent turns verbatim plus a background-maintained summary of older ones
+    st.session_state.memory = RollingSummaryMemory(
         chat_memory=st.session_state.chat_history,
-        return_messages=True,
+        llm=main_llm_langchain,
+        window_turns=MEMORY_WINDOW_TURNS,
+        summary_path=CHAT_SUMMARY_FILE,
+        max_summary_words=MEMORY_SUMMARY_MAX_WORDS,
         memory_key="chat_history",
         output_key="output",
         input_key="input"
@@ -36,7 +43,8 @@ if "memory" not in st.session_state:
 
 if "messages" not in st.session_state:
     try:
-        st.session_state.messages = st.session_state.memory.load_memory_variables({})['chat_history']
+        # Display the full transcript; the memory only hands the agents a window and a summary
+        st.session_state.messages = list(st.session_state.memory.chat_memory.messages)
         if not st.session_state.messages:
             st.session_state.messages = [SystemMessage(content="How can I help you?")]
             # Persist initial system message immediately if history was empty
@@ -124,6 +132,17 @@ if prompt := st.chat_input("Ask a financial question..."):
                 # Update the placeholder using the string from the list
                 log_placeholder.markdown(f"```log\n{log_accumulator[0]}\n```")
 
+        # --- Define the Token Callback ---
+        # Separate channel from the log: renders the answer as synthesis generates it
+        answer_accumulator = ["", 0.0]  # [answer so far, time of last render]
+        def token_handler(token: str):
+            answer_accumulator[0] += token
+            # Re-rendering markdown on every token is wasteful; ~20 updates a second is smooth
+            now = time.monotonic()
+            if now - answer_accumulator[1] >= 0.05:
+                answer_accumulator[1] = now
+                message_placeholder.markdown(answer_accumulator[0] + "▌")
+
         # --- Process Query ---
         try:
             # Pass the callback *only* if deep search is active
@@ -134,7 +153,8 @@ if prompt := st.chat_input("Ask a financial question..."):
                 prompt,
                 st.session_state.memory,
                 st.session_state.deep_search_active,
-                stream_callback=stream_callback_func
+                stream_callback=stream_callback_func,
+                token_callback=token_handler
             )
 
             # Extract the answer
@@ -0,0 +1,277 @@
+# hybrid_retriever.py
+
+# Keyword (BM25) + dense retrieval over the Chroma knowledge base.
+# Dense search alone misses exact tickers, fund codes and numbers, so the
+# retriever runs both searches and fuses the rankings with reciprocal rank
+# fusion (RRF). The BM25 index is built at ingest time, updated incrementally
+# as chunks are added or removed, and reloaded by readers when the file changes.
+import math
+import os
+import pickle
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+
+default_index_path = "./db/bm25_index.pkl"
+
+# Tokens like "hdfcbank", "m&m", "nifty50", "3.5" and "fy2023-24" stay whole
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.&\-/][a-z0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "to", "was", "were", "will", "with", "what", "which",
+    "how", "why", "who", "this", "these", "those", "i", "my", "me", "should", "can", "do", "does",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """In-process inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, path: str = default_index_path, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.doc_terms: Dict[str, List[str]] = {}   # Needed to remove a chunk's postings
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self._mtime = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self.doc_lengths:
+                    self._remove(chunk_id)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self.postings[term][chunk_id] = tf
+                self.doc_terms[chunk_id] = list(counts)
+                length = sum(counts.values())
+                self.doc_lengths[chunk_id] = length
+                self.total_length += length
+
+    def _remove(self, chunk_id: str):
+        for term in self.doc_terms.pop(chunk_id, []):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(chunk_id, 0)
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+
+    def search(self, query: str, k: int, allowed_ids: Optional[set] = None) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, BM25 score) pairs, optionally restricted to `allowed_ids`."""
+        self.refresh()
+        with self._lock:
+            n = len(self.doc_lengths)
+            if not n:
+                return []
+            avg_length = self.total_length / n
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf in posting.items():
+                    if allowed_ids is not None and chunk_id not in allowed_ids:
+                        continue
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self):
+        """Atomically write the index so readers never see a partial file."""
+        with self._lock:
+            state = {
+                "postings": dict(self.postings), "doc_terms": self.doc_terms,
+                "doc_lengths": self.doc_lengths, "total_length": self.total_length,
+            }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def refresh(self) -> bool:
+        """Reload from disk if another process (the ingest watcher) saved a newer index."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime <= self._mtime:
+            return False
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        with self._lock:
+            self.postings = defaultdict(dict, state["postings"])
+            self.doc_terms = state["doc_terms"]
+            self.doc_lengths = state["doc_lengths"]
+            self.total_length = state["total_length"]
+            self._mtime = mtime
+        return True
+
+    def rebuild(self, vector_store, page_size: int = 5000):
+        """Rebuild the index from every chunk stored in the Chroma collection."""
+        with self._lock:
+            self.postings = defaultdict(dict)
+            self.doc_terms, self.doc_lengths, self.total_length = {}, {}, 0
+        offset = 0
+        while True:
+            page = vector_store._collection.get(include=["documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self.add(page["ids"], page["documents"])
+            offset += len(page["ids"])
+        self.save()
+
+    @classmethod
+    def load_or_build(cls, vector_store, path: str = default_index_path) -> "BM25Index":
+        index = cls(path)
+        # A crash between a Chroma write and the next save leaves the index behind the collection
+        if not index.refresh() or len(index) != vector_store._collection.count():
+            print(f"Keyword index at {path} is missing or stale, rebuilding it from the vector store...")
+            index.rebuild(vector_store)
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several ranked id lists: score(id) = sum over lists of 1 / (rrf_k + rank)."""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] += 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def maximal_marginal_relevance(relevance, candidate_vectors, k: int, lambda_mult: float = 0.7) -> List[int]:
+    """
+    Indices of `k` candidates chosen greedily by MMR:
+    lambda * relevance(c) - (1 - lambda) * max sim(c, already selected).
+    `relevance` is the candidates' own score in [0, 1] (the normalized fused rank
+    score), so keyword-only hits keep their place; embeddings are used only to
+    measure redundancy. The candidate similarity matrix is computed once, so each
+    step is a vector update.
+    """
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    if not len(candidates):
+        return []
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    pairwise = candidates @ candidates.T
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+    selected = []
+    for _ in range(min(k, len(candidates))):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return selected
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    BM25 + vector retriever fused with RRF; a drop-in for `vector_store.as_retriever`.
+    Pass `entities=` (from entities.extract_entities) to `invoke` to restrict both
+    searches to the chunks the entity index has for them; when none of those chunks
+    is found, both searches run again unrestricted. With `mmr_lambda` set,
+    the top `fetch_k` fused candidates are reduced to `k` by maximal marginal
+    relevance, so overlapping splits of the same passage are not all returned.
+    """
+    vector_store: Any
+    keyword_index: Any
+    entity_index: Any = None
+    k: int = 3
+    fetch_k: int = 20       # Candidates taken from each ranking, and kept after fusion for MMR
+    rrf_k: int = 60
+    mmr_lambda: Optional[float] = None  # 1.0 is pure relevance, lower values favour diversity
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                entities: Optional[Dict[str, Any]] = None) -> List[Document]:
+        allowed_ids = None
+        if entities and self.entity_index is not None:
+            allowed_ids = self.entity_index.chunk_ids(entities)
+        query_vector = self.vector_store.embeddings.embed_query(query)
+        search_kwargs = {"ids": list(allowed_ids)} if allowed_ids else {}
+        vector_hits = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+            query_vector, k=self.fetch_k, **search_kwargs)
+        keyword_hits = self.keyword_index.search(query, self.fetch_k, allowed_ids=allowed_ids or None)
+        if allowed_ids and not vector_hits and not keyword_hits:
+            # The entity's chunks are not searchable here (e.g. missing from an older mmap export)
+            vector_hits = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                query_vector, k=self.fetch_k)
+            keyword_hits = self.keyword_index.search(query, self.fetch_k)
+
+        docs: Dict[str, Document] = {}
+        vector_ranking = []
+        for doc, distance in vector_hits:
+            if doc.id is None:
+                continue
+            docs[doc.id] = doc
+            doc.metadata["vector_distance"] = float(distance)
+            vector_ranking.append(doc.id)
+        keyword_scores = dict(keyword_hits)
+
+        use_mmr = self.mmr_lambda is not None
+        fused = reciprocal_rank_fusion([vector_ranking, [cid for cid, _ in keyword_hits]], self.rrf_k)
+        fused = fused[:self.fetch_k if use_mmr else self.k]
+        # Keyword-only hits still need their text and metadata; MMR needs every candidate's embedding
+        needed = [cid for cid, _ in fused if use_mmr or cid not in docs]
+        vectors: Dict[str, Any] = {}
+        if needed:
+            include = ["documents", "metadatas"] + (["embeddings"] if use_mmr else [])
+            stored = self.vector_store.get(ids=needed, include=include)
+            for i, cid in enumerate(stored["ids"]):
+                if cid not in docs:
+                    docs[cid] = Document(id=cid, page_content=stored["documents"][i],
+                                         metadata=stored["metadatas"][i] or {})
+                if use_mmr:
+                    vectors[cid] = stored["embeddings"][i]
+
+        results = []
+        for cid, score in fused:
+            doc = docs.get(cid)
+            if doc is None:
+                continue
+            doc.metadata["rrf_score"] = score
+            if cid in keyword_scores:
+                doc.metadata["bm25_score"] = keyword_scores[cid]
+            results.append(doc)
+
+        if use_mmr:
+            results = [doc for doc in results if doc.id in vectors]
+            # Relevance is the fused RRF score scaled to the best candidate, not query cosine:
+            # exact-ticker chunks found only by BM25 are weak on vector similarity
+            top_score = max((doc.metadata["rrf_score"] for doc in results), default=0.0) or 1.0
+            picked = maximal_marginal_relevance(
+                [doc.metadata["rrf_score"] / top_score for doc in results],
+                [vectors[doc.id] for doc in results], self.k, self.mmr_lambda)
+            results = [results[i] for i in picked]
+        return results
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       entities: Optional[Dict[str, Any]] = None) -> List[Document]:
+        # The base implementation does not forward extra arguments such as `entities`
+        return await run_in_executor(None, self._get_relevant_documents, query,
+                                     run_manager=run_manager.get_sync(), entities=entities)
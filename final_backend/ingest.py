@@ -1,69 +1,454 @@
+import hashlib
 import os
+import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from uuid import uuid4
-from models import Models
+from langchain_core.documents import Document
+from loaders import load_and_split, iter_file_chunks, is_supported
+from ingest_queue import IngestQueue, start_watcher
+from hybrid_retriever import BM25Index
+from entities import EntityIndex, document_entities, entity_metadata
 
 load_dotenv()
 
-# Initialize the models
-models = Models()
-embeddings = models.embeddings_ollama
-llm = models.model_ollama
-
 # Define constants
 data_folder = "data"
 chunk_size = 1000
 chunk_overlap = 50
 check_interval = 10
+embed_batch_size = 64       # Texts sent to OllamaEmbeddings per request
+embed_workers = 2           # Embedding batches in flight at once
+parse_workers = os.cpu_count() or 1  # Processes used to parse and split files
+store_batch_size = 5000     # Records per Chroma write (stays under SQLite's variable limit)
+stream_min_bytes = 20 * 1024 * 1024  # Files at least this large are streamed window by window
+stream_window_chars = 100_000  # Characters split, embedded and flushed together when streaming (~30 PDF pages)
+queue_path = "./db/ingest_queue.sqlite3"
+chroma_path = "./db/chroma_langchain_db"
+legacy_marker_path = os.path.join(chroma_path, "legacy_chunks_migrated")  # Written once legacy chunks are tagged
+queue_claim_size = 16       # Jobs handed to the pipeline per pass
+
+# Built on first use by setup(), so the queue commands (`status`, `retry-dead`) only open the queue
+_LAZY_GLOBALS = ("models", "embeddings", "llm", "vector_store", "keyword_index", "entity_index")
+_setup_lock = threading.Lock()
+
+
+def setup():
+    """
+    Create the models, the Chroma vector store and the keyword/entity indexes (which
+    may be rebuilt from the collection). Globals already assigned, e.g. a benchmark's
+    embedder, are kept.
+    """
+    namespace = globals()
+    with _setup_lock:
+        if all(name in namespace for name in _LAZY_GLOBALS):
+            return
+        from langchain_chroma import Chroma
+        from models import Models
+        # Initialize the models
+        if "models" not in namespace:
+            namespace["models"] = Models()
+        namespace.setdefault("embeddings", namespace["models"].embeddings_ollama)
+        namespace.setdefault("llm", namespace["models"].model_ollama)
+        # Chroma vector store
+        if "vector_store" not in namespace:
+            namespace["vector_store"] = Chroma(
+                collection_name="documents",
+                embedding_function=namespace["embeddings"],
+                persist_directory=chroma_path,  # Where to save data locally
+            )
+            if not os.path.exists(legacy_marker_path):
+                migrated = migrate_legacy_chunks(namespace["vector_store"])
+                if migrated:
+                    print(f"Tagged {migrated} chunks from before document ids with their source document.")
+                with open(legacy_marker_path, "w") as f:
+                    f.write(f"{migrated}\n")
+        # Keyword index kept in step with the collection for hybrid retrieval
+        if "keyword_index" not in namespace:
+            namespace["keyword_index"] = BM25Index.load_or_build(namespace["vector_store"])
+        # Ticker / fiscal-period -> chunk ids, used to restrict retrieval to the entities a query names
+        if "entity_index" not in namespace:
+            namespace["entity_index"] = EntityIndex.load_or_build(namespace["vector_store"])
+
+
+def __getattr__(name: str):
+    # `from ingest import vector_store` (run.py, mmap_index.py) triggers setup on first access
+    if name in _LAZY_GLOBALS:
+        setup()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@dataclass
+class IngestStats:
+    """Counters and per-stage timings for one ingestion run."""
+    docs: int = 0
+    chunks: int = 0
+    chunks_skipped: int = 0     # Unchanged chunks that were not re-embedded
+    parse_seconds: float = 0.0
+    split_seconds: float = 0.0
+    embed_seconds: float = 0.0
+    store_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    def report(self) -> str:
+        wall = self.wall_seconds or 1e-9
+        return (
+            f"Ingested {self.docs} docs / {self.chunks} chunks in {self.wall_seconds:.2f}s "
+            f"({self.docs / wall:.2f} docs/sec, {self.chunks / wall:.2f} chunks/sec, "
+            f"{self.chunks_skipped} unchanged) | "
+            f"parse {self.parse_seconds:.2f}s, split {self.split_seconds:.2f}s, "
+            f"embed {self.embed_seconds:.2f}s, store {self.store_seconds:.2f}s"
+        )
+
+
+def embed_texts(texts: List[str], batch_size: int = embed_batch_size,
+                progress: Optional[Callable[[int], None]] = None) -> List[List[float]]:
+    """Embed texts in fixed-size batches, keeping up to `embed_workers` requests in flight."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    vectors = []
+    with ThreadPoolExecutor(max_workers=max(1, embed_workers)) as executor:
+        for batch_vectors in executor.map(embeddings.embed_documents, batches):
+            vectors.extend(batch_vectors)
+            if progress:
+                progress(len(vectors))
+    return vectors
+
+
+def store_chunks(ids: List[str], docs: List[Document], vectors: List[List[float]]):
+    """Write pre-embedded chunks to the Chroma collection in bulk."""
+    for i in range(0, len(ids), store_batch_size):
+        end = i + store_batch_size
+        vector_store._collection.upsert(
+            ids=ids[i:end],
+            embeddings=vectors[i:end],
+            documents=[doc.page_content for doc in docs[i:end]],
+            metadatas=[doc.metadata or None for doc in docs[i:end]],
+        )
+
+
+def document_key(file_path: str) -> str:
+    """Stable key for a source document: its file name without the `ingested_` prefix."""
+    name = os.path.basename(file_path)
+    return name[len("ingested_"):] if name.startswith("ingested_") else name
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(doc_key: str, text_hash: str) -> str:
+    """Chunk ids are derived from the document key and the chunk content."""
+    return hashlib.sha256(f"{doc_key}\x00{text_hash}".encode("utf-8")).hexdigest()
+
+
+def migrate_legacy_chunks(vector_store, page_size: int = store_batch_size) -> int:
+    """
+    One-off migration for chunks stored before chunk ids were derived from the
+    document (random uuids, no `doc_id`): tag each with the key of its `source`
+    file, so re-ingesting that document replaces them instead of adding a copy.
+    Returns the number of chunks tagged.
+    """
+    collection = vector_store._collection
+    migrated, offset = 0, 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return migrated
+        ids, metadatas = [], []
+        for cid, metadata in zip(page["ids"], page["metadatas"]):
+            metadata = metadata or {}
+            if "doc_id" not in metadata and metadata.get("source"):
+                ids.append(cid)
+                metadatas.append({**metadata, "doc_id": document_key(metadata["source"])})
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            migrated += len(ids)
+        offset += len(page["ids"])
+
+
+def existing_chunk_ids(doc_key: str) -> Set[str]:
+    """Ids of every chunk currently stored for a document."""
+    return set(vector_store._collection.get(where={"doc_id": doc_key}, include=[])["ids"])
+
+
+def key_chunks(doc_key: str, docs: List[Document]) -> Dict[str, Document]:
+    """Attach document/content-hash/entity metadata and key chunks by id."""
+    chunks = {}
+    doc_entities = document_entities(doc_key)
+    for doc in docs:
+        text_hash = content_hash(doc.page_content)
+        doc.metadata = {**(doc.metadata or {}), "doc_id": doc_key, "content_hash": text_hash,
+                        **entity_metadata(doc.page_content, doc_entities)}
+        # Identical chunks within a document collapse to one entry
+        chunks.setdefault(chunk_id(doc_key, text_hash), doc)
+    return chunks
 
-# Chroma vector store
-vector_store = Chroma(
-    collection_name="documents",
-    embedding_function=embeddings,
-    persist_directory="./db/chroma_langchain_db",  # Where to save data locally
-)
-# Ingest a file
 
+def write_new_chunks(chunks: Dict[str, Document], existing: Set[str], stats: IngestStats,
+                     batch_size: int = embed_batch_size,
+                     progress: Optional[Callable[[int], None]] = None) -> int:
+    """Embed and store the chunks not already in `existing`. Returns how many were written."""
+    new_ids = [cid for cid in chunks if cid not in existing]
+    stats.chunks_skipped += len(chunks) - len(new_ids)
+    if not new_ids:
+        return 0
+    new_docs = [chunks[cid] for cid in new_ids]
+    start = time.perf_counter()
+    vectors = embed_texts([doc.page_content for doc in new_docs], batch_size=batch_size,
+                          progress=progress)
+    stats.embed_seconds += time.perf_counter() - start
 
-def ingest_file(file_path: str):
+    start = time.perf_counter()
+    store_chunks(new_ids, new_docs, vectors)
+    keyword_index.add(new_ids, [doc.page_content for doc in new_docs])
+    entity_index.add(new_ids, [doc.metadata for doc in new_docs])
+    stats.store_seconds += time.perf_counter() - start
+    return len(new_ids)
+
+
+def remove_stale_chunks(existing: Set[str], kept: Set[str]) -> int:
+    """Delete chunks of an earlier version of the document that the new version no longer has."""
+    stale_ids = [cid for cid in existing if cid not in kept]
+    if stale_ids:
+        # Only after the new version is stored, so a crash never leaves the document empty
+        vector_store._collection.delete(ids=stale_ids)
+        keyword_index.remove(stale_ids)
+        entity_index.remove(stale_ids)
+    return len(stale_ids)
+
+
+def save_indexes():
+    keyword_index.save()
+    entity_index.save()
+
+
+def commit_chunks(file_path: str, docs: List[Document], stats: IngestStats,
+                  batch_size: int = embed_batch_size,
+                  on_progress: Optional[Callable[[str, int, int], None]] = None) -> int:
+    """
+    Embed and store the chunks of one file incrementally. Chunks whose content
+    is already stored for this document are skipped without embedding, and
+    chunks left over from an earlier version of the document are deleted.
+    Returns the number of chunks the document now has.
+    """
+    doc_key = document_key(file_path)
+    chunks = key_chunks(doc_key, docs)
+    existing = existing_chunk_ids(doc_key)
+    total_new = sum(1 for cid in chunks if cid not in existing)
+    progress = (lambda done: on_progress(file_path, done, total_new)) if on_progress else None
+    written = write_new_chunks(chunks, existing, stats, batch_size=batch_size, progress=progress)
+    removed = remove_stale_chunks(existing, set(chunks))
+    print(f"{file_path}: {written} new chunks stored, "
+          f"{len(chunks) - written} unchanged, {removed} stale removed")
+    return len(chunks)
+
+
+def commit_streaming(file_path: str, stats: IngestStats, batch_size: int = embed_batch_size,
+                     on_progress: Optional[Callable[[str, int, int], None]] = None) -> int:
+    """
+    Ingest a large file in constant memory: pages (or rows, sections) are
+    loaded lazily and every window of about `stream_window_chars` characters is
+    split, embedded and flushed to Chroma before the next one is read. Returns the number of chunks the
+    document now has.
+    """
+    doc_key = document_key(file_path)
+    existing = existing_chunk_ids(doc_key)
+    kept: Set[str] = set()
+    written = 0
+    timings: Dict[str, float] = {}
+    for window in iter_file_chunks(file_path, chunk_size, chunk_overlap, stream_window_chars, timings):
+        # Chunks already written by an earlier window of this run count as existing
+        chunks = {cid: doc for cid, doc in key_chunks(doc_key, window).items() if cid not in kept}
+        written += write_new_chunks(chunks, existing, stats, batch_size=batch_size)
+        kept.update(chunks)
+        if on_progress:
+            # The total is unknown until the last page, so report what has been seen so far
+            on_progress(file_path, len(kept), len(kept))
+    stats.parse_seconds += timings.get("parse", 0.0)
+    stats.split_seconds += timings.get("split", 0.0)
+    removed = remove_stale_chunks(existing, kept)
+    print(f"{file_path} (streamed): {written} new chunks stored, "
+          f"{len(kept) - written} unchanged, {removed} stale removed")
+    return len(kept)
+
+
+def use_streaming(file_path: str) -> bool:
+    """Large files are streamed instead of being loaded whole."""
+    try:
+        return is_supported(file_path) and os.path.getsize(file_path) >= stream_min_bytes
+    except OSError:
+        return False
+
+
+def mark_ingested(file_path: str):
+    """Rename a file with the `ingested_` prefix. Only call once its chunks are committed."""
+    directory, file = os.path.split(file_path)
+    os.rename(file_path, os.path.join(directory, "ingested_" + file))
+
+
+# Ingest a file
+def ingest_file(file_path: str, stats: Optional[IngestStats] = None,
+                batch_size: int = embed_batch_size, streaming: Optional[bool] = None) -> int:
     print(f"Ingesting file: {file_path}")
-    # Skip non-PDF files
-    if not file_path.lower().endswith('.pdf'):
-        print(f"Skipping non-PDF file: {file_path}")
-        return
+    setup()
+    stats = stats if stats is not None else IngestStats()
+    # Skip unsupported file types
+    if not is_supported(file_path):
+        print(f"Skipping unsupported file: {file_path}")
+        return 0
     print(f"Starting to ingest file: {file_path}")
-    # Editor wallah - next generain physicswallah
-    loader = PyPDFLoader(file_path=file_path)
-    loaded_documents = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=[
-            "\n", ","]
-    )
-
-    docs = text_splitter.split_documents(loaded_documents)
+    if streaming is None:
+        streaming = use_streaming(file_path)
+    if streaming:
+        written = commit_streaming(file_path, stats, batch_size=batch_size)
+        save_indexes()
+        stats.docs += 1
+        stats.chunks += written
+        print(f"Finished ingesting file: {file_path}")
+        return written
+    _, docs, timings = load_and_split(file_path, chunk_size, chunk_overlap)
+    stats.parse_seconds += timings["parse"]
+    stats.split_seconds += timings["split"]
     print(f"Loaded {len(docs)} documents from {file_path}")
-    uuids = [str(uuid4()) for _ in range(len(docs))]
-    vector_store.add_documents(documents=docs, ids=uuids)
-    print(f"Added {len(docs)} documents to the vector store")
+    written = commit_chunks(file_path, docs, stats, batch_size=batch_size)
+    save_indexes()
+    stats.docs += 1
+    stats.chunks += written
     print(f"Finished ingesting file: {file_path}")
+    return written
+
+
+def ingest_files(file_paths: List[str], batch_size: int = embed_batch_size,
+                 max_workers: int = parse_workers,
+                 on_progress: Optional[Callable[[str, int, int], None]] = None,
+                 on_complete: Optional[Callable[[str], None]] = None,
+                 on_error: Optional[Callable[[str, Exception], None]] = None) -> IngestStats:
+    """
+    Ingest many files: parse/split in a process pool, embed in batches and
+    write to Chroma in bulk as each file becomes ready. A file is renamed to
+    `ingested_` only after all of its chunks have been committed. Files larger
+    than `stream_min_bytes` are streamed in windows instead.
+
+    The optional callbacks report per-file progress (chunks embedded so far),
+    completion and failure; without `on_error` failures are only printed.
+    """
+    stats = IngestStats()
+    if not file_paths:
+        return stats
+    setup()
+    start = time.perf_counter()
+
+    def finish(file_path: str):
+        mark_ingested(file_path)
+        if on_complete:
+            on_complete(file_path)
+
+    def failed(file_path: str, error: Exception):
+        # Leave the file in place so it can be retried
+        print(f"Failed to ingest {file_path}: {error}")
+        if on_error:
+            on_error(file_path, error)
+
+    streamed = [path for path in file_paths if use_streaming(path)]
+    pooled = [path for path in file_paths if path not in streamed]
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(pooled) or 1))) as executor:
+        futures = {
+            executor.submit(load_and_split, path, chunk_size, chunk_overlap): path
+            for path in pooled
+        }
+        # Large files stream through this process while the pool parses the rest
+        for file_path in streamed:
+            try:
+                stats.chunks += commit_streaming(file_path, stats, batch_size=batch_size,
+                                                 on_progress=on_progress)
+                stats.docs += 1
+                finish(file_path)
+            except Exception as e:
+                failed(file_path, e)
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                _, docs, timings = future.result()
+                stats.parse_seconds += timings["parse"]
+                stats.split_seconds += timings["split"]
+                if not is_supported(file_path):
+                    print(f"Skipping unsupported file: {file_path}")
+                else:
+                    stats.chunks += commit_chunks(file_path, docs, stats, batch_size=batch_size,
+                                                  on_progress=on_progress)
+                    stats.docs += 1
+                finish(file_path)
+            except Exception as e:
+                failed(file_path, e)
+    save_indexes()
+    stats.wall_seconds = time.perf_counter() - start
+    print(stats.report())
+    if hasattr(embeddings, "report"):
+        print(embeddings.report())
+    return stats
+
+
+def process_jobs(queue: IngestQueue, jobs: List[dict]):
+    """Run claimed queue jobs through the pipeline, recording progress, retries and dead letters."""
+    paths = []
+    for job in jobs:
+        path = job["path"]
+        ingested_path = os.path.join(os.path.dirname(path), "ingested_" + os.path.basename(path))
+        if not os.path.exists(path):
+            # Renamed before the previous run could mark it done, or removed from the folder
+            if os.path.exists(ingested_path):
+                queue.complete(path)
+            else:
+                queue.fail(path, "File no longer exists")
+            continue
+        # Chunks a crashed attempt already wrote are recognised by their content-hash
+        # ids, so resumed jobs simply skip them instead of storing them twice
+        paths.append(path)
+
+    def on_error(path: str, error: Exception):
+        status = queue.fail(path, f"{type(error).__name__}: {error}")
+        if status == "dead":
+            print(f"Moved {path} to the dead-letter list.")
+
+    ingest_files(paths, on_progress=queue.progress, on_complete=queue.complete, on_error=on_error)
 
 
 def main():
+    setup()
+    queue = IngestQueue(queue_path)
+    resumed = queue.recover()
+    if resumed:
+        print(f"Resuming {resumed} in-flight ingestion jobs.")
+    # Pick up anything dropped while the watcher was not running
+    for file in os.listdir(data_folder):
+        path = os.path.join(data_folder, file)
+        if not file.startswith("ingested_") and os.path.isfile(path):
+            queue.enqueue(path)
+    start_watcher(data_folder, queue, poll_interval=check_interval)
+    print(f"Watching {data_folder} for new files.")
     while True:
-        files = os.listdir(data_folder)
-        for file in files:
-            if not file.startswith("ingested_"):
-                file_path = os.path.join(data_folder, file)
-                ingest_file(file_path)
-                new_file = "ingested_" + file
-                new_file_path = os.path.join(data_folder, new_file)
-                os.rename(file_path, new_file_path)
-        time.sleep(check_interval)
+        jobs = queue.claim(queue_claim_size)
+        if jobs:
+            process_jobs(queue, jobs)
+        else:
+            # Wake up at least every check_interval to notice jobs re-queued by another process
+            retry_in = queue.next_retry_in()
+            queue.wait(check_interval if retry_in is None else min(retry_in, check_interval))
+
+
+def status():
+    print(IngestQueue(queue_path).status_report())
 
 
 if __name__ == "__main__":
-    main()
+    command = sys.argv[1] if len(sys.argv) > 1 else "watch"
+    if command == "status":
+        status()
+    elif command == "retry-dead":
+        print(f"Re-queued {IngestQueue(queue_path).retry_dead()} dead-lettered jobs.")
+    else:
+        main()
@@ -0,0 +1,275 @@
+# ingest_queue.py
+
+# Durable on-disk job queue and file watcher for the ingestion pipeline.
+# Jobs live in a small SQLite database so that a restart resumes whatever was
+# pending or in flight, and files that keep failing end up in a dead-letter
+# list instead of being retried forever.
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+# Job states
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+DEAD = "dead"
+
+max_attempts = 3        # Attempts before a job is moved to the dead-letter list
+retry_backoff = 30      # Seconds to wait before retrying, multiplied by the attempt number
+settle_delay = 2.0      # Seconds without create/modify events before a file counts as fully written
+
+
+class IngestQueue:
+    """SQLite-backed queue of files waiting to be ingested."""
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                resumed INTEGER NOT NULL DEFAULT 0,
+                chunks_done INTEGER NOT NULL DEFAULT 0,
+                chunks_total INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                not_before REAL NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def enqueue(self, path: str) -> bool:
+        """
+        Add a file to the queue. Returns False if it is already queued, in flight
+        or dead-lettered (use `retry_dead` to re-queue dead jobs).
+        """
+        now = time.time()
+        cursor = self._execute(
+            """INSERT INTO jobs (path, status, enqueued_at, updated_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(path) DO UPDATE SET
+                   status=excluded.status, attempts=0, resumed=0, chunks_done=0,
+                   chunks_total=0, error=NULL, not_before=0, enqueued_at=excluded.enqueued_at,
+                   updated_at=excluded.updated_at
+               WHERE jobs.status=?""",
+            (path, PENDING, now, now, DONE),
+        )
+        if cursor.rowcount:
+            self._wakeup.set()
+        return bool(cursor.rowcount)
+
+    def recover(self) -> int:
+        """Return jobs left in flight by a previous run to the queue, flagged as resumed."""
+        cursor = self._execute(
+            "UPDATE jobs SET status=?, resumed=1, updated_at=? WHERE status=?",
+            (PENDING, time.time(), PROCESSING),
+        )
+        return cursor.rowcount
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Move up to `limit` ready jobs to the processing state and return them."""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT path, attempts, resumed FROM jobs
+                   WHERE status=? AND not_before<=? ORDER BY enqueued_at LIMIT ?""",
+                (PENDING, now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET status=?, updated_at=? WHERE path=?",
+                [(PROCESSING, now, row[0]) for row in rows],
+            )
+            self._conn.commit()
+        return [{"path": path, "attempts": attempts, "resumed": bool(resumed)}
+                for path, attempts, resumed in rows]
+
+    def progress(self, path: str, chunks_done: int, chunks_total: int):
+        self._execute(
+            "UPDATE jobs SET chunks_done=?, chunks_total=?, updated_at=? WHERE path=?",
+            (chunks_done, chunks_total, time.time(), path),
+        )
+
+    def complete(self, path: str):
+        self._execute(
+            "UPDATE jobs SET status=?, resumed=0, error=NULL, updated_at=? WHERE path=?",
+            (DONE, time.time(), path),
+        )
+
+    def fail(self, path: str, error: str) -> str:
+        """Record a failed attempt. Returns the new status (pending for a retry, or dead)."""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM jobs WHERE path=?", (path,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            status = DEAD if attempts >= max_attempts else PENDING
+            now = time.time()
+            self._conn.execute(
+                """UPDATE jobs SET status=?, attempts=?, resumed=1, error=?, not_before=?,
+                   updated_at=? WHERE path=?""",
+                (status, attempts, error, now + retry_backoff * attempts, now, path),
+            )
+            self._conn.commit()
+        return status
+
+    def retry_dead(self) -> int:
+        """Move every dead-lettered job back to the queue."""
+        cursor = self._execute(
+            "UPDATE jobs SET status=?, attempts=0, not_before=0, updated_at=? WHERE status=?",
+            (PENDING, time.time(), DEAD),
+        )
+        if cursor.rowcount:
+            self._wakeup.set()
+        return cursor.rowcount
+
+    def next_retry_in(self) -> Optional[float]:
+        """Seconds until the earliest backed-off job becomes ready, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(not_before) FROM jobs WHERE status=?", (PENDING,)
+            ).fetchone()
+        if not row or row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def wait(self, timeout: Optional[float]):
+        """Block until a job is enqueued or `timeout` seconds pass."""
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def jobs(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = """SELECT path, status, attempts, chunks_done, chunks_total, error, updated_at
+                 FROM jobs"""
+        params: tuple = ()
+        if status:
+            sql += " WHERE status=?"
+            params = (status,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY enqueued_at", params).fetchall()
+        keys = ["path", "status", "attempts", "chunks_done", "chunks_total", "error", "updated_at"]
+        return [dict(zip(keys, row)) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {PENDING: 0, PROCESSING: 0, DONE: 0, DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def status_report(self) -> str:
+        counts = self.counts()
+        lines = [
+            f"Queue depth: {counts[PENDING] + counts[PROCESSING]} "
+            f"(pending {counts[PENDING]}, processing {counts[PROCESSING]}) | "
+            f"done {counts[DONE]} | dead {counts[DEAD]}"
+        ]
+        for status in (PROCESSING, PENDING):
+            for job in self.jobs(status):
+                total = job["chunks_total"]
+                progress = f"{job['chunks_done']}/{total} chunks" if total else "waiting"
+                retry = f", attempt {job['attempts'] + 1}" if job["attempts"] else ""
+                lines.append(f"  [{status}] {job['path']}: {progress}{retry}")
+        dead = self.jobs(DEAD)
+        if dead:
+            lines.append("Dead-letter list:")
+            for job in dead:
+                lines.append(f"  {job['path']} ({job['attempts']} attempts): {job['error']}")
+        return "\n".join(lines)
+
+
+def start_watcher(folder: str, queue: IngestQueue, poll_interval: float = 10):
+    """
+    Watch `folder` for new files and enqueue them.
+
+    Uses watchdog (inotify on Linux, FSEvents/ReadDirectoryChangesW elsewhere).
+    If watchdog is not installed, falls back to listing the folder every
+    `poll_interval` seconds in a daemon thread.
+    """
+    def should_queue(path: str) -> bool:
+        name = os.path.basename(path)
+        return not name.startswith("ingested_") and not name.startswith(".")
+
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        print("watchdog is not installed, falling back to polling the data folder.")
+
+        def poll():
+            while True:
+                for file in os.listdir(folder):
+                    path = os.path.join(folder, file)
+                    if should_queue(path) and os.path.isfile(path):
+                        queue.enqueue(path)
+                time.sleep(poll_interval)
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        return thread
+
+    class _Handler(FileSystemEventHandler):
+        # Files are queued once they are fully written (close) or moved into place.
+        # Close events only exist on inotify, so on other platforms a created or
+        # modified file is queued after `settle_delay` seconds without further events.
+        def __init__(self):
+            super().__init__()
+            self._timers: Dict[str, threading.Timer] = {}
+            self._lock = threading.Lock()
+
+        def _cancel(self, path: str):
+            with self._lock:
+                timer = self._timers.pop(path, None)
+            if timer:
+                timer.cancel()
+
+        def _settle(self, path: str):
+            timer = threading.Timer(settle_delay, self._settled, (path,))
+            timer.daemon = True
+            with self._lock:
+                previous = self._timers.get(path)
+                self._timers[path] = timer
+            if previous:
+                previous.cancel()
+            timer.start()
+
+        def _settled(self, path: str):
+            with self._lock:
+                # A later event for the path has started a newer timer
+                if self._timers.get(path) is not threading.current_thread():
+                    return
+                del self._timers[path]
+            if os.path.isfile(path):
+                queue.enqueue(path)
+
+        def on_created(self, event):
+            if not event.is_directory and should_queue(event.src_path):
+                self._settle(event.src_path)
+
+        on_modified = on_created
+
+        def on_closed(self, event):
+            if not event.is_directory and should_queue(event.src_path):
+                self._cancel(event.src_path)
+                queue.enqueue(event.src_path)
+
+        def on_moved(self, event):
+            self._cancel(event.src_path)
+            if not event.is_directory and should_queue(event.dest_path):
+                self._cancel(event.dest_path)
+                queue.enqueue(event.dest_path)
+
+    observer = Observer()
+    observer.schedule(_Handler(), folder, recursive=False)
+    observer.start()
+    return observer
@@ -0,0 +1,100 @@
+# intent_classifier.py
+
+# Local small-talk / intent classifier on the nomic-embed-text embeddings.
+# Labelled example phrases live in intent_prototypes.json; each label is
+# represented by the normalized mean (centroid) of its examples and a query gets
+# the label of the closest centroid. Confident small talk is answered from the
+# canned responses in the same file without any LLM call; low-confidence queries
+# are left to the LLM router. The file is re-read whenever it changes, so
+# prototypes and responses can be edited on a running deployment.
+import json
+import os
+import random
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+default_prototypes_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_prototypes.json")
+
+
+@dataclass
+class IntentResult:
+    label: str
+    similarity: float       # Cosine similarity to the winning centroid
+    margin: float           # Lead over the best centroid of the other kind (small talk vs not)
+    is_small_talk: bool
+    confident: bool
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class IntentClassifier:
+    def __init__(self, embeddings: Embeddings, path: str = default_prototypes_path,
+                 min_similarity: float = 0.75, min_margin: float = 0.05):
+        self.embeddings = embeddings
+        self.path = path
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._mtime = 0.0
+        self._lock = threading.Lock()
+        self.labels: List[str] = []
+        self.small_talk_labels: set = set()
+        self.responses: Dict[str, List[str]] = {}
+        self.centroids: Optional[np.ndarray] = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Rebuild the centroids if the prototypes file changed since the last load."""
+        mtime = os.path.getmtime(self.path)
+        if mtime <= self._mtime:
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            prototypes = json.load(f)
+        labels, centroids = [], []
+        for label, examples in prototypes["examples"].items():
+            if not examples:
+                continue
+            vectors = np.asarray(self.embeddings.embed_documents(examples), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            centroid = vectors.mean(axis=0)
+            labels.append(label)
+            centroids.append(centroid / max(float(np.linalg.norm(centroid)), 1e-12))
+        with self._lock:
+            self.labels = labels
+            self.centroids = np.vstack(centroids) if centroids else None
+            self.small_talk_labels = set(prototypes.get("small_talk_labels", []))
+            self.responses = prototypes.get("responses", {})
+            self._mtime = mtime
+        print(f"Loaded {len(labels)} intent prototypes from {self.path}")
+        return True
+
+    def classify(self, query: str) -> Optional[IntentResult]:
+        try:
+            self.refresh()
+        except (OSError, ValueError, KeyError) as e:
+            # Keep serving the last good prototypes if an edit left the file unreadable
+            print(f"Could not reload intent prototypes: {e}")
+        with self._lock:
+            labels, centroids, small_talk_labels = self.labels, self.centroids, self.small_talk_labels
+        if centroids is None:
+            return None
+        q = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        similarities = centroids @ q
+        best = int(np.argmax(similarities))
+        is_small_talk = labels[best] in small_talk_labels
+        other_kind = [s for label, s in zip(labels, similarities) if (label in small_talk_labels) != is_small_talk]
+        margin = float(similarities[best] - max(other_kind)) if other_kind else 1.0
+        similarity = float(similarities[best])
+        return IntentResult(
+            label=labels[best], similarity=similarity, margin=margin, is_small_talk=is_small_talk,
+            confident=similarity >= self.min_similarity and margin >= self.min_margin,
+        )
+
+    def canned_response(self, label: str) -> Optional[str]:
+        with self._lock:
+            options = self.responses.get(label)
+        return random.choice(options) if options else None
@@ -0,0 +1,240 @@
+# ivf_index.py
+
+# Approximate nearest-neighbour search for large corpora, layered on the
+# memory-mapped export from mmap_index.py. Rows are partitioned with spherical
+# k-means (IVF) and each row is stored as int8 scalar-quantized codes, a
+# quarter of the float32 size, laid out contiguously per list. A query scans
+# only the `nprobe` closest lists on the codes, then reranks the best
+# candidates exactly against the full vectors in embeddings.npy.
+# `nprobe` is the recall/latency knob: more lists probed, higher recall.
+#
+# Usage (from final_backend/, after `python mmap_index.py export`):
+#   python ivf_index.py build [--lists 1024]
+#   python ivf_index.py recall --k 10 --nprobe 1 4 8 16 32
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from mmap_index import MmapIndex, MmapVectorStore, default_index_path, block_rows
+
+kmeans_iterations = 10
+train_rows_per_list = 64    # Training sample size per list, as in the usual IVF recipes
+max_train_rows = 200_000
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+
+def _assign(matrix, centroids: np.ndarray) -> np.ndarray:
+    """Closest centroid (by cosine) for every row, computed block by block."""
+    labels = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(sample: np.ndarray, n_lists: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on normalized rows."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(kmeans_iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Re-seed empty lists from random rows so no centroid is wasted
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def build_ivf(path: str = default_index_path, n_lists: Optional[int] = None, seed: int = 0) -> Dict[str, Any]:
+    """Train the coarse partition and quantizer on an exported index and write the IVF files next to it."""
+    base = MmapIndex(path)
+    rows = len(base)
+    n_lists = n_lists or max(1, int(4 * np.sqrt(rows)))
+    n_lists = min(n_lists, rows)
+    rng = np.random.default_rng(seed)
+    train_size = min(rows, max(n_lists, min(max_train_rows, n_lists * train_rows_per_list)))
+    sample = np.asarray(base.matrix[np.sort(rng.choice(rows, train_size, replace=False))], dtype=np.float32)
+
+    centroids = train_centroids(sample, n_lists, seed)
+    # Per-dimension int8 scalar quantizer fitted on the sample; outliers are clipped
+    low = sample.min(axis=0)
+    scale = np.maximum(sample.max(axis=0) - low, 1e-12) / 255.0
+
+    labels = _assign(base.matrix, centroids)
+    order = np.argsort(labels, kind="stable")
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))]).astype(np.int64)
+
+    codes_path = os.path.join(path, "ivf_codes.npy")
+    codes = np.lib.format.open_memmap(codes_path + ".tmp", mode="w+", dtype=np.int8, shape=base.matrix.shape)
+    for start in range(0, rows, block_rows):
+        block = np.asarray(base.matrix[order[start:start + block_rows]], dtype=np.float32)
+        codes[start:start + len(block)] = np.clip(np.rint((block - low) / scale) - 128, -128, 127)
+    codes.flush()
+    del codes
+    os.replace(codes_path + ".tmp", codes_path)
+    for name, array in [("ivf_centroids", centroids.astype(np.float32)), ("ivf_rows", order.astype(np.int64)),
+                        ("ivf_offsets", list_offsets), ("ivf_low", low.astype(np.float32)),
+                        ("ivf_scale", scale.astype(np.float32))]:
+        np.save(os.path.join(path, name + ".tmp.npy"), array)
+        os.replace(os.path.join(path, name + ".tmp.npy"), os.path.join(path, name + ".npy"))
+
+    # Written last and tied to the export, so a re-export without a rebuild is detected
+    ivf_manifest = {"lists": n_lists, "rows": rows, "export_created_at": base.manifest["created_at"],
+                    "train_rows": train_size, "created_at": time.time()}
+    manifest_path = os.path.join(path, "ivf_manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(ivf_manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return ivf_manifest
+
+
+class IvfIndex(MmapIndex):
+    """MmapIndex whose search probes the IVF lists instead of scanning every row."""
+
+    def __init__(self, path: str = default_index_path, nprobe: int = 8, rerank_factor: int = 4):
+        self.nprobe = nprobe
+        self.rerank_factor = rerank_factor
+        self.ivf_manifest = None
+        self._ivf_manifest_mtime = 0.0
+        super().__init__(path)
+
+    def refresh(self) -> bool:
+        """Re-map the export and/or the IVF files when either has been rebuilt."""
+        export_changed = super().refresh()
+        # `python ivf_index.py build` after a re-export only rewrites ivf_manifest.json
+        # Read from the directory the export was mapped from, not through the link, so both match
+        manifest_path = os.path.join(self.index_dir, "ivf_manifest.json")
+        try:
+            ivf_mtime = os.path.getmtime(manifest_path)
+        except OSError:
+            ivf_mtime = 0.0
+        if not export_changed and ivf_mtime == self._ivf_manifest_mtime:
+            return False
+        self._ivf_manifest_mtime = ivf_mtime
+        self.ivf_manifest = None
+        try:
+            with open(manifest_path) as f:
+                ivf_manifest = json.load(f)
+        except OSError:
+            ivf_manifest = None
+        if not ivf_manifest or ivf_manifest["export_created_at"] != self.manifest["created_at"]:
+            print(f"No IVF index matches the export at {self.path}; falling back to exact search. "
+                  f"Run `python ivf_index.py build` to create one.")
+            return True
+        load = lambda name: np.load(os.path.join(self.index_dir, name + ".npy"), mmap_mode="r")
+        try:
+            arrays = [load(name) for name in
+                      ("ivf_centroids", "ivf_offsets", "ivf_rows", "ivf_codes", "ivf_low", "ivf_scale")]
+        except OSError:
+            # Removed along with a superseded export; exact search until the next refresh
+            self._ivf_manifest_mtime = 0.0
+            return True
+        centroids, list_offsets, self.list_rows, self.codes, low, scale = arrays
+        self.centroids, self.list_offsets = np.asarray(centroids), np.asarray(list_offsets)
+        self.low, self.scale = np.asarray(low), np.asarray(scale)
+        self.ivf_manifest = ivf_manifest
+        return True
+
+    def candidates(self, q: np.ndarray, nprobe: int, n: int) -> np.ndarray:
+        """Row numbers of the `n` best rows by quantized score within the `nprobe` closest lists."""
+        probe = np.argpartition(-(self.centroids @ q), min(nprobe, len(self.centroids)) - 1)[:nprobe]
+        ranges = [(self.list_offsets[p], self.list_offsets[p + 1]) for p in probe]
+        positions = np.concatenate([np.arange(lo, hi) for lo, hi in ranges]) if ranges else np.empty(0, np.int64)
+        if not len(positions):
+            return positions
+        # q . (scale * (code + 128) + low) ranks the same as (q * scale) . code
+        approx = np.asarray(self.codes[positions], dtype=np.float32) @ (q * self.scale)
+        n = min(n, len(positions))
+        best = np.argpartition(-approx, n - 1)[:n]
+        return np.asarray(self.list_rows[positions[best]])
+
+    def search(self, query_vector, k: int, rows: Optional[List[int]] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        # A restricted search (entity filter) is small enough to score exactly
+        if self.ivf_manifest is None or rows is not None:
+            return super().search(query_vector, k, rows=rows)
+        q = np.asarray(query_vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        rows = np.sort(self.candidates(q, nprobe or self.nprobe, k * self.rerank_factor))
+        if not len(rows):
+            return []
+        # Exact rerank on the full vectors; only these rows are paged in
+        exact = np.asarray(self.matrix[rows], dtype=np.float32) @ q
+        top = np.argsort(-exact)[:k]
+        return [(int(rows[i]), float(exact[i])) for i in top]
+
+
+class IvfVectorStore(MmapVectorStore):
+    """MmapVectorStore served through the IVF index."""
+
+    def __init__(self, embeddings: Embeddings, path: str = default_index_path, nprobe: int = 8,
+                 rerank_factor: int = 4):
+        self.embeddings = embeddings
+        self.index = IvfIndex(path, nprobe, rerank_factor)
+
+
+def measure_recall(index: IvfIndex, k: int, nprobes: List[int], queries: int, seed: int = 0) -> List[Dict[str, float]]:
+    """
+    Recall@k of IVF search against exact search, using chunks sampled from the
+    collection itself as queries (lightly perturbed so the query is not its own
+    exact duplicate).
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(index), min(queries, len(index)), replace=False)
+    vectors = np.asarray(index.matrix[np.sort(sample)], dtype=np.float32)
+    vectors = _normalize(vectors + rng.normal(0, 0.02, vectors.shape).astype(np.float32))
+
+    start = time.perf_counter()
+    truth = [{row for row, _ in MmapIndex.search(index, v, k)} for v in vectors]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(vectors)
+    results = []
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        found = [{row for row, _ in index.search(v, k, nprobe=nprobe)} for v in vectors]
+        latency_ms = (time.perf_counter() - start) * 1000 / len(vectors)
+        recall = float(np.mean([len(f & t) / len(t) for f, t in zip(found, truth) if t]))
+        results.append({"nprobe": nprobe, "recall": recall, "latency_ms": latency_ms, "exact_ms": exact_ms})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or evaluate the IVF index over the mmap export.")
+    parser.add_argument("--path", default=default_index_path)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Train and write the IVF lists and int8 codes")
+    build.add_argument("--lists", type=int, help="Number of IVF lists (default 4 * sqrt(rows))")
+    recall = sub.add_parser("recall", help="Measure recall@k against exact search")
+    recall.add_argument("--k", type=int, default=10)
+    recall.add_argument("--queries", type=int, default=200)
+    recall.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    recall.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        manifest = build_ivf(args.path, args.lists)
+        print(f"Built {manifest['lists']} lists over {manifest['rows']} rows "
+              f"in {time.perf_counter() - start:.2f}s")
+    else:
+        index = IvfIndex(args.path, rerank_factor=args.rerank_factor)
+        if index.ivf_manifest is None:
+            raise SystemExit(1)
+        print(f"recall@{args.k} over {args.queries} queries, {index.ivf_manifest['lists']} lists")
+        for row in measure_recall(index, args.k, args.nprobe, args.queries):
+            print(f"  nprobe={row['nprobe']:<4} recall={row['recall']:.3f} "
+                  f"latency={row['latency_ms']:.2f} ms (exact {row['exact_ms']:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# loaders.py
+
+# Parsing and splitting helpers used by the ingestion pipeline.
+# Kept free of module-level model / vector store setup so that the functions
+# can be pickled and run inside worker processes without opening Chroma or
+# connecting to Ollama in every worker.
+import csv
+import os
+import re
+import time
+from bisect import bisect_right
+from html.parser import HTMLParser
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+# File types the pipeline can ingest. Everything except PDF is read directly
+# and streamed into the splitter without any rendering step.
+SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".md", ".markdown", ".csv", ".html", ".htm"}
+max_unit_chars = 20_000     # Longest block a text/markdown/html unit may grow to before it is emitted
+
+
+def make_splitter(chunk_size: int, chunk_overlap: int, add_start_index: bool = False) -> RecursiveCharacterTextSplitter:
+    """Build the text splitter used for every ingested document."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=[
+            "\n", ","], add_start_index=add_start_index
+    )
+
+
+def file_type(file_path: str) -> str:
+    return os.path.splitext(file_path)[1].lower()
+
+
+def is_supported(file_path: str) -> bool:
+    return file_type(file_path) in SUPPORTED_EXTENSIONS
+
+
+def load_and_split(file_path: str, chunk_size: int, chunk_overlap: int) -> Tuple[str, List[Document], Dict[str, float]]:
+    """
+    Parse and split a single file. Safe to run in a worker process.
+
+    Returns:
+        (file_path, chunks, timings) where timings holds the seconds spent
+        in the 'parse' and 'split' stages.
+    """
+    timings = {"parse": 0.0, "split": 0.0}
+    if not is_supported(file_path):
+        return file_path, [], timings
+
+    # A single unbounded window gives the same chunks (and chunk ids) as streaming the file,
+    # so a document splits the same way on either side of the streaming size threshold
+    chunks = [chunk for window in iter_file_chunks(file_path, chunk_size, chunk_overlap, 0, timings)
+              for chunk in window]
+    return file_path, chunks, timings
+
+
+def _read_blocks(file_path: str) -> Iterator[Tuple[int, str]]:
+    """Yield (first line number, text) blocks of a text file, split on blank lines."""
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        lines, start_line, size = [], 1, 0
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                if lines:
+                    yield start_line, "".join(lines).strip()
+                lines, size = [], 0
+                continue
+            if not lines:
+                start_line = number
+            lines.append(line)
+            size += len(line)
+            if size >= max_unit_chars:
+                yield start_line, "".join(lines).strip()
+                lines, size = [], 0
+        if lines:
+            yield start_line, "".join(lines).strip()
+
+
+def iter_text_units(file_path: str) -> Iterator[Document]:
+    for line, text in _read_blocks(file_path):
+        yield Document(page_content=text, metadata={"source": file_path, "line": line})
+
+
+def iter_markdown_units(file_path: str) -> Iterator[Document]:
+    """Yield markdown blocks tagged with the heading of the section they belong to."""
+    section = ""
+    for line, text in _read_blocks(file_path):
+        heading = re.match(r"^#{1,6}\s+(.*)", text)
+        if heading:
+            section = heading.group(1).splitlines()[0].strip()
+        yield Document(page_content=text,
+                       metadata={"source": file_path, "line": line, "section": section})
+
+
+def iter_csv_units(file_path: str) -> Iterator[Document]:
+    """Yield one unit per CSV row, rendered as 'column: value' lines so every chunk is self-describing."""
+    with open(file_path, "r", encoding="utf-8", errors="replace", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return
+        header = [name.strip() or f"column_{i + 1}" for i, name in enumerate(header)]
+        for number, row in enumerate(reader, start=1):
+            fields = [f"{name}: {value.strip()}" for name, value in zip(header, row) if value.strip()]
+            if fields:
+                yield Document(page_content="\n".join(fields),
+                               metadata={"source": file_path, "row": number})
+
+
+class _SectionParser(HTMLParser):
+    """Collects visible HTML text, closing a section at every heading."""
+    _skip_tags = {"script", "style", "noscript", "template", "head"}
+    _block_tags = {"p", "div", "br", "li", "tr", "table", "section", "article", "ul", "ol"}
+    _heading_tags = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.sections: List[Tuple[str, str]] = []
+        self._heading = ""
+        self._parts: List[str] = []
+        self._heading_parts: Optional[List[str]] = None
+        self._skip_depth = 0
+
+    def _flush(self):
+        text = re.sub(r"[ \t]+", " ", "".join(self._parts))
+        text = re.sub(r"\s*\n\s*", "\n", text).strip()
+        if text:
+            self.sections.append((self._heading, text))
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._skip_tags:
+            self._skip_depth += 1
+        elif tag in self._heading_tags:
+            self._flush()
+            self._heading_parts = []
+        elif tag in self._block_tags:
+            self._parts.append("\n")
+        elif tag in ("td", "th") and self._parts and not self._parts[-1].endswith("\n"):
+            self._parts.append(", ")
+
+    def handle_endtag(self, tag):
+        if tag in self._skip_tags:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self._heading_tags and self._heading_parts is not None:
+            self._heading = " ".join("".join(self._heading_parts).split())
+            self._parts.append(self._heading + "\n")
+            self._heading_parts = None
+        elif tag in self._block_tags:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._heading_parts is not None:
+            self._heading_parts.append(data)
+        else:
+            self._parts.append(data)
+            if sum(len(part) for part in self._parts[-50:]) >= max_unit_chars:
+                self._flush()
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def iter_html_units(file_path: str, read_size: int = 64 * 1024) -> Iterator[Document]:
+    """Feed the HTML file to the parser incrementally and yield each section as it completes."""
+    parser = _SectionParser()
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(read_size)
+            if not block:
+                break
+            parser.feed(block)
+            while parser.sections:
+                heading, text = parser.sections.pop(0)
+                yield Document(page_content=text, metadata={"source": file_path, "section": heading})
+    parser.close()
+    for heading, text in parser.sections:
+        yield Document(page_content=text, metadata={"source": file_path, "section": heading})
+
+
+def iter_units(file_path: str) -> Iterator[Document]:
+    """Lazily load a supported file as a stream of units (pages, blocks, sections or rows)."""
+    extension = file_type(file_path)
+    if extension == ".pdf":
+        return PyPDFLoader(file_path=file_path).lazy_load()
+    if extension in (".md", ".markdown"):
+        return iter_markdown_units(file_path)
+    if extension == ".csv":
+        return iter_csv_units(file_path)
+    if extension in (".html", ".htm"):
+        return iter_html_units(file_path)
+    if extension == ".txt":
+        return iter_text_units(file_path)
+    raise ValueError(f"Unsupported file type: {file_path}")
+
+
+def _timed(units: Iterable[Document], timings: Dict[str, float], stage: str) -> Iterator[Document]:
+    """Yield from a lazy loader, charging the time spent producing each unit to `stage`."""
+    iterator = iter(units)
+    while True:
+        start = time.perf_counter()
+        try:
+            unit = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+        yield unit
+
+
+def _windows(units: Iterable[Document], window_chars: int) -> Iterator[List[Document]]:
+    """Group units into windows of roughly `window_chars` characters (0 means a single window)."""
+    window, size = [], 0
+    for unit in units:
+        window.append(unit)
+        size += len(unit.page_content)
+        if window_chars and size >= window_chars:
+            yield window
+            window, size = [], 0
+    if window:
+        yield window
+
+
+def iter_windowed_chunks(units: Iterable[Document], chunk_size: int, chunk_overlap: int,
+                         window_chars: int, timings: Optional[Dict[str, float]] = None) -> Iterator[List[Document]]:
+    """
+    Split a lazily loaded document window by window with bounded memory.
+
+    `units` (pages, sections, rows, ...) are gathered into windows of about
+    `window_chars` characters and each window is split as one continuous text,
+    so chunks and their overlap span unit boundaries. The last chunk of every
+    window is held back and re-split together with the next window, so chunks
+    across window seams come out as if the whole document had been split at
+    once. Each chunk takes the metadata of the unit it starts in. Yields one
+    list of chunks per window.
+    """
+    timings = timings if timings is not None else {}
+    splitter = make_splitter(chunk_size, chunk_overlap, add_start_index=True)
+    windows = _windows(_timed(units, timings, "parse"), window_chars)
+    carry: Optional[Document] = None
+    window = next(windows, None)
+    while window:
+        next_window = next(windows, None)
+        start = time.perf_counter()
+
+        # Continuous text for this window, remembering where each unit starts
+        parts, offsets, metadatas, position = [], [], [], 0
+        for unit in ([carry] if carry else []) + window:
+            if parts:
+                parts.append("\n")
+                position += 1
+            offsets.append(position)
+            metadatas.append(unit.metadata)
+            parts.append(unit.page_content)
+            position += len(unit.page_content)
+
+        chunks = []
+        for chunk in splitter.create_documents(["".join(parts)]):
+            start_index = chunk.metadata.pop("start_index", 0)
+            owner = metadatas[max(0, bisect_right(offsets, max(start_index, 0)) - 1)]
+            chunks.append(Document(page_content=chunk.page_content, metadata=dict(owner)))
+
+        carry = None
+        if next_window and chunks:
+            carry = chunks.pop()
+        timings["split"] = timings.get("split", 0.0) + time.perf_counter() - start
+        if chunks:
+            yield chunks
+        window = next_window
+
+
+def iter_file_chunks(file_path: str, chunk_size: int, chunk_overlap: int, window_chars: int,
+                     timings: Optional[Dict[str, float]] = None) -> Iterator[List[Document]]:
+    """Stream any supported file unit by unit and yield its chunks one window at a time."""
+    return iter_windowed_chunks(iter_units(file_path), chunk_size, chunk_overlap, window_chars, timings)
@@ -0,0 +1,274 @@
+# mmap_index.py
+
+# Read-optimized serving index exported from the Chroma collection.
+# Embeddings are written to a memory-mapped .npy matrix (float32 or float16,
+# rows L2-normalized) with the chunk texts and metadata in a JSON-lines
+# sidecar. Serving processes map the files read-only, so every worker shares
+# the OS page cache instead of holding its own copy, startup is a few mmap
+# calls, and exact top-k search is a single vectorized matmul.
+#
+# Usage (from final_backend/):
+#   python mmap_index.py export [--dtype float16] [--out ./db/mmap_index]
+#   python mmap_index.py search "what is a SIP" [--k 3]
+import argparse
+import json
+import mmap
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+default_index_path = "./db/mmap_index"
+block_rows = 65536  # Rows upcast per block when searching a float16 matrix
+
+
+def export_collection(vector_store, out_dir: str = default_index_path, dtype: str = "float32",
+                      page_size: int = 5000) -> Dict[str, Any]:
+    """
+    Write every chunk of the Chroma collection to a memory-mappable index.
+    Each export is built in its own directory next to `out_dir`; `out_dir` is
+    a symlink to the current one and is repointed atomically when complete.
+    """
+    collection = vector_store._collection
+    count = collection.count()
+    if not count:
+        raise ValueError("The collection is empty, nothing to export.")
+    out_dir = out_dir.rstrip("/")
+    tmp_dir = f"{out_dir}.{time.time_ns()}"
+    os.makedirs(tmp_dir)
+
+    matrix = None
+    ids: List[str] = []
+    offsets = [0]
+    row = 0
+    with open(os.path.join(tmp_dir, "chunks.jsonl"), "wb") as sidecar:
+        while row < count:
+            page = collection.get(include=["embeddings", "documents", "metadatas"],
+                                  limit=page_size, offset=row)
+            if not len(page["ids"]):
+                break
+            vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(
+                    os.path.join(tmp_dir, "embeddings.npy"), mode="w+",
+                    dtype=np.dtype(dtype), shape=(count, vectors.shape[1]))
+            # Stop at the size counted up front if ingestion added chunks meanwhile
+            vectors = vectors[:count - row]
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            matrix[row:row + len(vectors)] = vectors / np.where(norms == 0, 1, norms)
+            for cid, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                if len(ids) == row + len(vectors):
+                    break
+                line = json.dumps({"id": cid, "text": text, "metadata": metadata or {}}).encode("utf-8") + b"\n"
+                sidecar.write(line)
+                offsets.append(offsets[-1] + len(line))
+                ids.append(cid)
+            row += len(vectors)
+    matrix.flush()
+    rows = len(ids)
+    del matrix
+
+    # Sorted id table for id -> row lookups without building a dict at startup
+    id_array = np.array(ids, dtype=f"S{max(len(cid) for cid in ids)}")
+    order = np.argsort(id_array)
+    np.save(os.path.join(tmp_dir, "ids_sorted.npy"), id_array[order])
+    np.save(os.path.join(tmp_dir, "ids_order.npy"), order.astype(np.int64))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    manifest = {"rows": rows, "dim": int(np.load(os.path.join(tmp_dir, "embeddings.npy"), mmap_mode="r").shape[1]),
+                "dtype": dtype, "created_at": time.time()}
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap the finished index in; readers pick it up on their next refresh, and
+    # a reader that resolved the link before the swap keeps its own version's files
+    previous = os.path.realpath(out_dir) if os.path.islink(out_dir) else None
+    if os.path.isdir(out_dir) and not os.path.islink(out_dir):
+        # Export written before versioned directories; moved aside once
+        previous = out_dir + ".old"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(out_dir, previous)
+    link_tmp = out_dir + ".link"
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    os.symlink(os.path.basename(tmp_dir), link_tmp)
+    os.replace(link_tmp, out_dir)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+class MmapIndex:
+    """Read-only view of an exported index with exact top-k search."""
+
+    def __init__(self, path: str = default_index_path):
+        self.path = path
+        self.index_dir = None       # Export directory the current maps were loaded from
+        self._manifest_mtime = 0.0
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """
+        Re-map the files if a newer export has been swapped in. If the files cannot
+        be read (an export being swapped or cleaned up), the current maps stay in use.
+        """
+        index_dir = os.path.realpath(self.path)
+        manifest_path = os.path.join(index_dir, "manifest.json")
+        try:
+            mtime = os.path.getmtime(manifest_path)
+            if index_dir == self.index_dir and mtime <= self._manifest_mtime:
+                return False
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            load = lambda name: np.load(os.path.join(index_dir, name + ".npy"), mmap_mode="r")
+            # Slicing a memmap is a view; rows beyond the manifest count are unused padding
+            matrix = load("embeddings")[:manifest["rows"]]
+            offsets, ids_sorted, ids_order = load("offsets"), load("ids_sorted"), load("ids_order")
+            with open(os.path.join(index_dir, "chunks.jsonl"), "rb") as f:
+                sidecar = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            if self.index_dir is None:
+                raise
+            return False
+        self.manifest, self.matrix, self._sidecar = manifest, matrix, sidecar
+        self.offsets, self.ids_sorted, self.ids_order = offsets, ids_sorted, ids_order
+        self.index_dir, self._manifest_mtime = index_dir, mtime
+        return True
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def record(self, row: int) -> Dict[str, Any]:
+        return json.loads(self._sidecar[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def rows_for_ids(self, ids: List[str]) -> List[int]:
+        if not ids:
+            return []
+        keys = np.array([cid.encode("utf-8") for cid in ids], dtype=self.ids_sorted.dtype)
+        positions = np.searchsorted(self.ids_sorted, keys)
+        rows = []
+        for key, position in zip(keys, positions):
+            if position < len(self.ids_sorted) and self.ids_sorted[position] == key:
+                rows.append(int(self.ids_order[position]))
+        return rows
+
+    def scores(self, query_vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarity of the query against every row, or only against `rows`."""
+        q = np.asarray(query_vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        if rows is not None:
+            return np.asarray(self.matrix[rows], dtype=np.float32) @ q
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ q
+        # float16 matmul is slow on most CPUs; upcast one block at a time instead of the whole matrix
+        out = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), block_rows):
+            out[start:start + block_rows] = self.matrix[start:start + block_rows].astype(np.float32) @ q
+        return out
+
+    def search(self, query_vector, k: int, rows: Optional[List[int]] = None) -> List[Tuple[int, float]]:
+        """Exact top-k over every row, or over the `rows` subset when given."""
+        rows = np.sort(np.asarray(rows, dtype=np.int64)) if rows is not None else None
+        scores = self.scores(query_vector, rows)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+def _document(record: Dict[str, Any], **extra) -> Document:
+    return Document(id=record["id"], page_content=record["text"], metadata=dict(record["metadata"], **extra))
+
+
+class MmapVectorStore:
+    """
+    Serving-side stand-in for the Chroma store. Implements the subset of the
+    LangChain vector store interface the retrievers use, backed by MmapIndex.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: str = default_index_path):
+        self.embeddings = embeddings
+        self.index = MmapIndex(path)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4,
+                                                          ids: Optional[List[str]] = None,
+                                                          **kwargs) -> List[Tuple[Document, float]]:
+        """
+        Returns (document, cosine distance) pairs, matching Chroma's lower-is-better
+        scores. `ids` restricts the search to those chunks, as it does for Chroma.
+        """
+        self.index.refresh()
+        rows = self.index.rows_for_ids(list(ids)) if ids is not None else None
+        hits = self.index.search(embedding, k, rows=rows)
+        return [(_document(self.index.record(row)), 1.0 - score) for row, score in hits]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(self.embeddings.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        rows = self.index.rows_for_ids(ids or [])
+        records = [self.index.record(row) for row in rows]
+        result = {
+            "ids": [r["id"] for r in records],
+            "documents": [r["text"] for r in records],
+            "metadatas": [r["metadata"] for r in records],
+        }
+        if include and "embeddings" in include:
+            # Rows are stored normalized, which is all cosine-based consumers need
+            result["embeddings"] = np.asarray(self.index.matrix[rows], dtype=np.float32) if rows else []
+        return result
+
+    def as_retriever(self, search_kwargs: Optional[Dict[str, Any]] = None) -> "MmapRetriever":
+        return MmapRetriever(store=self, k=(search_kwargs or {}).get("k", 4))
+
+
+class MmapRetriever(BaseRetriever):
+    """LangChain retriever doing exact top-k over the memory-mapped index."""
+    store: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.store.similarity_search(query, k=self.k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or query the memory-mapped serving index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Export the Chroma collection")
+    export.add_argument("--out", default=default_index_path)
+    export.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    search = sub.add_parser("search", help="Run a query against the exported index")
+    search.add_argument("query")
+    search.add_argument("--path", default=default_index_path)
+    search.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        from ingest import vector_store
+        start = time.perf_counter()
+        manifest = export_collection(vector_store, args.out, args.dtype)
+        print(f"Exported {manifest['rows']} chunks ({manifest['dim']}-d {manifest['dtype']}) "
+              f"to {args.out} in {time.perf_counter() - start:.2f}s")
+    else:
+        from models import Models
+        store = MmapVectorStore(Models().embeddings_ollama, args.path)
+        start = time.perf_counter()
+        results = store.similarity_search_with_score(args.query, k=args.k)
+        print(f"Top {len(results)} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for doc, distance in results:
+            print(f"- {distance:.4f} {doc.metadata.get('source', '')}: {doc.page_content[:120]!r}")
+
+
+if __name__ == "__main__":
+    main()
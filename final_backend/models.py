@@ -1,11 +1,14 @@
 import os 
 from langchain_ollama import OllamaEmbeddings, ChatOllama
+from embedding_cache import CachedEmbeddings
 #  from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
 class Models:
     def __init__(self):
         #ollama pull  nomic-embed-text 
-        self.embeddings_ollama = OllamaEmbeddings(
-            model="nomic-embed-text"
+        # Wrapped in an on-disk cache shared by ingest.py and run.py
+        self.embeddings_ollama = CachedEmbeddings(
+            OllamaEmbeddings(model="nomic-embed-text"),
+            model_name="nomic-embed-text",
         )
         #ollama pull llama3.2
         self.model_ollama = ChatOllama(
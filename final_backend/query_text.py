@@ -0,0 +1,25 @@
+# query_text.py
+
+# Lexical helpers shared by the caches in front of the pipeline (answer_cache.py,
+# search_cache.py): a cheap real-time screen, usable before the LLM router's
+# verdict is known, and the normalization that makes trivially different
+# phrasings of a query share one cache key.
+import re
+import unicodedata
+
+REALTIME_HINTS = re.compile(
+    r"\b(today|now|current(ly)?|latest|live|right now|this (week|month)|price|quote|trading at|"
+    r"breaking|news|yesterday|tomorrow)\b",
+    re.IGNORECASE,
+)
+
+
+def looks_realtime(query: str) -> bool:
+    return bool(REALTIME_HINTS.search(query))
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace, quotes and trailing punctuation do not change the question."""
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip("\"'`").rstrip("?!.").strip()
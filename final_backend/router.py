@@ -0,0 +1,61 @@
+# router.py
+
+# One structured LLM call that decides how a query is handled: whether it is
+# small talk, whether it needs real-time data, and whether the retrieved
+# knowledge-base documents are relevant. Replaces three separate yes/no
+# classifier round-trips; the verdict is validated against RouteVerdict and
+# callers fall back to the individual checks when it does not parse.
+from typing import Any, Dict, Optional
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from pydantic import BaseModel, Field
+from vars import get_llm_id, get_llm_provider  # Use centralized provider
+from dotenv import load_dotenv
+
+load_dotenv()
+
+router_llm = get_llm_provider(get_llm_id("remote"), "langchain")
+
+
+class RouteVerdict(BaseModel):
+    is_small_talk: bool = Field(description="Greeting, thanks or conversational filler, not a financial question")
+    needs_realtime: bool = Field(description="Needs current prices, news or live market data")
+    rag_relevant: bool = Field(description="The retrieved documents help answer the question")
+
+
+prompt_for_routing = PromptTemplate(
+    template="""You are the router of a financial assistant. Classify the user's question and judge the documents retrieved from the internal knowledge base.
+
+    Decide:
+    - is_small_talk: true if the question is only a greeting, a thank you, or conversational filler ("Hello", "Thanks!", "Who are you?"), false for any request for financial information, analysis or research.
+    - needs_realtime: true if answering requires CURRENT, up-to-the-minute information like stock prices, breaking news, or live market status.
+    - rag_relevant: true if ANY of the retrieved documents is relevant to the question, false if none are or there are no documents.
+
+    Question: {question}
+
+    Retrieved documents:
+    {documents}
+
+    Provide the verdict ONLY as JSON within ```json markdown code fences, with exactly these keys. Example:
+    ```json
+    {{
+      "is_small_talk": false,
+      "needs_realtime": true,
+      "rag_relevant": false
+    }}
+    ```
+    """,
+    input_variables=["question", "documents"],
+)
+
+router_chain = prompt_for_routing | router_llm | JsonOutputParser()
+
+
+def _documents_text(documents: str) -> str:
+    return documents if documents else "No documents were retrieved."
+
+
+async def aroute(question: str, documents: str = "", config: Optional[Dict[str, Any]] = None) -> RouteVerdict:
+    """Raises on unparseable or invalid output, so callers can fall back."""
+    result = await router_chain.ainvoke({"question": question, "documents": _documents_text(documents)}, config=config)
+    return RouteVerdict.model_validate(result)
@@ -1,20 +1,56 @@
 # run.py
 
-# Assuming this initializes and returns a Chroma/FAISS etc. vector store
-from ingest import vector_store
+from vars import (
+    RETRIEVAL_BACKEND, MMAP_INDEX_PATH, IVF_NPROBE, IVF_RERANK_FACTOR,
+    RETRIEVAL_K, RETRIEVAL_FETCH_K, MMR_LAMBDA
+)
+from hybrid_retriever import BM25Index, HybridRetriever
+from entities import EntityIndex, extract_entities
+if RETRIEVAL_BACKEND in ("mmap", "ivf"):
+    # Serve from the memory-mapped export; no Chroma client or ingest models are loaded
+    from models import Models
+    from mmap_index import MmapVectorStore
+    from ivf_index import IvfVectorStore
+    embeddings = Models().embeddings_ollama
+    if RETRIEVAL_BACKEND == "ivf":
+        vector_store = IvfVectorStore(embeddings, MMAP_INDEX_PATH, IVF_NPROBE, IVF_RERANK_FACTOR)
+    else:
+        vector_store = MmapVectorStore(embeddings, MMAP_INDEX_PATH)
+    keyword_index = BM25Index()
+    keyword_index.refresh()
+    entity_index = EntityIndex()
+    entity_index.refresh()
+else:
+    # Assuming this initializes and returns a Chroma/FAISS etc. vector store
+    from ingest import vector_store, keyword_index, entity_index, embeddings
+from answer_cache import AnswerCache
+from intent_classifier import IntentClassifier, IntentResult
+from web_policy import WebPolicyConfig, decide_web_step, KB_ONLY, DEEP
+from context_budget import ContextAssembler, split_evidence, count_tokens
+from tracing import (
+    span, trace, traced, set_attributes, current_span, record_llm_usage, callback_config,
+    configure as configure_tracing
+)
 from agno.agent import Agent
 from agno.knowledge.langchain import LangChainKnowledgeBase
 # Use centralized LLM providers
 from vars import (
     get_llm_id, get_llm_provider,
-    MAX_SEARCH_CALLS, MAX_DEPTH, VECTOR_STORE_PATH
+    MAX_SEARCH_CALLS, MAX_DEPTH, VECTOR_STORE_PATH,
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES,
+    INTENT_CLASSIFIER_ENABLED, INTENT_MIN_SIMILARITY, INTENT_MIN_MARGIN,
+    WEB_POLICY_MODE, LATENCY_BUDGET_SECONDS, QUICK_WEB_EXPECTED_SECONDS, DEEP_RESEARCH_EXPECTED_SECONDS,
+    KB_MIN_AGREEING_DOCS, SYNTHESIS_RESERVE_TOKENS,
+    TRACING_ENABLED, TRACE_LOG_PATH, METRICS_TEXTFILE_PATH, METRICS_PORT,
+    TAVILY_SEARCH_DEPTH, TAVILY_MAX_RESULTS
 )
 from agno.tools.yfinance import YFinanceTools
 # Import graders and summarizer
-from retrieval_grader import retrieval_grader, small_talk_grader # Keep existing imports if they define other things
+from router import RouteVerdict, aroute
 from deep_research import DeepResearch # Import the modified DeepResearch class
 # from summarizer import summarize # Not currently used for final synthesis
 from tavily import TavilyClient
+from search_cache import CachedTavilyClient, shared_search_cache
 
 import os
 from dotenv import load_dotenv
@@ -27,9 +63,12 @@ from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
 from langchain.output_parsers import BooleanOutputParser # Import Boolean parser
 
-# from retrieval_grader import YesNoParser # Remove if SimpleYesNoParser was defined here
-from typing import Optional, Callable, Dict, Any # Add Dict, Any, Optional, Callable
+from typing import Optional, Callable, Dict, Any, List, Tuple # Add Dict, Any, Optional, Callable
 import traceback # Import traceback for detailed error logging
+import json
+import asyncio
+import concurrent.futures
+import time
 
 load_dotenv()
 console = Console()
@@ -38,7 +77,8 @@ console = Console()
 tavily_api_key = os.environ.get("TAVILY_API_KEY")
 if not tavily_api_key:
     raise ValueError("TAVILY_API_KEY not found in environment variables.")
-tavily_client = TavilyClient(api_key=tavily_api_key)
+# Shares the on-disk search cache with deep research (see search_cache.py)
+tavily_client = CachedTavilyClient(TavilyClient(api_key=tavily_api_key), shared_search_cache())
 
 yf_tool = YFinanceTools(
     stock_price=True,
@@ -57,7 +97,11 @@ researcher = DeepResearch(
 
 # --- Initialize Knowledge Base ---
 try:
-    retriever = vector_store.as_retriever(search_kwargs={'k': 3})
+    # BM25 + dense search fused with reciprocal rank fusion, so exact tickers and codes are found
+    # Over-fetched candidates are reduced to RETRIEVAL_K with MMR so overlapping splits are not repeated
+    retriever = HybridRetriever(vector_store=vector_store, keyword_index=keyword_index,
+                                entity_index=entity_index, k=RETRIEVAL_K,
+                                fetch_k=RETRIEVAL_FETCH_K, mmr_lambda=MMR_LAMBDA)
 except Exception as e:
     print(colored(f"Error initializing vector store/retriever: {e}", "red"))
     print(colored("Knowledge base retrieval will be unavailable.", "yellow"))
@@ -66,6 +110,47 @@ except Exception as e:
 knowledge_base = LangChainKnowledgeBase(
     retriever=retriever) if retriever else None
 
+# --- Initialize Answer Cache ---
+try:
+    answer_cache = AnswerCache(
+        embeddings,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ) if ANSWER_CACHE_ENABLED else None
+except Exception as e:
+    print(colored(f"Error initializing answer cache: {e}", "red"))
+    answer_cache = None
+
+# --- Synthesis Context Budget ---
+SYNTHESIS_DESCRIPTION = """You are a Financial Analyst Synthesizer. Combine information from internal knowledge (RAG Context) and web research (Web/Deep Research Context) to answer the user's original query comprehensively. Prioritize accuracy and recent information. Format clearly using Markdown."""
+context_assembler = ContextAssembler(get_llm_id("remote"), reserve_output_tokens=SYNTHESIS_RESERVE_TOKENS)
+
+# --- Web Step Policy ---
+web_policy = WebPolicyConfig(
+    mode=WEB_POLICY_MODE,
+    latency_budget_seconds=LATENCY_BUDGET_SECONDS,
+    quick_web_expected_seconds=QUICK_WEB_EXPECTED_SECONDS,
+    deep_research_expected_seconds=DEEP_RESEARCH_EXPECTED_SECONDS,
+    kb_min_agreeing_docs=KB_MIN_AGREEING_DOCS,
+)
+
+# --- Tracing ---
+# Every request gets a trace in its result dict; exporters feed per-stage p50/p95 dashboards
+if TRACING_ENABLED:
+    configure_tracing(jsonl_path=TRACE_LOG_PATH, prometheus_path=METRICS_TEXTFILE_PATH, metrics_port=METRICS_PORT)
+
+# --- Initialize Intent Classifier ---
+try:
+    intent_classifier = IntentClassifier(
+        embeddings,
+        min_similarity=INTENT_MIN_SIMILARITY,
+        min_margin=INTENT_MIN_MARGIN,
+    ) if INTENT_CLASSIFIER_ENABLED else None
+except Exception as e:
+    print(colored(f"Error initializing intent classifier: {e}", "red"))
+    intent_classifier = None
+
 # --- Initialize LLMs ---
 # Ensure framework="langchain" is specified when Langchain specific features like parsers are used
 main_llm_langchain = get_llm_provider(get_llm_id("remote"), framework="langchain")
@@ -80,48 +165,26 @@ tool_llm_agno = get_llm_provider(get_llm_id("tool"))
 # ... (display_tool_calls function remains the same) ...
 
 
-# --- Core Processing Function ---
-def process_query_flow(
-    query: str,
-    memory: ConversationBufferMemory,
-    deep_search: bool = False,
-    stream_callback: Optional[Callable[[str], None]] = None
-) -> Dict[str, Any]:
-    print(colored(f"\nProcessing Query: '{query}' (Deep Search: {deep_search})", "white", attrs=["bold"]))
-    final_answer = ""
-    rag_context = ""
-    web_research_context = ""
-    research_debug_log = ""
+# --- Pipeline Stages ---
+# Retrieval is followed by a single routing call (router.py) that decides small
+# talk, real-time need and RAG relevance together. If the verdict cannot be parsed,
+# the individual checks below run concurrently instead. The web step and synthesis
+# stay on the caller's thread: they are sequential anyway and stream through
+# callbacks (e.g. Streamlit placeholders) that must fire on the thread that owns them.
 
-    # === 1. Small Talk Check (Using BooleanOutputParser) ===
+@traced("llm.small_talk_check")
+async def check_small_talk(query: str) -> bool:
     try:
         print(colored("Checking for small talk...", "cyan"))
-        # Use Langchain compatible LLM
-        small_talk_llm = main_llm_langchain
         # Updated prompt for BooleanOutputParser (often works better with true/false but tries yes/no)
         small_talk_prompt = PromptTemplate(
             template="Is the following a simple greeting, pleasantry, or conversational filler (small talk)? Answer ONLY with 'YES' or 'NO'.\n\nQuestion: {question}",
             input_variables=["question"]
         )
-        # Use BooleanOutputParser
-        small_talk_parser = BooleanOutputParser()
-        small_talk_chain = small_talk_prompt | small_talk_llm | small_talk_parser
-
-        # Invoke the chain
-        is_small_talk = small_talk_chain.invoke({"question": query})
+        small_talk_chain = small_talk_prompt | main_llm_langchain | BooleanOutputParser()
+        is_small_talk = await small_talk_chain.ainvoke({"question": query}, config=callback_config())
         print(colored(f"Small talk check result: {is_small_talk}", "magenta"))
-
-        if is_small_talk: # BooleanOutputParser returns True or False
-            print(colored("Query identified as small talk.", "yellow"))
-            # Use Agno compatible LLM for the Agno Agent
-            conv_agent = Agent(
-                model=main_llm_agno,
-                description="You are a friendly assistant.",
-                memory=memory
-            )
-            history = memory.load_memory_variables({})["chat_history"]
-            response = conv_agent.run(f"Respond conversationally to: {query}", chat_history=history)
-            return {"answer": response.content, "deep_research_log": ""}
+        return is_small_talk
     except Exception as e:
         # Catch potential OutputParserException here too
         print(colored(f"Error during small talk check: {e}", "red"))
@@ -129,172 +192,293 @@ def process_query_flow(
              print(colored("Attempting to proceed assuming it's not small talk...", "yellow"))
         else:
              traceback.print_exc() # Print full trace for unexpected errors
-        # Proceed assuming it's not small talk on error
+        return False # Proceed assuming it's not small talk on error
 
 
-    # === 2. RAG Retrieval ===
-    retrieved_docs_content = "No documents found or knowledge base unavailable."
-    retrieved_docs = None
-    if knowledge_base and retriever:
-        try:
-            print(colored("Attempting RAG retrieval...", "cyan"))
-            retrieved_docs = retriever.invoke(query) # Langchain LCEL standard invoke
-
-            if retrieved_docs:
-                retrieved_docs_content = "\n\n".join([doc.page_content for doc in retrieved_docs])
-                print(colored(f"Retrieved {len(retrieved_docs)} snippets.", "green"))
-                print(colored("Retrieved Snippet:", "yellow"))
-                print(colored(retrieved_docs_content[:500] + "...", "yellow"))
-            else:
-                print(colored("No relevant documents found in knowledge base.", "yellow"))
-                retrieved_docs_content = "No relevant documents found in knowledge base."
-        except Exception as e:
-            print(colored(f"Error during RAG retrieval: {e}", "red"))
-            traceback.print_exc()
-            retrieved_docs_content = "Error retrieving documents from knowledge base."
-    else:
+@traced("small_talk_reply")
+async def respond_small_talk(query: str, memory: ConversationBufferMemory, history: list) -> str:
+    print(colored("Query identified as small talk.", "yellow"))
+    # Use Agno compatible LLM for the Agno Agent
+    conv_agent = Agent(
+        model=main_llm_agno,
+        description="You are a friendly assistant.",
+        memory=memory
+    )
+    response = await asyncio.to_thread(conv_agent.run, f"Respond conversationally to: {query}", chat_history=history)
+    record_llm_usage(response)
+    return response.content
+
+
+async def lookup_cached_answer(query: str, namespace: str) -> Optional[Dict[str, Any]]:
+    try:
+        with span("answer_cache.lookup", namespace=namespace) as s:
+            cached = await asyncio.to_thread(answer_cache.lookup, query, namespace)
+            s.set(cache_hit=bool(cached))
+        return cached
+    except Exception as e:
+        print(colored(f"Error during answer cache lookup: {e}", "red"))
+        return None
+
+
+async def _cancel_tasks(*tasks: Optional[asyncio.Task]):
+    pending = [task for task in tasks if task and not task.done()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+@traced("retrieval")
+async def retrieve_documents(query: str) -> Tuple[Optional[list], str]:
+    """Returns (documents, joined document text)."""
+    if not (knowledge_base and retriever):
         print(colored("Knowledge base not available, skipping RAG.", "yellow"))
+        return None, "No documents found or knowledge base unavailable."
+    try:
+        print(colored("Attempting RAG retrieval...", "cyan"))
+        # Tickers / fiscal periods in the question narrow the search to chunks that mention them
+        query_entities = extract_entities(query)
+        if query_entities["tickers"] or query_entities["periods"]:
+            print(colored(f"Query entities: {sorted(query_entities['tickers'] | query_entities['periods'])}", "magenta"))
+        retrieved_docs = await retriever.ainvoke(query, entities=query_entities) # Langchain LCEL standard invoke
+        set_attributes(backend=RETRIEVAL_BACKEND, docs=len(retrieved_docs or []),
+                       entity_filtered=bool(query_entities["tickers"] or query_entities["periods"]))
+
+        if retrieved_docs:
+            retrieved_docs_content = "\n\n".join([doc.page_content for doc in retrieved_docs])
+            print(colored(f"Retrieved {len(retrieved_docs)} snippets.", "green"))
+            print(colored("Retrieved Snippet:", "yellow"))
+            print(colored(retrieved_docs_content[:500] + "...", "yellow"))
+            return retrieved_docs, retrieved_docs_content
+        print(colored("No relevant documents found in knowledge base.", "yellow"))
+        return retrieved_docs, "No relevant documents found in knowledge base."
+    except Exception as e:
+        print(colored(f"Error during RAG retrieval: {e}", "red"))
+        traceback.print_exc()
+        return None, "Error retrieving documents from knowledge base."
 
-    # === 3. Relevance Grading (Using JsonOutputParser with Markdown Fence Instruction) ===
-    grade = 0 # Default to not relevant
-    if retrieved_docs:
-        try:
-            print(colored("Grading retrieved documents...", "cyan"))
-            grading_llm = main_llm_langchain
-            # Updated prompt asking for JSON within markdown fences
-            grading_prompt = PromptTemplate(
-                 template="""Evaluate the relevance of the retrieved documents to the user's question. Give a binary score: 1 if relevant, 0 if not.\n
-                 Provide the score ONLY as JSON within ```json markdown code fences. Example:
-                 ```json
-                 {{
-                   "score": 1
-                 }}
-                 ```
-
-                 Documents:\n{documents}\n\nQuestion: {question}""",
-                 input_variables=["documents", "question"]
-            )
-            # Standard JsonOutputParser - should handle markdown fences
-            grading_parser = JsonOutputParser()
-            grading_chain = grading_prompt | grading_llm | grading_parser
-
-            grade_result = grading_chain.invoke({"question": query, "documents": retrieved_docs_content})
-            # Check the type/content of grade_result
-            print(f"DEBUG: Raw grade_result: {grade_result} (type: {type(grade_result)})")
-            if isinstance(grade_result, dict):
-                 grade = grade_result.get('score', 0) # Default to 0 if key missing
-            else:
-                 print(colored("Warning: Grading did not return a dictionary.", "yellow"))
-                 grade = 0 # Default to not relevant if parsing failed unexpectedly
-
-            print(colored(f"Retrieval grade: {grade} ({'Relevant' if grade == 1 else 'Not Relevant'})", 'magenta'))
-
-            if grade == 1:
-                rag_context = retrieved_docs_content
-            else:
-                print(colored("Documents deemed not relevant or insufficient.", "yellow"))
-                rag_context = ""
-        except Exception as e:
-            print(colored(f"Error during retrieval grading: {e}", "red"))
-            # Don't necessarily need full traceback here if it's the expected OutputParserException
-            if "Invalid" in str(e) or "OutputParserException" in str(e):
-                 print(colored("Failed to parse relevance grade. Assuming documents are not relevant.", "yellow"))
-            else:
-                 traceback.print_exc() # Show full trace for unexpected errors
-            rag_context = "" # Discard context on error
 
+@traced("llm.grade")
+async def grade_documents(query: str, retrieved_docs_content: str) -> int:
+    """Binary relevance grade (1 relevant, 0 not) of the retrieved documents."""
+    try:
+        print(colored("Grading retrieved documents...", "cyan"))
+        # Updated prompt asking for JSON within markdown fences
+        grading_prompt = PromptTemplate(
+             template="""Evaluate the relevance of the retrieved documents to the user's question. Give a binary score: 1 if relevant, 0 if not.\n
+             Provide the score ONLY as JSON within ```json markdown code fences. Example:
+             ```json
+             {{
+               "score": 1
+             }}
+             ```
+
+             Documents:\n{documents}\n\nQuestion: {question}""",
+             input_variables=["documents", "question"]
+        )
+        # Standard JsonOutputParser - should handle markdown fences
+        grading_chain = grading_prompt | main_llm_langchain | JsonOutputParser()
+
+        set_attributes(prompt_chars=len(retrieved_docs_content))
+        grade_result = await grading_chain.ainvoke({"question": query, "documents": retrieved_docs_content},
+                                                   config=callback_config())
+        # Check the type/content of grade_result
+        print(f"DEBUG: Raw grade_result: {grade_result} (type: {type(grade_result)})")
+        if isinstance(grade_result, dict):
+             grade = grade_result.get('score', 0) # Default to 0 if key missing
+        else:
+             print(colored("Warning: Grading did not return a dictionary.", "yellow"))
+             grade = 0 # Default to not relevant if parsing failed unexpectedly
 
-    # === 4. Web Search / Deep Research ===
-    # Check for real-time need (Using BooleanOutputParser)
-    needs_realtime = True # Default assumption
+        print(colored(f"Retrieval grade: {grade} ({'Relevant' if grade == 1 else 'Not Relevant'})", 'magenta'))
+        if grade != 1:
+            print(colored("Documents deemed not relevant or insufficient.", "yellow"))
+        return grade
+    except Exception as e:
+        print(colored(f"Error during retrieval grading: {e}", "red"))
+        # Don't necessarily need full traceback here if it's the expected OutputParserException
+        if "Invalid" in str(e) or "OutputParserException" in str(e):
+             print(colored("Failed to parse relevance grade. Assuming documents are not relevant.", "yellow"))
+        else:
+             traceback.print_exc() # Show full trace for unexpected errors
+        return 0 # Discard context on error
+
+
+@traced("intent")
+async def classify_intent(query: str) -> Optional[IntentResult]:
+    if not intent_classifier:
+        return None
+    try:
+        intent = await asyncio.to_thread(intent_classifier.classify, query)
+        if intent:
+            set_attributes(label=intent.label, similarity=round(intent.similarity, 4), confident=intent.confident)
+            print(colored(f"Intent: {intent.label} (similarity {intent.similarity:.3f}, margin {intent.margin:.3f}, "
+                          f"{'confident' if intent.confident else 'not confident'})", "magenta"))
+        return intent
+    except Exception as e:
+        print(colored(f"Error during intent classification: {e}", "red"))
+        return None
+
+
+@traced("route")
+async def route_query(query: str, retrieved_docs: Optional[list], retrieved_docs_content: str,
+                      intent: Optional[IntentResult] = None) -> RouteVerdict:
+    """
+    One structured routing call; falls back to the separate checks if it fails.
+    A confident local intent that is not small talk skips the small talk check there.
+    """
+    try:
+        print(colored("Routing query...", "cyan"))
+        documents = retrieved_docs_content if retrieved_docs else ""
+        with span("llm.route", prompt_chars=len(query) + len(documents)) as s:
+            verdict = await aroute(query, documents, config=callback_config(s))
+        print(colored(f"Route: small talk={verdict.is_small_talk}, real-time={verdict.needs_realtime}, "
+                      f"RAG relevant={verdict.rag_relevant}", "magenta"))
+        return verdict
+    except Exception as e:
+        print(colored(f"Error during routing: {e}", "red"))
+        print(colored("Falling back to separate small talk / relevance / real-time checks...", "yellow"))
+        set_attributes(fallback=True)
+
+    if intent and intent.confident and not intent.is_small_talk:
+        small_talk_task = asyncio.create_task(asyncio.sleep(0, result=False))
+    else:
+        small_talk_task = asyncio.create_task(check_small_talk(query))
+    grade_task = asyncio.create_task(grade_documents(query, retrieved_docs_content)) if retrieved_docs else None
+    realtime_task = asyncio.create_task(check_realtime(query))
+    other_tasks = [t for t in (grade_task, realtime_task) if t]
+    if await small_talk_task:
+        # The other checks are not needed for a conversational reply
+        for task in other_tasks:
+            task.cancel()
+        await asyncio.gather(*other_tasks, return_exceptions=True)
+        return RouteVerdict(is_small_talk=True, needs_realtime=False, rag_relevant=False)
+    grade = await grade_task if grade_task else 0
+    return RouteVerdict(is_small_talk=False, needs_realtime=await realtime_task, rag_relevant=grade == 1)
+
+
+@traced("llm.realtime_check")
+async def check_realtime(query: str) -> bool:
     try:
         print(colored("Checking for real-time data need...", "cyan"))
-        realtime_check_llm = main_llm_langchain
         # Updated prompt for BooleanOutputParser
         realtime_check_prompt = PromptTemplate(
             template="""Does the question below strongly imply a need for CURRENT, up-to-the-minute information like stock prices, breaking news, or live market status? Answer ONLY with 'YES' or 'NO'.\n\nQuestion: {question}""",
             input_variables=["question"]
         )
-        realtime_check_parser = BooleanOutputParser()
-        realtime_check_chain = realtime_check_prompt | realtime_check_llm | realtime_check_parser
+        realtime_check_chain = realtime_check_prompt | main_llm_langchain | BooleanOutputParser()
 
         # BooleanOutputParser returns True/False
-        needs_realtime = realtime_check_chain.invoke({"question": query})
+        needs_realtime = await realtime_check_chain.ainvoke({"question": query}, config=callback_config())
 
         print(colored(f"Needs real-time data check result: {'Yes' if needs_realtime else 'No'}", "cyan"))
+        return needs_realtime
     except Exception as e:
         print(colored(f"Error checking for real-time need: {e}", "red"))
         if "Invalid" in str(e) or "OutputParserException" in str(e):
             print(colored("Failed to parse real-time need. Assuming real-time IS needed.", "yellow"))
         else:
             traceback.print_exc()
-        needs_realtime = True # Default to True on error
-
-    # Decide whether to perform web step
-    perform_web_step = True
-    if grade == 1 and not needs_realtime:
-        print(colored("Relevant RAG found and no immediate real-time data need identified. Proceeding with web search for verification/augmentation.", "green"))
-        # perform_web_step = False # Uncomment to skip web step in this case
-
-    if perform_web_step:
-        if deep_search:
-            # --- Deep Research Path ---
-            print(colored("Initiating Deep Research...", 'magenta'))
-            if stream_callback: stream_callback("Initiating Deep Research...\n")
-            try:
-                # Pass the stream_callback to the research method
-                # Ensure 'researcher' uses Agno-compatible models internally if needed
-                research_result = researcher.research(query, stream_callback=stream_callback)
-                web_research_context = research_result.get("answer", "Deep research failed to produce a synthesized answer.")
-                research_debug_log = research_result.get("debug_log", "")
-                print(colored("Deep Research completed.", "green"))
-                if stream_callback: stream_callback("Deep Research completed.\n")
-
-            except Exception as e:
-                error_msg = f"Critical Error during Deep Research execution: {e}"
-                print(colored(error_msg, "red"))
-                traceback.print_exc()
-                web_research_context = f"Deep research encountered a critical error: {str(e)}"
-                research_debug_log = f"{research_debug_log}\n\n--- CRITICAL ERROR ---\n{error_msg}\n{traceback.format_exc()}"
-                if stream_callback:
-                    stream_callback(f"--- DEEP RESEARCH CRITICAL ERROR: {e} ---\n")
-        else:
-            # --- Standard Web Search Path ---
-            print(colored("Initiating Standard Web Search using Tavily/YFinance...", 'magenta'))
-            # Use Agno compatible LLM for Agno Agent
-            web_search_agent = Agent(
-                model=tool_llm_agno,
-                description="""You are a Financial Assistant specialized in retrieving real-time and web-based information using Tavily Search for general info/news and YFinance for specific stock data. Execute tool calls as needed. Synthesize the results factually. Current time: {current_datetime}""",
-                markdown=True,
-                search_knowledge=False,
-                tools=[tavily_client, yf_tool],
-                show_tool_calls=True,
-                add_datetime_to_instructions=True,
-            )
-            try:
-                history = memory.load_memory_variables({})["chat_history"]
-                response = web_search_agent.run(query, chat_history=history)
-                web_research_context = response.content
-                print(colored(f"Web Search Agent Response: {web_research_context}", "magenta"))
-                print(colored("Standard Web Search completed.", "green"))
-
-            except Exception as e:
-                error_msg = f"Error during Standard Web Search Agent execution: {str(e)}"
-                print(colored(error_msg, "red"))
-                traceback.print_exc()
-                web_research_context = f"Standard web search encountered an error: {str(e)}"
+        return True # Default to True on error
 
-    # === 5. Synthesis ===
-    print(colored("Synthesizing final answer...", "cyan"))
+
+def make_web_search_tool(realtime: bool) -> Callable[..., str]:
+    """
+    Tavily search tool for the web agent; real-time questions skip cached results.
+    Uses the same search parameters as deep research, so the two share cache entries.
+    """
+    def web_search(query: str) -> str:
+        """Search the web for news and general financial information.
+
+        Args:
+            query: The search query.
+
+        Returns:
+            The search results as a JSON string.
+        """
+        with span("tool.tavily", search_depth=TAVILY_SEARCH_DEPTH) as s:
+            results, cached = tavily_client.search_with_status(
+                query, realtime=realtime, search_depth=TAVILY_SEARCH_DEPTH, max_results=TAVILY_MAX_RESULTS)
+            s.set(cache_hit=cached)
+        return json.dumps(results)
+    return web_search
+
+
+@traced("web_step")
+def run_web_step(query: str, history: list, deep_search: bool,
+                 stream_callback: Optional[Callable[[str], None]] = None,
+                 needs_realtime: bool = False) -> Tuple[str, str, bool]:
+    """Deep research or standard web search. Returns (web context, research debug log, succeeded)."""
+    research_debug_log = ""
+    if deep_search:
+        # --- Deep Research Path ---
+        print(colored("Initiating Deep Research...", 'magenta'))
+        if stream_callback: stream_callback("Initiating Deep Research...\n")
+        try:
+            # Pass the stream_callback to the research method
+            # Ensure 'researcher' uses Agno-compatible models internally if needed
+            research_result = researcher.research(query, stream_callback=stream_callback, realtime=needs_realtime)
+            web_research_context = research_result.get("answer", "Deep research failed to produce a synthesized answer.")
+            research_debug_log = research_result.get("debug_log", "")
+            print(colored("Deep Research completed.", "green"))
+            if stream_callback: stream_callback("Deep Research completed.\n")
+            return web_research_context, research_debug_log, True
+
+        except Exception as e:
+            error_msg = f"Critical Error during Deep Research execution: {e}"
+            print(colored(error_msg, "red"))
+            traceback.print_exc()
+            research_debug_log = f"{research_debug_log}\n\n--- CRITICAL ERROR ---\n{error_msg}\n{traceback.format_exc()}"
+            if stream_callback:
+                stream_callback(f"--- DEEP RESEARCH CRITICAL ERROR: {e} ---\n")
+            return f"Deep research encountered a critical error: {str(e)}", research_debug_log, False
+
+    # --- Standard Web Search Path ---
+    print(colored("Initiating Standard Web Search using Tavily/YFinance...", 'magenta'))
     # Use Agno compatible LLM for Agno Agent
-    synthesis_agent = Agent(
-        model=main_llm_agno,
-        description="""You are a Financial Analyst Synthesizer. Combine information from internal knowledge (RAG Context) and web research (Web/Deep Research Context) to answer the user's original query comprehensively. Prioritize accuracy and recent information. Format clearly using Markdown.""",
+    web_search_agent = Agent(
+        model=tool_llm_agno,
+        description="""You are a Financial Assistant specialized in retrieving real-time and web-based information using Tavily Search for general info/news and YFinance for specific stock data. Execute tool calls as needed. Synthesize the results factually. Current time: {current_datetime}""",
         markdown=True,
+        search_knowledge=False,
+        tools=[make_web_search_tool(needs_realtime), yf_tool],
+        show_tool_calls=True,
+        add_datetime_to_instructions=True,
     )
-
     try:
-        synthesis_prompt_input = f"""Original Query: {query}
+        with span("llm.web_agent", prompt_chars=len(query)):
+            response = web_search_agent.run(query, chat_history=history)
+            record_llm_usage(response)
+        web_research_context = response.content
+        print(colored(f"Web Search Agent Response: {web_research_context}", "magenta"))
+        print(colored("Standard Web Search completed.", "green"))
+        return web_research_context, research_debug_log, True
+
+    except Exception as e:
+        error_msg = f"Error during Standard Web Search Agent execution: {str(e)}"
+        print(colored(error_msg, "red"))
+        traceback.print_exc()
+        return f"Standard web search encountered an error: {str(e)}", research_debug_log, False
+
+
+def run_agent_streaming(agent: Agent, message: str, token_callback: Callable[[str], None], **kwargs) -> str:
+    """Run an Agno agent with streaming, passing each content delta to token_callback. Returns the full text."""
+    parts = []
+    s = current_span()
+    for chunk in agent.run(message, stream=True, **kwargs):
+        # Completion events repeat the whole answer; only content deltas are forwarded
+        if "Completed" in str(getattr(chunk, "event", "")):
+            continue
+        piece = getattr(chunk, "content", None)
+        if isinstance(piece, str) and piece:
+            if not parts and s is not None:
+                s.set(first_token_ms=round((time.perf_counter() - s.start) * 1000, 2))
+            parts.append(piece)
+            token_callback(piece)
+    return "".join(parts)
+
+
+def build_synthesis_prompt(query: str, rag_context: str, web_research_context: str) -> str:
+    return f"""Original Query: {query}
 
         --- Information from Knowledge Base (RAG Context) ---
         {rag_context if rag_context else "No relevant information found in internal documents."}
@@ -306,24 +490,195 @@ def process_query_flow(
 
         Synthesize the above information to answer the original query comprehensively and accurately. Structure the response clearly using Markdown. If conflicting information exists, highlight it or prioritize the most recent/reliable source (often the web context for current data). Respond directly to the user.
         """
-        print(colored(f"SYNTHESIS PROMPT INPUT LENGTH: {len(synthesis_prompt_input)} chars", "grey"))
 
-        history = memory.load_memory_variables({})["chat_history"]
-        final_response = synthesis_agent.run(synthesis_prompt_input, chat_history=history)
-        final_answer = final_response.content
+
+@traced("synthesis")
+def synthesize_answer(query: str, history: list, rag_items: List[str],
+                      web_research_context: str,
+                      token_callback: Optional[Callable[[str], None]] = None,
+                      needs_realtime: bool = False) -> Tuple[str, bool, Dict[str, Any]]:
+    """
+    Final answer from the RAG and web contexts. Returns (answer, succeeded, context budget report).
+    The RAG chunks, web evidence and chat history are trimmed to the model's context window;
+    web evidence is kept ahead of RAG when the question needs real-time data.
+    With token_callback, the answer is streamed to it token by token as it is generated.
+    """
+    print(colored("Synthesizing final answer...", "cyan"))
+    # Use Agno compatible LLM for Agno Agent
+    synthesis_agent = Agent(
+        model=main_llm_agno,
+        description=SYNTHESIS_DESCRIPTION,
+        markdown=True,
+    )
+    context_report: Dict[str, Any] = {}
+
+    try:
+        context = context_assembler.assemble(
+            fixed_prompt=SYNTHESIS_DESCRIPTION + build_synthesis_prompt(query, "", ""),
+            rag=rag_items,
+            web=split_evidence(web_research_context),
+            history=history if isinstance(history, list) else [history],
+            priority=("web", "rag", "history") if needs_realtime else ("rag", "web", "history"),
+        )
+        context_report = context.report()
+        for item in context.dropped:
+            print(colored(f"Context budget: {'truncated' if item['truncated'] else 'dropped'} {item['items']} "
+                          f"{item['section']} item(s), ~{item['tokens']} tokens", "yellow"))
+        synthesis_prompt_input = build_synthesis_prompt(query, context.rag_text, context.web_text)
+        set_attributes(prompt_chars=len(synthesis_prompt_input), streamed=bool(token_callback),
+                       prompt_tokens=count_tokens(SYNTHESIS_DESCRIPTION) + count_tokens(synthesis_prompt_input)
+                       + context.used_tokens.get("history", 0))
+        print(colored(f"SYNTHESIS PROMPT INPUT LENGTH: {len(synthesis_prompt_input)} chars, "
+                      f"context tokens {sum(context.used_tokens.values())}/{context.budget_tokens}", "grey"))
+
+        if token_callback:
+            answer = run_agent_streaming(synthesis_agent, synthesis_prompt_input, token_callback, chat_history=context.history)
+            record_llm_usage(synthesis_agent)
+            return answer, True, context_report
+        final_response = synthesis_agent.run(synthesis_prompt_input, chat_history=context.history)
+        record_llm_usage(final_response)
+        return final_response.content, True, context_report
 
     except Exception as e:
         print(colored(f"Error during final synthesis: {e}", "red"))
         traceback.print_exc()
-        final_answer = f"Sorry, I encountered an error while synthesizing the final answer: {str(e)}"
+        return f"Sorry, I encountered an error while synthesizing the final answer: {str(e)}", False, context_report
+
+
+# --- Core Processing Function ---
+async def process_query_flow_async(
+    query: str,
+    memory: ConversationBufferMemory,
+    deep_search: bool = False,
+    stream_callback: Optional[Callable[[str], None]] = None,
+    token_callback: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    stream_callback receives progress/log lines (deep research); token_callback
+    receives the final answer's tokens as synthesis generates them.
+    The result carries the request's trace (per-stage timings, tokens, cache hits).
+    """
+    with trace("process_query", deep_search=deep_search, query_chars=len(query)) as request_trace:
+        result = await _run_query_flow(query, memory, deep_search, stream_callback, token_callback)
+    print(colored(f"Stage timings (ms): {request_trace.stage_durations()}", "grey"))
+    result["trace"] = request_trace.to_dict()
+    return result
+
+
+async def _run_query_flow(
+    query: str,
+    memory: ConversationBufferMemory,
+    deep_search: bool,
+    stream_callback: Optional[Callable[[str], None]],
+    token_callback: Optional[Callable[[str], None]]
+) -> Dict[str, Any]:
+    print(colored(f"\nProcessing Query: '{query}' (Deep Search: {deep_search})", "white", attrs=["bold"]))
+    start_time = time.perf_counter()
+    # Loaded once and shared by every stage; with RollingSummaryMemory this is a summary plus the last turns
+    with span("memory.load"):
+        history = memory.load_memory_variables({})["chat_history"]
+
+    # Retrieval and the cache lookup do not depend on the intent, so all three run at once;
+    # whatever is still running when the flow returns early (canned reply, cache hit) is cancelled
+    cache_namespace = "deep" if deep_search else "standard"
+    retrieval_task = asyncio.create_task(retrieve_documents(query))
+    cache_task = asyncio.create_task(lookup_cached_answer(query, cache_namespace)) if answer_cache else None
+    try:
+        # === 0. Local Intent Check (no LLM call) ===
+        intent = await classify_intent(query)
+        if intent and intent.confident and intent.is_small_talk:
+            canned = intent_classifier.canned_response(intent.label)
+            set_attributes(outcome="canned_small_talk" if canned else "small_talk")
+            await _cancel_tasks(retrieval_task, cache_task)
+            answer = canned if canned else await respond_small_talk(query, memory, history)
+            return {"answer": answer, "deep_research_log": "", "intent": intent.to_dict()}
+
+        # === 0b. Semantic Answer Cache ===
+        cached = await cache_task if cache_task else None
+        if cached:
+            set_attributes(outcome="answer_cache_hit")
+            print(colored(f"Answer cache hit (similarity {cached['similarity']:.3f}, matched: '{cached['matched_query']}')", "green"))
+            await _cancel_tasks(retrieval_task)
+            return {
+                "answer": cached["answer"],
+                "deep_research_log": "",
+                "cache": dict(cached, hit=True, stats=answer_cache.stats()),
+            }
+
+        # === 1. RAG Retrieval ===
+        retrieved_docs, retrieved_docs_content = await retrieval_task
+    finally:
+        # Only does anything if the flow itself failed or was cancelled above
+        await _cancel_tasks(retrieval_task, cache_task)
+
+    # === 2. Routing: Small Talk / Relevance Grading / Real-time Need in one call ===
+    verdict = await route_query(query, retrieved_docs, retrieved_docs_content, intent)
+    if verdict.is_small_talk:
+        set_attributes(outcome="small_talk")
+        return {"answer": await respond_small_talk(query, memory, history), "deep_research_log": ""}
+
+    grade = 1 if retrieved_docs and verdict.rag_relevant else 0
+    if retrieved_docs and not grade:
+        print(colored("Documents deemed not relevant or insufficient.", "yellow"))
+    rag_items = [doc.page_content for doc in retrieved_docs] if grade == 1 else []
+    needs_realtime = verdict.needs_realtime
+
+    # === 4. Web Search / Deep Research ===
+    # Decide between KB-only, quick web search and deep research
+    decision = decide_web_step(web_policy, grade, needs_realtime, retrieved_docs, deep_search,
+                               elapsed_seconds=time.perf_counter() - start_time)
+    set_attributes(web_mode=decision.mode, outcome="answered")
+    print(colored(f"Web step decision: {decision.mode} ({'; '.join(decision.reasons)})", "green"))
+    if deep_search and stream_callback and decision.mode != DEEP:
+        stream_callback(f"Skipping deep research: {'; '.join(decision.reasons)}\n")
+
+    web_research_context, research_debug_log, web_ok = "", "", True
+    if decision.mode != KB_ONLY:
+        web_research_context, research_debug_log, web_ok = run_web_step(
+            query, history, decision.mode == DEEP, stream_callback, needs_realtime)
+
+    # === 5. Synthesis ===
+    final_answer, synthesis_ok, context_report = synthesize_answer(
+        query, history, rag_items, web_research_context, token_callback, needs_realtime)
+
+    # Real-time answers go stale immediately, so only evergreen answers are cached;
+    # degraded answers (a stage failed) are never cached
+    if answer_cache and web_ok and synthesis_ok and not needs_realtime and final_answer:
+        try:
+            with span("answer_cache.store", namespace=cache_namespace):
+                answer_cache.store(query, final_answer, namespace=cache_namespace)
+        except Exception as e:
+            print(colored(f"Error storing answer in cache: {e}", "red"))
 
     print(colored("Processing complete.", "white", attrs=["bold"]))
 
     return {
         "answer": final_answer,
-        "deep_research_log": research_debug_log
+        "deep_research_log": research_debug_log,
+        "cache": {"hit": False, "stats": answer_cache.stats() if answer_cache else {}},
+        "search_cache": tavily_client.cache.stats() if tavily_client.cache else {},
+        "web_policy": decision.to_dict(),
+        "context_budget": context_report,
         }
 
+
+def process_query_flow(
+    query: str,
+    memory: ConversationBufferMemory,
+    deep_search: bool = False,
+    stream_callback: Optional[Callable[[str], None]] = None,
+    token_callback: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """Synchronous entry point (Streamlit, scripts) for process_query_flow_async."""
+    coro = process_query_flow_async(query, memory, deep_search, stream_callback, token_callback)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Called from inside a running event loop: run the flow on its own loop in a worker thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
 # Example of how to potentially run this file directly (for testing)
 if __name__ == "__main__":
     print("Testing process_query_flow...")
@@ -0,0 +1,188 @@
+# search_cache.py
+
+# Persistent TTL cache of Tavily search results, shared by deep research and the
+# standard web search path (and across users and restarts). Entries are keyed by
+# the normalized query plus the search parameters, carry their own expiry
+# (time-sensitive queries get a short TTL), and the least recently used entries
+# are evicted beyond max_entries. Real-time queries skip the lookup but still
+# refresh the stored result. Cache hits do not count against deep research's
+# search budget.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from query_text import looks_realtime, normalize_query
+from tracing import span
+
+default_cache_path = "./db/search_cache.sqlite3"
+evict_fraction = 0.1    # Share of entries dropped per eviction pass
+
+
+def cache_key(query: str, params: Dict[str, Any]) -> str:
+    payload = json.dumps({"query": normalize_query(query), "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SearchCache:
+    """SQLite-backed store of search responses with per-entry expiry and LRU eviction."""
+
+    def __init__(self, path: str = default_cache_path, ttl_seconds: float = 6 * 3600,
+                 short_ttl_seconds: float = 15 * 60, max_entries: int = 20_000):
+        self.ttl_seconds = ttl_seconds
+        self.short_ttl_seconds = short_ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS searches (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_searches_last_used ON searches(last_used)")
+        self._conn.execute("DELETE FROM searches WHERE expires_at <= ?", (time.time(),))
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+
+    def ttl_for(self, query: str) -> float:
+        # "latest news on X" goes stale much faster than "what does X do"
+        return self.short_ttl_seconds if looks_realtime(query) else self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM searches WHERE key=? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE searches SET last_used=? WHERE key=?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, query: str, result: Dict[str, Any], ttl_seconds: Optional[float] = None):
+        now = time.time()
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_for(query)
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO searches (key, query, result, created_at, expires_at, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (key, query, json.dumps(result, default=str), now, now + ttl, now),
+            )
+            self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Caller holds the lock. Expired entries go first, then the least recently used.
+        self._conn.execute("DELETE FROM searches WHERE expires_at <= ?", (time.time(),))
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+        excess = self._entries - int(self.max_entries * (1 - evict_fraction))
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM searches WHERE key IN (SELECT key FROM searches ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._entries -= excess
+
+    def note_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM searches")
+            self._conn.commit()
+            self._entries = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._entries,
+        }
+
+
+class CachedTavilyClient:
+    """TavilyClient whose search() goes through a SearchCache; other attributes pass through."""
+
+    def __init__(self, client: Any, cache: Optional[SearchCache]):
+        self.client = client
+        self.cache = cache
+        self.name = getattr(client, "name", "TavilySearch")
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def lookup(self, query: str, realtime: bool = False, **params) -> Optional[Dict[str, Any]]:
+        """The cached response for this search, or None (always None for real-time queries)."""
+        if self.cache is None:
+            return None
+        if realtime:
+            self.cache.note_bypass()
+            return None
+        with span("search_cache.lookup") as s:
+            result = self.cache.get(cache_key(query, params))
+            s.set(cache_hit=result is not None)
+        return result
+
+    def fetch(self, query: str, **params) -> Dict[str, Any]:
+        """Run the search against Tavily and store the response."""
+        result = self.client.search(query=query, **params)
+        if self.cache is not None and result:
+            try:
+                self.cache.put(cache_key(query, params), query, result)
+            except sqlite3.Error as e:
+                print(f"Error storing search result in cache: {e}")
+        return result
+
+    def search_with_status(self, query: str, realtime: bool = False, **params) -> Tuple[Dict[str, Any], bool]:
+        """(response, served from cache)."""
+        cached = self.lookup(query, realtime=realtime, **params)
+        if cached is not None:
+            return cached, True
+        return self.fetch(query, **params), False
+
+    def search(self, query: str, realtime: bool = False, **params) -> Dict[str, Any]:
+        return self.search_with_status(query, realtime=realtime, **params)[0]
+
+
+_shared_cache: Optional[SearchCache] = None
+_shared_lock = threading.Lock()
+
+
+def shared_search_cache() -> Optional[SearchCache]:
+    """The process-wide cache configured in vars.py (None when disabled)."""
+    global _shared_cache
+    from vars import (SEARCH_CACHE_ENABLED, SEARCH_CACHE_PATH, SEARCH_CACHE_TTL,
+                      SEARCH_CACHE_SHORT_TTL, SEARCH_CACHE_MAX_ENTRIES)
+    if not SEARCH_CACHE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            try:
+                _shared_cache = SearchCache(SEARCH_CACHE_PATH, ttl_seconds=SEARCH_CACHE_TTL,
+                                            short_ttl_seconds=SEARCH_CACHE_SHORT_TTL,
+                                            max_entries=SEARCH_CACHE_MAX_ENTRIES)
+            except sqlite3.Error as e:
+                print(f"Error initializing search cache: {e}")
+                return None
+        return _shared_cache
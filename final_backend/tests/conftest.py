@@ -0,0 +1,7 @@
+# tests/conftest.py
+
+# The backend modules are flat files in final_backend/, imported by name.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,18 @@
+# tests/test_entities.py
+from entities import document_entities, extract_entities
+
+
+def test_common_words_are_not_companies():
+    for text in ["Is reliance on debt a risk?", "an apple a day", "google it", "amazon rainforest funds"]:
+        assert extract_entities(text)["tickers"] == set(), text
+
+
+def test_company_names_and_qualified_forms():
+    assert extract_entities("Reliance Q3 FY24 results")["tickers"] == {"RELIANCE"}
+    assert extract_entities("reliance industries ltd margins")["tickers"] == {"RELIANCE"}
+    assert extract_entities("apple inc buybacks")["tickers"] == {"AAPL"}
+    assert extract_entities("SBI vs AMZN")["tickers"] == {"SBIN", "AMZN"}
+
+
+def test_file_names_match_in_any_case():
+    assert document_entities("apple_q3fy24.pdf") == {"tickers": {"AAPL"}, "periods": {"FY24", "Q3FY24"}}
@@ -0,0 +1,87 @@
+# tests/test_hybrid_retriever.py
+import numpy as np
+from langchain_core.documents import Document
+from entities import EntityIndex
+from hybrid_retriever import BM25Index, HybridRetriever
+
+
+class FakeEmbeddings:
+    def __init__(self, query_vector):
+        self.query_vector = query_vector
+
+    def embed_query(self, text):
+        return self.query_vector
+
+
+class FakeVectorStore:
+    """Minimal Chroma-like store: cosine search plus get(ids=...)."""
+
+    def __init__(self, chunks, query_vector):
+        self.chunks = chunks    # id -> (text, vector)
+        self.embeddings = FakeEmbeddings(query_vector)
+
+    def similarity_search_by_vector_with_relevance_scores(self, query_vector, k, ids=None, **kwargs):
+        q = np.asarray(query_vector) / np.linalg.norm(query_vector)
+        scored = []
+        for cid, (text, vector) in self.chunks.items():
+            if ids is not None and cid not in ids:
+                continue
+            v = np.asarray(vector) / np.linalg.norm(vector)
+            scored.append((Document(id=cid, page_content=text), float(1 - v @ q)))
+        return sorted(scored, key=lambda item: item[1])[:k]
+
+    def get(self, ids, include):
+        return {
+            "ids": list(ids),
+            "documents": [self.chunks[cid][0] for cid in ids],
+            "metadatas": [{} for _ in ids],
+            "embeddings": [self.chunks[cid][1] for cid in ids],
+        }
+
+
+def test_keyword_only_hit_survives_mmr(tmp_path):
+    rng = np.random.default_rng(0)
+    query_vector = np.zeros(16)
+    query_vector[0] = 1.0
+    chunks = {}
+    # Generic passages close to the query in embedding space, none mentioning the ticker
+    for i in range(8):
+        vector = query_vector + rng.normal(0, 0.05, 16)
+        chunks[f"generic{i}"] = (f"Quarterly results commentary for large cap companies, part {i}.", vector)
+    # The exact-ticker chunk: only BM25 finds it, its embedding is nearly orthogonal to the query
+    ticker_vector = np.zeros(16)
+    ticker_vector[1] = 1.0
+    chunks["ticker"] = ("ASHOKLEY reported EBITDA margin of 12.4% in Q3.", ticker_vector)
+
+    keyword_index = BM25Index(str(tmp_path / "bm25.pkl"))
+    keyword_index.add(list(chunks), [text for text, _ in chunks.values()])
+    retriever = HybridRetriever(
+        vector_store=FakeVectorStore(chunks, query_vector), keyword_index=keyword_index,
+        k=3, fetch_k=5, mmr_lambda=0.7,
+    )
+
+    results = retriever.invoke("ASHOKLEY EBITDA margin")
+
+    assert len(results) == 3
+    ticker = [doc for doc in results if doc.id == "ticker"]
+    assert ticker, "the BM25-only exact-ticker chunk was dropped by MMR"
+    assert ticker[0].metadata["bm25_score"] > 0
+
+
+def test_entity_filter_falls_back_when_its_chunks_are_missing(tmp_path):
+    query_vector = np.zeros(4)
+    query_vector[0] = 1.0
+    chunks = {"generic": ("Dividend policy of large Indian banks.", query_vector + 0.1)}
+    keyword_index = BM25Index(str(tmp_path / "bm25.pkl"))
+    keyword_index.add(list(chunks), [text for text, _ in chunks.values()])
+    # The entity index knows an HDFCBANK chunk that the store being searched does not have
+    entity_index = EntityIndex(str(tmp_path / "entities.pkl"))
+    entity_index.add(["exported-later"], [{"tickers": "HDFCBANK"}])
+    retriever = HybridRetriever(
+        vector_store=FakeVectorStore(chunks, query_vector), keyword_index=keyword_index,
+        entity_index=entity_index, k=3,
+    )
+
+    results = retriever.invoke("HDFC Bank dividend policy", entities={"tickers": {"HDFCBANK"}, "periods": set()})
+
+    assert [doc.id for doc in results] == ["generic"]
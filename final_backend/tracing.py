@@ -0,0 +1,429 @@
+# tracing.py
+
+# Span-based latency tracing for the query pipeline and deep research.
+# A request opens a trace; every stage and every LLM/tool call inside it opens a
+# span recording wall time plus attributes such as token counts, prompt sizes and
+# cache hits. The active span is held in a context variable, so spans nest across
+# function calls, asyncio tasks and asyncio.to_thread without being passed around.
+# Finished traces are returned with the result dict and handed to the configured
+# exporters (JSON lines file, Prometheus text exposition) so per-stage p50/p95
+# can be tracked in production:
+#   python tracing.py stats ./db/traces.jsonl
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+except ImportError:  # Only needed for token counts from LangChain chains
+    BaseCallbackHandler = object
+
+metric_prefix = "finassist"
+# Histogram bucket bounds in seconds: LLM calls take seconds, deep research minutes
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    children: List["Span"] = field(default_factory=list)
+    start: float = field(default_factory=time.perf_counter)
+    offset_ms: float = 0.0          # Start relative to the trace start
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+    thread: str = field(default_factory=lambda: threading.current_thread().name)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **counts):
+        """Accumulate numeric attributes, e.g. tokens of several model calls in one span."""
+        for key, value in counts.items():
+            if value:
+                self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        entry = {"name": self.name, "offset_ms": round(self.offset_ms, 2),
+                 "duration_ms": round(self.duration_ms, 2) if self.duration_ms is not None else None}
+        if self.attributes:
+            entry["attributes"] = self.attributes
+        if self.error:
+            entry["error"] = self.error
+        if self.children:
+            entry["children"] = [child.to_dict() for child in list(self.children)]
+        return entry
+
+    def walk(self) -> Iterator["Span"]:
+        yield self
+        for child in list(self.children):
+            yield from child.walk()
+
+
+@dataclass
+class Trace:
+    name: str
+    root: Span
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    started_at: float = field(default_factory=time.time)
+
+    def stage_durations(self) -> Dict[str, float]:
+        """Total milliseconds per span name (spans of the same name are summed)."""
+        totals: Dict[str, float] = {}
+        for s in self.root.walk():
+            if s.duration_ms is not None:
+                totals[s.name] = round(totals.get(s.name, 0.0) + s.duration_ms, 2)
+        return totals
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.root.duration_ms, 2) if self.root.duration_ms is not None else None,
+            "stages_ms": self.stage_durations(),
+            "root": self.root.to_dict(),
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attributes(**attributes):
+    """Annotate the active span; a no-op outside a trace."""
+    s = _current_span.get()
+    if s is not None:
+        s.set(**attributes)
+
+
+def _finish(s: Span):
+    s.duration_ms = (time.perf_counter() - s.start) * 1000
+    metrics.observe(s)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """Time a block as a child of the active span. Outside a trace the span is still
+    timed and counted in the metrics, just not attached to anything."""
+    parent = _current_span.get()
+    s = Span(name, dict(attributes))
+    if parent is not None:
+        s.offset_ms = parent.offset_ms + (s.start - parent.start) * 1000
+        parent.children.append(s)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(s)
+
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Trace]:
+    """Open a request trace; on exit it is passed to every registered exporter."""
+    t = Trace(name, Span(name, dict(attributes)))
+    token = _current_span.set(t.root)
+    try:
+        yield t
+    except BaseException as e:
+        t.root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(t.root)
+        for exporter in list(exporters):
+            try:
+                exporter.export(t)
+            except Exception as e:
+                print(f"Error exporting trace {t.trace_id}: {e}")
+
+
+def traced(name: Optional[str] = None):
+    """Decorator form of span() for sync and async functions."""
+    def decorator(func: Callable):
+        span_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func: Callable) -> Callable:
+    """Run func in a copy of the current context, e.g. in a thread pool, so its spans nest here."""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, func)
+
+
+# --- Token usage ---
+
+def _total(value) -> int:
+    # Agno keeps one entry per model call in a run
+    if isinstance(value, (list, tuple)):
+        return sum(v for v in value if isinstance(v, (int, float)))
+    return value if isinstance(value, (int, float)) else 0
+
+
+def record_llm_usage(result: Any, s: Optional[Span] = None):
+    """
+    Add token counts from an Agno RunResponse (or Agent after a streamed run) or a
+    LangChain message to the span (default: the active one). Missing usage is ignored.
+    """
+    s = s or _current_span.get()
+    if s is None or result is None:
+        return
+    run_response = getattr(result, "run_response", None)
+    if run_response is not None:
+        result = run_response
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        s.add(input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+        return
+    run_metrics = getattr(result, "metrics", None)
+    if isinstance(run_metrics, dict):
+        s.add(input_tokens=_total(run_metrics.get("input_tokens", run_metrics.get("prompt_tokens"))),
+              output_tokens=_total(run_metrics.get("output_tokens", run_metrics.get("completion_tokens"))))
+    tools = getattr(result, "tools", None)
+    if tools:
+        s.add(tool_calls=len(tools))
+
+
+class UsageCallback(BaseCallbackHandler):
+    """LangChain callback adding each model call's token usage to a span; chains that
+    end in an output parser drop the message, so usage is collected on the way."""
+
+    def __init__(self, s: Optional[Span] = None):
+        super().__init__()
+        self.span = s or _current_span.get()
+
+    def on_llm_end(self, response, **kwargs):
+        if self.span is None:
+            return
+        found = False
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is not None and getattr(message, "usage_metadata", None):
+                    record_llm_usage(message, self.span)
+                    found = True
+        token_usage = (response.llm_output or {}).get("token_usage") if not found else None
+        if token_usage:
+            self.span.add(input_tokens=token_usage.get("prompt_tokens", 0),
+                          output_tokens=token_usage.get("completion_tokens", 0))
+
+
+def callback_config(s: Optional[Span] = None) -> Dict[str, Any]:
+    """RunnableConfig collecting token usage into the span, for chain.invoke/ainvoke."""
+    return {"callbacks": [UsageCallback(s)]}
+
+
+# --- Metrics ---
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+class MetricsRegistry:
+    """Per-span-name latency histograms plus token and cache counters, in Prometheus text format."""
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, List[float]] = {}   # name -> bucket counts + [sum, count]
+        self._errors: Dict[str, int] = {}
+        self._counters: Dict[tuple, float] = {}           # (metric, span, label) -> value
+
+    def observe(self, s: Span):
+        seconds = (s.duration_ms or 0.0) / 1000
+        with self._lock:
+            histogram = self._histograms.setdefault(s.name, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            if s.error:
+                self._errors[s.name] = self._errors.get(s.name, 0) + 1
+            for kind in ("input_tokens", "output_tokens"):
+                if s.attributes.get(kind):
+                    key = ("llm_tokens_total", s.name, kind)
+                    self._counters[key] = self._counters.get(key, 0) + s.attributes[kind]
+            if isinstance(s.attributes.get("cache_hit"), bool):
+                key = ("cache_requests_total", s.name, "hit" if s.attributes["cache_hit"] else "miss")
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+    def render(self) -> str:
+        p = metric_prefix
+        lines = [f"# HELP {p}_span_duration_seconds Wall time of pipeline stages and LLM/tool calls",
+                 f"# TYPE {p}_span_duration_seconds histogram"]
+        with self._lock:
+            histograms = {name: list(h) for name, h in self._histograms.items()}
+            errors = dict(self._errors)
+            counters = dict(self._counters)
+        for name in sorted(histograms):
+            h, label = histograms[name], _label(name)
+            # Prometheus buckets are cumulative, which observe() already maintains
+            for bound, count in zip(self.buckets, h):
+                lines.append(f'{p}_span_duration_seconds_bucket{{span="{label}",le="{bound}"}} {count}')
+            lines.append(f'{p}_span_duration_seconds_bucket{{span="{label}",le="+Inf"}} {h[-1]}')
+            lines.append(f'{p}_span_duration_seconds_sum{{span="{label}"}} {h[-2]:.6f}')
+            lines.append(f'{p}_span_duration_seconds_count{{span="{label}"}} {h[-1]}')
+        lines += [f"# HELP {p}_span_errors_total Spans that ended with an exception",
+                  f"# TYPE {p}_span_errors_total counter"]
+        lines += [f'{p}_span_errors_total{{span="{_label(name)}"}} {count}' for name, count in sorted(errors.items())]
+        lines += [f"# HELP {p}_llm_tokens_total Model tokens by span and direction",
+                  f"# TYPE {p}_llm_tokens_total counter"]
+        lines += [f'{p}_llm_tokens_total{{span="{_label(name)}",kind="{kind}"}} {value:g}'
+                  for (metric, name, kind), value in sorted(counters.items()) if metric == "llm_tokens_total"]
+        lines += [f"# HELP {p}_cache_requests_total Cache lookups by span and result",
+                  f"# TYPE {p}_cache_requests_total counter"]
+        lines += [f'{p}_cache_requests_total{{span="{_label(name)}",result="{result}"}} {value:g}'
+                  for (metric, name, result), value in sorted(counters.items()) if metric == "cache_requests_total"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+# --- Exporters ---
+
+class JsonlExporter:
+    """Appends one JSON object per finished trace."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, t: Trace):
+        line = json.dumps(t.to_dict(), default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusTextfileExporter:
+    """Rewrites the metrics file after each trace (node_exporter textfile collector format)."""
+
+    def __init__(self, path: str, registry: MetricsRegistry = metrics):
+        self.path = path
+        self.registry = registry
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, t: Trace):
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+
+
+exporters: List[Any] = []
+_metrics_server: Optional[ThreadingHTTPServer] = None
+
+
+def serve_metrics(port: int, registry: MetricsRegistry = metrics) -> ThreadingHTTPServer:
+    """Serve GET /metrics for Prometheus to scrape, from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the console
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on :{port}/metrics")
+    return server
+
+
+def configure(jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None,
+              metrics_port: Optional[int] = None):
+    """Register exporters once per process (Streamlit re-imports are harmless)."""
+    global _metrics_server
+    paths = {getattr(e, "path", None) for e in exporters}
+    if jsonl_path and jsonl_path not in paths:
+        exporters.append(JsonlExporter(jsonl_path))
+    if prometheus_path and prometheus_path not in paths:
+        exporters.append(PrometheusTextfileExporter(prometheus_path))
+    if metrics_port and _metrics_server is None:
+        try:
+            _metrics_server = serve_metrics(metrics_port)
+        except OSError as e:
+            print(f"Could not serve metrics on port {metrics_port}: {e}")
+
+
+# --- Offline statistics ---
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # Nearest-rank percentile; rounding first keeps float error (0.1 * 30 = 3.0000000000000004) from skipping a rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(round(q * len(sorted_values), 9)) - 1))
+    return sorted_values[index]
+
+
+def stage_stats(traces: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """p50/p95/max milliseconds per stage across exported traces (a stage's spans are summed per trace)."""
+    samples: Dict[str, List[float]] = {}
+    for t in traces:
+        for name, ms in t.get("stages_ms", {}).items():
+            samples.setdefault(name, []).append(ms)
+    stats = {}
+    for name, values in samples.items():
+        values.sort()
+        stats[name] = {"count": len(values), "p50": percentile(values, 0.50),
+                       "p95": percentile(values, 0.95), "max": values[-1]}
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize exported query traces")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stats_parser = sub.add_parser("stats", help="p50/p95 latency per stage from a JSON lines trace file")
+    stats_parser.add_argument("path")
+    stats_parser.add_argument("--last", type=int, default=0, help="Only the last N traces")
+    args = parser.parse_args()
+
+    with open(args.path, encoding="utf-8") as f:
+        traces = [json.loads(line) for line in f if line.strip()]
+    if args.last:
+        traces = traces[-args.last:]
+    print(f"{len(traces)} traces")
+    print(f"{'stage':<32} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for name, s in sorted(stage_stats(traces).items(), key=lambda item: -item[1]["p95"]):
+        print(f"{name:<32} {s['count']:>6} {s['p50']:>10.1f} {s['p95']:>10.1f} {s['max']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,10 +33,80 @@ TOOL_CALL_LLM_LOCAL = "llama3.2:latest"
 MAX_SEARCH_CALLS = 5 # Max Tavily/Tool calls *within* deep research recursion
 MAX_DEPTH = 2        # Max recursion depth for subquestions
 NUM_SUBQUESTIONS = 3 # Initial number of subquestions
+RESEARCH_WORKERS = 4 # Sibling subquestions researched concurrently (per level of the tree)
+EVIDENCE_SIMILARITY_THRESHOLD = 0.8 # Estimated shingle overlap at which two web sources count as the same article
+
+# --- Answer Cache ---
+# Semantic cache in front of process_query_flow for evergreen questions
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_THRESHOLD = 0.92   # Min cosine similarity between query embeddings for a hit
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # Seconds a cached answer stays valid
+ANSWER_CACHE_MAX_ENTRIES = 5000
+
+# --- Search Cache ---
+# Tavily responses cached on disk by normalized query and search parameters (see search_cache.py),
+# shared by deep research and the web search agent; real-time questions skip the lookup
+SEARCH_CACHE_ENABLED = True
+SEARCH_CACHE_PATH = "./db/search_cache.sqlite3"
+SEARCH_CACHE_TTL = 6 * 3600         # Seconds a search result stays valid
+SEARCH_CACHE_SHORT_TTL = 15 * 60    # For time-sensitive queries ("latest", "today", "price", ...)
+SEARCH_CACHE_MAX_ENTRIES = 20000
+# Every Tavily search uses the same parameters (they are part of the cache key), so a result
+# fetched by deep research also serves the quick web search and vice versa
+TAVILY_SEARCH_DEPTH = "advanced"
+TAVILY_MAX_RESULTS = 5
+
+# --- Intent Classifier ---
+# Local nearest-centroid small-talk detection on the embedding model (prototypes in
+# intent_prototypes.json, reloaded on change); the LLM router decides when it is not confident
+INTENT_CLASSIFIER_ENABLED = True
+INTENT_MIN_SIMILARITY = 0.70    # Min cosine similarity to the winning label centroid
+INTENT_MIN_MARGIN = 0.05        # Min lead over the best centroid on the other side (small talk vs not)
+
+# --- Web Step Policy ---
+# "adaptive" skips web search when the knowledge base answers an evergreen question;
+# "always_web" searches the web on every question
+WEB_POLICY_MODE = "adaptive"
+LATENCY_BUDGET_SECONDS = 240        # Per-request budget for this deployment
+QUICK_WEB_EXPECTED_SECONDS = 10     # Typical Tavily + YFinance agent run
+DEEP_RESEARCH_EXPECTED_SECONDS = 120
+KB_MIN_AGREEING_DOCS = 1            # Retrieved chunks found by both keyword and vector search for KB-only answers
+
+# --- Synthesis Context Budget ---
+# Tokens kept free for the synthesized answer; RAG, web evidence and chat history share the rest
+# of the remote model's context window (see context_budget.py)
+SYNTHESIS_RESERVE_TOKENS = 1024
+
+# --- Conversation Memory ---
+# The last MEMORY_WINDOW_TURNS exchanges are sent verbatim; older ones are folded into a
+# rolling summary updated in the background (see conversation_memory.py)
+MEMORY_WINDOW_TURNS = 4
+MEMORY_SUMMARY_MAX_WORDS = 200
+
+# --- Tracing ---
+# Per-stage spans (wall time, tokens, prompt sizes, cache hits) for every request, see tracing.py.
+# Traces are appended as JSON lines (`python tracing.py stats ./db/traces.jsonl` for p50/p95);
+# metrics go to a Prometheus textfile and, if METRICS_PORT is set, to http://host:PORT/metrics
+TRACING_ENABLED = True
+TRACE_LOG_PATH = "./db/traces.jsonl"
+METRICS_TEXTFILE_PATH = "./db/metrics.prom"
+METRICS_PORT = None     # e.g. 9464
 
 # --- Knowledge Base ---
 # Add path to your vector store if needed, or configure as necessary
 VECTOR_STORE_PATH = "../db/chroma.sqlite3" 
+# Retrieval: RETRIEVAL_FETCH_K candidates are over-fetched and fused, then
+# RETRIEVAL_K are picked by maximal marginal relevance (MMR_LAMBDA = None keeps plain RRF order)
+RETRIEVAL_K = 3
+RETRIEVAL_FETCH_K = 20
+MMR_LAMBDA = 0.7        # 1.0 is pure relevance; lower values penalise near-duplicate chunks more
+# "chroma" serves queries from the live collection; "mmap" serves them from the
+# read-only export written by `python mmap_index.py export` (re-export after ingesting)
+# "ivf" serves the same export through the quantized IVF index (`python ivf_index.py build`)
+RETRIEVAL_BACKEND = "chroma"
+MMAP_INDEX_PATH = "./db/mmap_index"
+IVF_NPROBE = 8          # IVF lists scanned per query; raise for recall, lower for latency
+IVF_RERANK_FACTOR = 4   # Candidates reranked exactly per requested result
 
 # --- API Keys ---
 # Ensure these are set in your .env file
@@ -0,0 +1,83 @@
+# web_policy.py
+
+# Decides how much web work a query gets after retrieval and routing:
+#   kb_only   - answer from the knowledge base alone (no Tavily / agent run)
+#   quick_web - the standard Tavily + YFinance agent
+#   deep      - DeepResearch (only when the user asked for it)
+# The decision uses the relevance grade, the real-time verdict, how strongly the
+# keyword and vector rankings agree on the retrieved chunks, and the latency
+# budget left for this request. Every decision carries the reasons behind it so
+# it can be logged and inspected.
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+KB_ONLY = "kb_only"
+QUICK_WEB = "quick_web"
+DEEP = "deep"
+
+
+@dataclass
+class WebPolicyConfig:
+    mode: str = "adaptive"                  # "adaptive", or "always_web" to search on every question
+    latency_budget_seconds: float = 240.0   # Per-request budget for the whole flow in this deployment
+    quick_web_expected_seconds: float = 10.0
+    deep_research_expected_seconds: float = 120.0
+    kb_min_agreeing_docs: int = 1           # Retrieved chunks found by both BM25 and vector search
+
+
+@dataclass
+class WebDecision:
+    mode: str
+    reasons: List[str] = field(default_factory=list)
+    signals: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def retrieval_signals(retrieved_docs: Optional[list]) -> Dict[str, Any]:
+    """Backend-independent strength signals from the retriever's metadata."""
+    docs = retrieved_docs or []
+    agreeing = [d for d in docs if "bm25_score" in d.metadata and "vector_distance" in d.metadata]
+    return {
+        "docs": len(docs),
+        "agreeing_docs": len(agreeing),
+        "top_rrf_score": max((d.metadata.get("rrf_score", 0.0) for d in docs), default=0.0),
+    }
+
+
+def decide_web_step(config: WebPolicyConfig, grade: int, needs_realtime: bool, retrieved_docs: Optional[list],
+                    deep_search: bool, elapsed_seconds: float = 0.0) -> WebDecision:
+    signals = retrieval_signals(retrieved_docs)
+    remaining = config.latency_budget_seconds - elapsed_seconds
+    signals.update(grade=grade, needs_realtime=needs_realtime, deep_search=deep_search,
+                   remaining_budget_seconds=round(remaining, 2))
+    reasons: List[str] = []
+
+    if deep_search:
+        if remaining >= config.deep_research_expected_seconds:
+            return WebDecision(DEEP, ["deep research requested"], signals)
+        reasons.append(f"deep research requested but ~{config.deep_research_expected_seconds:.0f}s "
+                       f"exceeds the {remaining:.0f}s left in the latency budget")
+        if remaining >= config.quick_web_expected_seconds:
+            return WebDecision(QUICK_WEB, reasons + ["falling back to quick web search"], signals)
+        return WebDecision(KB_ONLY, reasons + ["no budget left for web search"], signals)
+
+    if config.mode == "always_web":
+        return WebDecision(QUICK_WEB, ["policy mode always_web"], signals)
+
+    if needs_realtime:
+        reasons.append("question needs real-time data")
+    elif grade != 1:
+        reasons.append("knowledge base documents not relevant" if signals["docs"] else "no knowledge base documents")
+    elif signals["agreeing_docs"] < config.kb_min_agreeing_docs:
+        reasons.append(f"relevant but weakly supported retrieval ({signals['agreeing_docs']} chunk(s) found by "
+                       f"both keyword and vector search, need {config.kb_min_agreeing_docs})")
+    else:
+        return WebDecision(KB_ONLY, [f"knowledge base relevant with {signals['agreeing_docs']} chunk(s) found by "
+                                     f"both keyword and vector search, no real-time need"], signals)
+
+    if remaining < config.quick_web_expected_seconds:
+        return WebDecision(KB_ONLY, reasons + [f"only {remaining:.0f}s left in the latency budget, "
+                                               f"skipping web search"], signals)
+    return WebDecision(QUICK_WEB, reasons, signals)